@@ -1,9 +1,12 @@
 """
 Module for event route
 """
-from fastapi import APIRouter, Depends, status
+import time
+from fastapi import APIRouter, Depends, HTTPException, status
 
+from api_service.core.config import settings
 from api_service.services.auth import get_current_user
+from api_service.services.producer import SendQueueFull
 from api_service.core.utils import get_producer
 from api_service.schemas import (
     event,
@@ -15,6 +18,14 @@ router = APIRouter(
     tags=['Game Event']
 )
 
+def _queue_full(err: SendQueueFull):
+    """
+    Build the backpressure response returned when the send queue is full
+    """
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail=f"Event queue is full, retry later. {err}",
+                         headers={"Retry-After": str(settings.send_queue_retry_after)})
+
 # Need to create a default response model and a pydantic schema of what that post event looks like
 @router.post("", status_code=status.HTTP_201_CREATED)
 async def post_event(
@@ -25,9 +36,67 @@ async def post_event(
     """
     Post sports event payload
     """ 
+    ingested_at = time.time()
+    key = producer.key_event(event)
+    if producer.mode == "queue":
+        try:
+            producer.enqueue_message(key=key, value=event, ingested_at=ingested_at)
+        except SendQueueFull as err:
+            raise _queue_full(err)
+        return message.Message(message="Event has been queued.")
+
     await producer.produce_message(
-        key=f'event-key-{event.play_id}', #use the event id from the payload
-        value=event
+        key=key, # game_id by default, see EventPartitioner
+        value=event,
+        ingested_at=ingested_at
     )
 
     return message.Message(message="Event has been queued.") 
+
+@router.post("/batch", status_code=status.HTTP_201_CREATED, response_model=message.BatchMessage)
+async def post_event_batch(
+    events: list[event.GameEvent],
+    user = Depends(get_current_user),
+    producer = Depends(get_producer)
+    ):
+    """
+    Post a batch of sports event payloads. All events are sent to Kafka
+    together and the response reports the outcome of each event.
+    """
+    ingested_at = time.time()
+    if not events:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Batch must contain at least one event.")
+
+    if len(events) > settings.event_batch_max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Batch can contain at most {settings.event_batch_max_size} events.")
+
+    batch = [(producer.key_event(game_event), game_event) for game_event in events]
+
+    if producer.mode == "queue":
+        try:
+            producer.enqueue_batch(batch, ingested_at=ingested_at)
+        except SendQueueFull as err:
+            raise _queue_full(err)
+        delivery = [None] * len(batch)
+    else:
+        delivery = await producer.produce_batch(batch, ingested_at=ingested_at)
+
+    results = [
+        message.EventResult(
+            index=idx,
+            play_id=game_event.play_id,
+            status="failed" if isinstance(outcome, Exception) else "queued",
+            detail=str(outcome) if isinstance(outcome, Exception) else None
+        )
+        for idx, (game_event, outcome) in enumerate(zip(events, delivery))
+    ]
+    failed = sum(result.status == "failed" for result in results)
+
+    return message.BatchMessage(
+        message=f"{len(results) - failed} of {len(results)} events have been queued.",
+        accepted=len(results) - failed,
+        failed=failed,
+        results=results
+    )
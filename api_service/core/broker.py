@@ -0,0 +1,552 @@
+"""
+Module for the embedded (in-process) event broker.
+
+Replaces Kafka when the API and the consumer run in one process (EVENT_TRANSPORT=
+embedded): produced records are handed to the consumer through asyncio queues, and
+with the "object" codec the event dict itself is the record value, so nothing is
+serialized between the two. With a log directory every record is also appended to
+a local log per partition, and committed offsets are stored next to it, so a
+restart resumes from the last commit like a Kafka consumer group. The logs are
+split into segments, and segments every consumer group has committed past are
+deleted.
+
+Both services import this module (each image has its own copy, keep them
+identical). In a single process the runner creates one broker and hands it to both
+copies with set_broker. Services pick their clients with create_producer,
+create_sync_producer and create_consumer, the only places the transport is chosen.
+"""
+import os
+import json
+import time
+import zlib
+import base64
+import asyncio
+import itertools
+import threading
+import contextlib
+from collections import deque
+from datetime import datetime
+
+_TIMESTAMP_CREATE_TIME = 1 # confluent_kafka.TIMESTAMP_CREATE_TIME
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type {type(value).__name__} is not serializable")
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii") if data is not None else None
+
+def _unb64(data):
+    return base64.b64decode(data) if data is not None else None
+
+class Record:
+    """
+    One produced record. Quacks like a confluent_kafka Message, so the consumer
+    pipeline handles it like a polled Kafka message. Producers get it back as the
+    delivery result.
+    """
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers", "_timestamp")
+
+    def __init__(self, topic:str, partition:int, offset:int, key, value, headers, timestamp:int):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+        self._timestamp = timestamp # milliseconds since the epoch
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def timestamp(self):
+        return (_TIMESTAMP_CREATE_TIME, self._timestamp)
+
+    def error(self):
+        return None
+
+    def to_line(self) -> bytes:
+        """
+        Record as one line of the partition log
+        """
+        value = self._value
+        entry = {
+            "offset": self._offset,
+            "timestamp": self._timestamp,
+            "key": _b64(self._key),
+            "headers": [[name, _b64(data)] for name, data in self._headers or ()]
+        }
+        if isinstance(value, (bytes, bytearray)):
+            entry["value_bytes"] = _b64(bytes(value))
+        else:
+            entry["value"] = value
+        return json.dumps(entry, default=_default, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    @classmethod
+    def from_line(cls, topic:str, partition:int, line:bytes):
+        entry = json.loads(line)
+        value = _unb64(entry["value_bytes"]) if "value_bytes" in entry else entry.get("value")
+        return cls(topic, partition, entry["offset"], _unb64(entry["key"]), value,
+                   [(name, _unb64(data)) for name, data in entry["headers"]], entry["timestamp"])
+
+class Subscription:
+    """
+    Records of one topic for one consumer group. Records replayed from the log
+    (read lazily, one record at a time) are served before live ones.
+    """
+    def __init__(self, topic:str, group:str, maxsize:int, replay = ()):
+        self.topic = topic
+        self.group = group
+        self.replay = iter(replay)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def _replayed(self):
+        if self.replay is not None:
+            record = next(self.replay, None)
+            if record is not None:
+                return record
+            self.replay = None
+        return None
+
+    async def get(self):
+        record = self._replayed()
+        if record is not None:
+            return record
+        return await self.queue.get()
+
+    def get_nowait(self):
+        """
+        raises asyncio.QueueEmpty when nothing is waiting
+        """
+        record = self._replayed()
+        if record is not None:
+            return record
+        return self.queue.get_nowait()
+
+class EmbeddedBroker:
+    """
+    In-process broker with Kafka's delivery model: topics split into partitions by
+    key, per-partition offsets, and consumer groups that commit offsets.
+
+    Records are queued for every subscribed group. When a group's queue is full,
+    produce() waits (and produce_nowait() raises BufferError), which pushes back on
+    the API the way a full producer buffer does. Producers of a topic take turns:
+    a record is assigned its offset and queued in one step, in arrival order, so
+    a group always receives a partition's records in offset order. Records of topics nobody has
+    subscribed to yet are kept for the first subscriber, in the log or (up to
+    queue_size per topic, producing raises BufferError beyond that) in memory.
+
+    A partition log is a series of segment files of segment_size records, named
+    after the offset of their first record. Once every consumer group that uses a
+    topic has committed past a segment, the segment is deleted. A group that
+    stops consuming for good therefore keeps the log growing: remove it from
+    committed-offsets.json.
+    """
+    def __init__(
+            self,
+            partitions:int = 1,
+            log_dir:str = None,
+            queue_size:int = 10000,
+            fsync:bool = False,
+            segment_size:int = 100000
+            ):
+        """
+        Initialize broker
+
+        params:
+            - partitions (int): partitions per topic
+            - log_dir (str): directory of the append-only partition logs, None keeps records in memory only
+            - queue_size (int): records a consumer group can fall behind before producers wait
+            - fsync (bool): fsync the log after every record instead of leaving it to the OS
+            - segment_size (int): records per log segment, the unit of retention
+        """
+        self.partitions = partitions
+        self.log_dir = log_dir
+        self.queue_size = queue_size
+        self.fsync = fsync
+        self.segment_size = segment_size
+
+        self._next_offsets = {} # (topic, partition) -> next offset
+        self._round_robin = 0
+        self._subscriptions = {} # topic -> [Subscription]
+        self._backlog = {} # topic -> records produced before anyone subscribed
+        self._committed = {} # group -> {"topic/partition": next offset to read}
+        self._logs = {} # (topic, partition) -> open file of the last segment
+        self._segments = {} # (topic, partition) -> first offsets of the log segments, ascending
+        self._produce_locks = {} # topic -> asyncio.Lock, held from offset assignment until queued
+        self._lock = threading.Lock()
+
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._load()
+
+    def _log_path(self, topic:str, partition:int, base:int):
+        if base == 0 and os.path.exists(os.path.join(self.log_dir, f'{topic}-{partition}.log')):
+            return os.path.join(self.log_dir, f'{topic}-{partition}.log') # written before segments
+        return os.path.join(self.log_dir, f'{topic}-{partition}.{base:020d}.log')
+
+    def _offsets_path(self):
+        return os.path.join(self.log_dir, "committed-offsets.json")
+
+    @staticmethod
+    def _parse_log_name(name:str):
+        """
+        (topic, partition, first offset) of a segment file name
+        """
+        stem = name[:-len(".log")]
+        prefix, _, base = stem.rpartition(".")
+        if not (prefix and base.isdigit()):
+            prefix, base = stem, "0" # single log file written before segments
+        topic, _, partition = prefix.rpartition("-")
+        return topic, int(partition), int(base)
+
+    def _load(self):
+        """
+        Pick up the segments and offsets of an existing log directory. Only the last
+        segment of a partition is read.
+        """
+        if os.path.exists(self._offsets_path()):
+            with open(self._offsets_path()) as file:
+                self._committed = json.load(file)
+
+        for name in os.listdir(self.log_dir):
+            if name.endswith(".log"):
+                topic, partition, base = self._parse_log_name(name)
+                self._segments.setdefault((topic, partition), []).append(base)
+
+        for (topic, partition), bases in self._segments.items():
+            bases.sort()
+            path = self._log_path(topic, partition, bases[-1])
+            self._truncate_torn_write(path)
+            last = bases[-1] - 1
+            for record in self._read_segment(topic, partition, path):
+                last = record.offset()
+            self._next_offsets[(topic, partition)] = last + 1
+
+    @staticmethod
+    def _truncate_torn_write(path:str):
+        """
+        Drop a partially written last record (e.g. after a crash), so new records start on a fresh line
+        """
+        with open(path, "rb+") as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                file.truncate(data.rfind(b"\n") + 1)
+
+    @staticmethod
+    def _read_segment(topic:str, partition:int, path:str):
+        try:
+            with open(path, "rb") as file:
+                for line in file:
+                    yield Record.from_line(topic, partition, line)
+        except FileNotFoundError: # deleted by retention
+            return
+
+    def _read_log(self, topic:str, partition:int, start:int = 0, end:int = None):
+        """
+        Records from offset start up to (not including) end, read lazily from the
+        segments that hold them
+        """
+        bases = list(self._segments.get((topic, partition), ()))
+        first = max((idx for idx, base in enumerate(bases) if base <= start), default=0)
+        for base in bases[first:]:
+            if end is not None and base >= end:
+                return
+            for record in self._read_segment(topic, partition, self._log_path(topic, partition, base)):
+                if end is not None and record.offset() >= end:
+                    return
+                if record.offset() >= start:
+                    yield record
+
+    def _partition_for(self, key) -> int:
+        if key is None:
+            self._round_robin += 1
+            return self._round_robin % self.partitions
+        return zlib.crc32(key) % self.partitions
+
+    def _append(self, topic:str, key, value, headers, partition:int = None) -> Record:
+        with self._lock:
+            if partition is None:
+                partition = self._partition_for(key)
+            offset = self._next_offsets.get((topic, partition), 0)
+            self._next_offsets[(topic, partition)] = offset + 1
+            record = Record(topic, partition, offset, key, value, list(headers or ()), time.time_ns() // 1_000_000)
+
+            if self.log_dir:
+                log = self._segment_for(topic, partition, offset)
+                log.write(record.to_line())
+                log.flush()
+                if self.fsync:
+                    os.fsync(log.fileno())
+        return record
+
+    def _segment_for(self, topic:str, partition:int, offset:int):
+        """
+        Open file of the segment offset is appended to, rolling to a new segment
+        once the last one holds segment_size records
+        """
+        bases = self._segments.setdefault((topic, partition), [])
+        log = self._logs.get((topic, partition))
+        if bases and offset - bases[-1] < self.segment_size:
+            if log is None:
+                log = self._logs[(topic, partition)] = open(self._log_path(topic, partition, bases[-1]), "ab")
+            return log
+
+        if log is not None:
+            log.close()
+        bases.append(offset)
+        log = self._logs[(topic, partition)] = open(self._log_path(topic, partition, offset), "ab")
+        return log
+
+    def _retain(self, topic:str, partition:int):
+        """
+        Delete the segments of a partition every group using its topic has committed
+        past. The last segment is always kept. Called with self._lock held.
+        """
+        groups = [offsets for offsets in self._committed.values()
+                  if any(key.rpartition("/")[0] == topic for key in offsets)]
+        if not groups:
+            return
+        low = min(offsets.get(f'{topic}/{partition}', 0) for offsets in groups)
+
+        bases = self._segments.get((topic, partition), [])
+        while len(bases) > 1 and bases[1] <= low:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._log_path(topic, partition, bases[0]))
+            bases.pop(0)
+
+    def _backlog_for(self, topic:str):
+        """
+        In-memory backlog of a topic nobody subscribed to, raises BufferError when full
+        """
+        backlog = self._backlog.get(topic)
+        if backlog is None:
+            backlog = self._backlog[topic] = deque()
+        if len(backlog) >= self.queue_size:
+            raise BufferError(f"Embedded broker backlog for {topic} is full, nobody has subscribed to it")
+        return backlog
+
+    def _produce_lock(self, topic:str) -> asyncio.Lock:
+        lock = self._produce_locks.get(topic)
+        if lock is None:
+            lock = self._produce_locks[topic] = asyncio.Lock()
+        return lock
+
+    async def produce(self, topic:str, key = None, value = None, headers = None, partition:int = None) -> Record:
+        """
+        Append a record and queue it for every subscribed group, waiting while a group's queue is full
+        """
+        # Held while waiting for queue space, so a later record cannot be queued
+        # ahead of a lower offset (asyncio.Lock wakes waiters in FIFO order)
+        async with self._produce_lock(topic):
+            subscriptions = self._subscriptions.get(topic)
+            backlog = self._backlog_for(topic) if not subscriptions and not self.log_dir else None
+            record = self._append(topic, key, value, headers, partition)
+            if backlog is not None:
+                backlog.append(record)
+            for subscription in list(subscriptions or ()):
+                await subscription.queue.put(record)
+        return record
+
+    def produce_nowait(self, topic:str, key = None, value = None, headers = None, partition:int = None) -> Record:
+        """
+        Append a record without waiting. raises BufferError when a subscribed group's
+        queue is full or other producers of the topic are waiting for space
+        """
+        subscriptions = self._subscriptions.get(topic) or ()
+        if self._produce_lock(topic).locked() or any(subscription.queue.full() for subscription in subscriptions):
+            raise BufferError(f"Embedded broker queue for {topic} is full")
+
+        backlog = self._backlog_for(topic) if not subscriptions and not self.log_dir else None
+        record = self._append(topic, key, value, headers, partition)
+        if backlog is not None:
+            backlog.append(record)
+        for subscription in subscriptions:
+            subscription.queue.put_nowait(record)
+        return record
+
+    def subscribe(self, topic:str, group:str) -> Subscription:
+        """
+        Subscribe a consumer group to a topic. Logged records after the group's
+        committed offsets, and records produced before anyone subscribed, are
+        delivered first.
+        """
+        if self.log_dir:
+            with self._lock:
+                committed = self._committed.setdefault(group, {})
+                # Live records arrive through the queue, replay stops where it starts
+                ends = {partition: offset for (log_topic, partition), offset in self._next_offsets.items()
+                        if log_topic == topic}
+                for partition in ends:
+                    committed.setdefault(f'{topic}/{partition}', 0) # holds back retention until the group commits
+            replay = itertools.chain.from_iterable(
+                self._read_log(topic, partition, committed[f'{topic}/{partition}'], end)
+                for partition, end in sorted(ends.items())
+            )
+        else:
+            replay = self._backlog.pop(topic, ())
+
+        subscription = Subscription(topic, group, self.queue_size, replay)
+        self._subscriptions.setdefault(topic, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription:Subscription):
+        subscriptions = self._subscriptions.get(subscription.topic, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+
+    def commit(self, group:str, offsets:dict):
+        """
+        Store the next offset to read per partition for a group (thread safe)
+
+        params:
+            - offsets (dict): (topic, partition) -> next offset to read
+        """
+        with self._lock:
+            committed = self._committed.setdefault(group, {})
+            for (topic, partition), offset in offsets.items():
+                committed[f'{topic}/{partition}'] = offset
+
+            if self.log_dir:
+                path = self._offsets_path()
+                with open(path + ".tmp", "w") as file:
+                    json.dump(self._committed, file)
+                os.replace(path + ".tmp", path)
+                for topic, partition in offsets:
+                    self._retain(topic, partition)
+
+    def close(self):
+        with self._lock:
+            for log in self._logs.values():
+                log.close()
+            self._logs = {}
+
+class EmbeddedProducer:
+    """
+    Producer client for the embedded broker with the AIOKafkaProducer methods
+    ProducerService uses
+    """
+    def __init__(self, broker:EmbeddedBroker):
+        self.broker = broker
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def send(self, topic:str, key = None, value = None, headers = None, partition:int = None):
+        """
+        Append the record and return an already resolved delivery future
+        """
+        record = await self.broker.produce(topic, key, value, headers, partition)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(record)
+        return future
+
+    async def send_and_wait(self, topic:str, key = None, value = None, headers = None, partition:int = None):
+        return await self.broker.produce(topic, key, value, headers, partition)
+
+class EmbeddedSyncProducer:
+    """
+    Producer client for the embedded broker with the confluent_kafka Producer
+    methods the dead-letter publisher uses. Must be called on the event loop thread.
+    """
+    def __init__(self, broker:EmbeddedBroker):
+        self.broker = broker
+
+    def produce(self, topic:str, key = None, value = None, headers = None, on_delivery = None):
+        record = self.broker.produce_nowait(topic, key, value, headers)
+        if on_delivery is not None:
+            on_delivery(None, record)
+
+    def poll(self, timeout:float = 0):
+        return 0
+
+    def flush(self, timeout:float = None):
+        return 0
+
+_broker = None
+
+def get_broker(**kwargs) -> EmbeddedBroker:
+    """
+    Return the process-wide broker, created with kwargs (see EmbeddedBroker) on first use
+    """
+    global _broker
+    if _broker is None:
+        _broker = EmbeddedBroker(**kwargs)
+    return _broker
+
+def set_broker(broker:EmbeddedBroker):
+    """
+    Use broker as the process-wide broker (shares one broker between both services)
+    """
+    global _broker
+    _broker = broker
+
+def is_embedded(settings) -> bool:
+    """
+    Whether the service settings select the embedded broker (EVENT_TRANSPORT=embedded)
+    """
+    return settings.transport == "embedded"
+
+def _settings_broker(settings) -> EmbeddedBroker:
+    return get_broker(
+        partitions=settings.embedded_partitions,
+        log_dir=settings.embedded_log_dir,
+        queue_size=settings.embedded_queue_size,
+        segment_size=settings.embedded_segment_records
+    )
+
+def create_producer(settings, kafka):
+    """
+    Producer with the AIOKafkaProducer interface for the configured transport
+
+    params:
+        - settings (Settings): service settings (transport and embedded_*)
+        - kafka (callable): builds the Kafka producer, only called for the kafka transport
+    """
+    if is_embedded(settings):
+        return EmbeddedProducer(_settings_broker(settings))
+    return kafka()
+
+def create_sync_producer(settings, kafka):
+    """
+    Producer with the confluent_kafka Producer interface for the configured transport,
+    see create_producer
+    """
+    if is_embedded(settings):
+        return EmbeddedSyncProducer(_settings_broker(settings))
+    return kafka()
+
+def create_consumer(settings, kafka, embedded):
+    """
+    Consumer service for the configured transport
+
+    params:
+        - settings (Settings): service settings (transport and embedded_*)
+        - kafka (callable): builds the Kafka consumer service
+        - embedded (callable): builds the consumer service from the EmbeddedBroker
+    """
+    if is_embedded(settings):
+        return embedded(_settings_broker(settings))
+    return kafka()
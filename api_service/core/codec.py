@@ -0,0 +1,183 @@
+"""
+Module for GameEvent wire codecs.
+
+The producer (api_service) and the consumer (event_consumer) ship as separate
+images, so each has a copy of this module. Keep both copies identical: the
+codec used for a message is named in the Kafka header CODEC_HEADER and the
+consumer picks its decoder from that header, which lets the producer switch
+formats without downtime.
+"""
+import json
+import struct
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError: # fall back to the standard library
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODEC_HEADER = "event-codec"
+DEFAULT_CODEC = "json"
+# Tracing headers the API sets on every event: a random id and the time the API
+# received the event, in microseconds since the epoch
+TRACE_ID_HEADER = "trace-id"
+INGEST_TS_HEADER = "ingest-ts"
+
+_MICROSECOND = datetime.resolution
+
+def _default(value):
+    """
+    Serialize values the encoders do not handle natively
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type {type(value).__name__} is not serializable")
+
+class JsonCodec:
+    """
+    JSON encoding (orjson when it is installed)
+    """
+    name = "json"
+
+    def encode(self, event:dict) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(event, default=_default)
+        return json.dumps(event, default=_default, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data:bytes) -> dict:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+class MsgPackCodec:
+    """
+    MessagePack encoding
+    """
+    name = "msgpack"
+
+    def encode(self, event:dict) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        return msgpack.packb(event, default=_default, use_bin_type=True)
+
+    def decode(self, data:bytes) -> dict:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        return msgpack.unpackb(data, raw=False)
+
+class BinaryCodec:
+    """
+    Schema-versioned binary encoding of a GameEvent.
+
+    Layout (version 1, big endian):
+        - version (B)
+        - game_id (q), player_id (q)
+        - timestamp kind (B: 0 missing, 1 naive, 2 utc) and microseconds since epoch (q)
+        - play_id, event_type, event as a length (H, 0xFFFF for None) followed by utf-8 bytes
+    """
+    name = "binary"
+    version = 1
+
+    _header = struct.Struct(">BqqBq")
+    _length = struct.Struct(">H")
+    _none = 0xFFFF
+    _epoch_naive = datetime(1970, 1, 1)
+    _epoch_utc = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def encode(self, event:dict) -> bytes:
+        timestamp = event.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+
+        if timestamp is None:
+            kind, micros = 0, 0
+        elif timestamp.tzinfo is None:
+            kind, micros = 1, (timestamp - self._epoch_naive) // _MICROSECOND
+        else:
+            kind, micros = 2, (timestamp - self._epoch_utc) // _MICROSECOND
+
+        parts = [self._header.pack(self.version, int(event["game_id"]), int(event["player_id"]), kind, micros)]
+        for field in ("play_id", "event_type", "event"):
+            value = event.get(field)
+            if value is None:
+                parts.append(self._length.pack(self._none))
+            else:
+                encoded = str(value).encode("utf-8")
+                parts.append(self._length.pack(len(encoded)))
+                parts.append(encoded)
+
+        return b"".join(parts)
+
+    def decode(self, data:bytes) -> dict:
+        view = memoryview(data)
+        version, game_id, player_id, kind, micros = self._header.unpack_from(view, 0)
+        if version != self.version:
+            raise ValueError(f"Unsupported binary event version {version}")
+
+        if kind == 0:
+            timestamp = None
+        elif kind == 1:
+            timestamp = (self._epoch_naive + micros * _MICROSECOND).isoformat()
+        else:
+            timestamp = (self._epoch_utc + micros * _MICROSECOND).isoformat()
+
+        event = {"game_id": game_id, "player_id": player_id, "timestamp": timestamp}
+        offset = self._header.size
+        for field in ("play_id", "event_type", "event"):
+            (length,) = self._length.unpack_from(view, offset)
+            offset += self._length.size
+            if length == self._none:
+                event[field] = None
+            else:
+                event[field] = bytes(view[offset:offset + length]).decode("utf-8")
+                offset += length
+
+        return event
+
+class ObjectCodec:
+    """
+    No encoding: the event dict itself is the message value. Only usable with the
+    embedded broker, where producer and consumer share a process. Datetimes become
+    ISO strings like with the other codecs, so the stored documents are the same.
+    """
+    name = "object"
+
+    def encode(self, event:dict) -> dict:
+        return {field: value.isoformat() if isinstance(value, datetime) else value
+                for field, value in event.items()}
+
+    def decode(self, data:dict) -> dict:
+        # Copy, the consumer adds fields (e.g. _id) to the documents it stores
+        return dict(data)
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgPackCodec(), BinaryCodec(), ObjectCodec())}
+
+def get_codec(name:str):
+    """
+    Return the codec registered under name
+
+    params:
+        - name (str): codec name (json, msgpack, binary or object)
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown event codec '{name}'. Choose one of {sorted(CODECS)}")
+
+def codec_from_headers(headers):
+    """
+    Return the codec named in the Kafka message headers. Messages without
+    the header are treated as JSON.
+
+    params:
+        - headers (list): (key, value) header pairs, or None
+    """
+    for key, value in headers or ():
+        if key == CODEC_HEADER:
+            return get_codec(value.decode("utf-8") if isinstance(value, bytes) else value)
+    return CODECS[DEFAULT_CODEC]
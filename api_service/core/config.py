@@ -1,5 +1,5 @@
 import os
-from sqlalchemy.engine import URL
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class DatabaseConfig:
@@ -30,7 +30,10 @@ class DatabaseConfig:
         self.username = username
         self.password = password
 
-    def create_dsn(self):
+    def create_dsn(self, drivername:str = "mssql+pyodbc"):
+        # Imported here so importing the settings does not load SQLAlchemy
+        from sqlalchemy.engine import URL
+
         connection_string = (
             f'DRIVER={self.driver};'
             f'SERVER={self.server};'
@@ -40,35 +43,83 @@ class DatabaseConfig:
             'TrustServerCertificate=yes'
         )
 
-        connection_dsn = URL.create("mssql+pyodbc", 
+        connection_dsn = URL.create(drivername, 
                             query={"odbc_connect": connection_string})
         
         return connection_dsn
 
 class Settings(BaseSettings):
     # SQL env variables
-    database_driver: str = os.getenv('SQL_driver')
-    database_server: str = os.getenv('SQL_server')
-    database_name: str = os.getenv('SQL_database')
-    database_username: str = os.getenv('SQL_username')
-    database_password: str = os.getenv('SQL_password')
+    database_driver: Optional[str] = os.getenv('SQL_driver')
+    database_server: Optional[str] = os.getenv('SQL_server')
+    database_name: Optional[str] = os.getenv('SQL_database')
+    database_username: Optional[str] = os.getenv('SQL_username')
+    database_password: Optional[str] = os.getenv('SQL_password')
+    sql_pool_size: int = os.getenv('SQL_POOL_SIZE', 10)
+    sql_max_overflow: int = os.getenv('SQL_MAX_OVERFLOW', 20)
+    sql_pool_timeout: float = os.getenv('SQL_POOL_TIMEOUT', 30) # seconds to wait for a connection
+    sql_pool_pre_ping: bool = os.getenv('SQL_POOL_PRE_PING', True)
+    sql_pool_recycle: int = os.getenv('SQL_POOL_RECYCLE', 1800) # seconds before a connection is replaced
+    sql_warmup_connections: int = os.getenv('SQL_WARMUP_CONNECTIONS', 2) # connections opened on startup, 0 skips the warm-up
 
     # Authentication env variables
-    secret_key: str = os.getenv("JWT_SECRET_KEY") # Need to create a new secret key for this application
-    algorithm: str = os.getenv("JWT_ALGORITHM")
-    access_token_expire_minutes: int = os.getenv("JWT_EXPIRE_MINUTES")
-    token_type: str = os.getenv("JWT_TOKEN_TYPE")
+    secret_key: Optional[str] = os.getenv("JWT_SECRET_KEY") # Need to create a new secret key for this application
+    algorithm: Optional[str] = os.getenv("JWT_ALGORITHM")
+    access_token_expire_minutes: Optional[int] = os.getenv("JWT_EXPIRE_MINUTES")
+    token_type: Optional[str] = os.getenv("JWT_TOKEN_TYPE")
+    token_cache_size: int = os.getenv("JWT_CACHE_SIZE", 10000) # 0 disables the verified-token cache
+    token_cache_ttl_seconds: float = os.getenv("JWT_CACHE_TTL_SECONDS", 300)
+    user_cache_size: int = os.getenv("USER_CACHE_SIZE", 10000) # 0 disables the user lookup cache
+    user_cache_ttl_seconds: float = os.getenv("USER_CACHE_TTL_SECONDS", 60)
+    user_cache_negative_ttl_seconds: float = os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", 10)
+
+    # Password hashing env variables
+    bcrypt_workers: int = os.getenv("BCRYPT_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+    bcrypt_calibrate: bool = os.getenv("BCRYPT_CALIBRATE", True) # pick the cost factor on startup
+    bcrypt_target_ms: float = os.getenv("BCRYPT_TARGET_MS", 250)
+    bcrypt_min_rounds: int = os.getenv("BCRYPT_MIN_ROUNDS", 12)
+    bcrypt_max_rounds: int = os.getenv("BCRYPT_MAX_ROUNDS", 15)
 
     # Kafka env variables 
-    bootstrap_server: str = os.getenv("KAFKA_SERVERS")
-    topic: str = os.getenv("KAFKA_TOPIC")
+    transport: str = os.getenv("EVENT_TRANSPORT", "kafka") # kafka or embedded (in-process broker, single process only)
+    embedded_partitions: int = os.getenv("EMBEDDED_PARTITIONS", 4)
+    embedded_log_dir: Optional[str] = os.getenv("EMBEDDED_LOG_DIR") # append-only log directory, unset keeps records in memory
+    embedded_queue_size: int = os.getenv("EMBEDDED_QUEUE_SIZE", 10000) # records the consumer can fall behind
+    embedded_segment_records: int = os.getenv("EMBEDDED_SEGMENT_RECORDS", 100000) # records per log segment, segments every group committed past are deleted
+    bootstrap_server: Optional[str] = os.getenv("KAFKA_SERVERS")
+    topic: Optional[str] = os.getenv("KAFKA_TOPIC")
+    producer_mode: str = os.getenv("KAFKA_PRODUCER_MODE", "sync") # sync or queue
+    event_codec: str = os.getenv("EVENT_CODEC", "json") # json, msgpack or binary
+    send_queue_size: int = os.getenv("KAFKA_SEND_QUEUE_SIZE", 10000)
+    send_queue_workers: int = os.getenv("KAFKA_SEND_QUEUE_WORKERS", 2)
+    send_queue_batch_size: int = os.getenv("KAFKA_SEND_QUEUE_BATCH_SIZE", 500)
+    send_queue_retry_after: int = os.getenv("KAFKA_SEND_QUEUE_RETRY_AFTER", 1) # seconds
+    send_queue_drain_timeout: float = os.getenv("KAFKA_SEND_QUEUE_DRAIN_TIMEOUT", 5.0) # seconds
+    producer_acks: str = os.getenv("KAFKA_PRODUCER_ACKS", "1") # 0, 1 or all
+    producer_linger_ms: int = os.getenv("KAFKA_PRODUCER_LINGER_MS", 0) # aiokafka client linger
+    producer_max_batch_bytes: int = os.getenv("KAFKA_PRODUCER_MAX_BATCH_BYTES", 16384) # aiokafka client batch per partition
+    producer_compression: str = os.getenv("KAFKA_PRODUCER_COMPRESSION", "auto") # none, gzip, snappy, lz4, zstd or auto (lz4 or zstd, measured on startup)
+    producer_adaptive: bool = os.getenv("KAFKA_PRODUCER_ADAPTIVE", True) # tune send queue linger and batch size at runtime (queue mode)
+    producer_target_p99_ms: float = os.getenv("KAFKA_PRODUCER_TARGET_P99_MS", 50)
+    producer_max_queue_linger_ms: float = os.getenv("KAFKA_PRODUCER_MAX_QUEUE_LINGER_MS", 20)
+    producer_min_queue_batch_size: int = os.getenv("KAFKA_PRODUCER_MIN_QUEUE_BATCH_SIZE", 50) # send_queue_batch_size is the maximum
+    producer_adapt_interval: float = os.getenv("KAFKA_PRODUCER_ADAPT_INTERVAL", 5.0) # seconds
+    partition_strategy: str = os.getenv("KAFKA_PARTITION_STRATEGY", "game") # game (one partition per game) or play
+
+    # Event ingestion env variables
+    event_batch_max_size: int = os.getenv("EVENT_BATCH_MAX_SIZE", 500)
 
-    mssql_dsn: DatabaseConfig = DatabaseConfig(
-        driver=database_driver,
-        server=database_server,
-        name=database_name,
-        username=database_username,
-        password=database_password
-    )
+    @property
+    def mssql_dsn(self) -> DatabaseConfig:
+        """
+        Connection settings, built when the engine is created rather than on import
+        """
+        return DatabaseConfig(
+            driver=self.database_driver,
+            server=self.database_server,
+            name=self.database_name,
+            username=self.database_username,
+            password=self.database_password
+        )
 
 settings = Settings()
@@ -0,0 +1,248 @@
+"""
+Module for in-process metrics exposed in the Prometheus text format
+"""
+import math
+import time
+import threading
+from bisect import bisect_left
+
+# Latency buckets in seconds, from 0.1ms to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Batch size buckets in messages
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def _format_value(value:float) -> str:
+    if value != value:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names:tuple, values:tuple, extra:str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    """
+    A named metric, optionally split by labels. Children (one per label value
+    combination) are created on first use and cached, so recording a value is a
+    dictionary lookup and a locked update.
+    """
+    kind = None
+    suffix = "" # appended to the name of the samples and of the HELP/TYPE family
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple = (), registry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """
+        Child metric for one combination of label values
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        # Text format 0.0.4 needs the family named like its samples (a counter's x_total)
+        family = self.name + self.suffix
+        lines = [f'# HELP {family} {self.documentation}', f'# TYPE {family} {self.kind}']
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(family, self.labelnames, values))
+        return lines
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount:float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{_labels(labelnames, values)} {_format_value(self.value)}']
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, exposed as <name>_total
+    """
+    kind = "counter"
+    suffix = "_total"
+
+    def _child(self):
+        return _CounterChild()
+
+    def inc(self, amount:float = 1):
+        self._default().inc(amount)
+
+class _GaugeChild:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value:float):
+        self.value = value
+
+    def inc(self, amount:float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount:float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """
+        Read the value from function whenever the metrics are collected
+        """
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = math.nan
+        return [f'{name}{_labels(labelnames, values)} {_format_value(value)}']
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down
+    """
+    kind = "gauge"
+
+    def _child(self):
+        return _GaugeChild()
+
+    def set(self, value:float):
+        self._default().set(value)
+
+    def inc(self, amount:float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount:float = 1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets:tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value:float):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """
+        Context manager that observes the time spent inside it
+        """
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f'{name}_bucket{_labels(labelnames, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labelnames, values)} {_format_value(total)}')
+        lines.append(f'{name}_count{_labels(labelnames, values)} {count}')
+        return lines
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple = (),
+                 buckets:tuple = LATENCY_BUCKETS, registry = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value:float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+class Registry:
+    """
+    Collection of metrics rendered together by the /metrics route
+    """
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric:_Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,107 @@
+"""
+Module for SQL Server database sessions
+"""
+import time
+import asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from api_service.core.config import settings
+
+class PoolStats:
+    """
+    Connection pool checkout statistics
+    """
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds:float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self, engine):
+        """
+        Current pool usage and checkout wait times (milliseconds)
+        """
+        pool = engine.pool if engine is not None else None
+        return {
+            "pool_size": pool.size() if pool else 0,
+            "in_use": pool.checkedout() if pool else 0,
+            "overflow": pool.overflow() if pool else 0,
+            "checkouts": self.checkouts,
+            "checkout_wait_avg_ms": (self.wait_total / self.checkouts * 1000) if self.checkouts else 0.0,
+            "checkout_wait_max_ms": self.wait_max * 1000
+        }
+
+pool_stats = PoolStats()
+
+# The engine is created on first use so importing this module never opens connections
+_engine = None
+_session_factory = None
+
+def get_engine():
+    """
+    Return the async SQL Server engine, creating it on first call
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        _engine = create_async_engine(
+            settings.mssql_dsn.create_dsn(drivername="mssql+aioodbc"),
+            pool_size=settings.sql_pool_size,
+            max_overflow=settings.sql_max_overflow,
+            pool_timeout=settings.sql_pool_timeout,
+            pool_pre_ping=settings.sql_pool_pre_ping,
+            pool_recycle=settings.sql_pool_recycle
+        )
+        _session_factory = async_sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False)
+    return _engine
+
+async def warm_up(connections:int):
+    """
+    Open connections concurrently so the first requests do not pay for the
+    connect and login. They go back to the pool, which keeps up to pool_size open.
+
+    params:
+        - connections (int): number of connections to open, capped at the pool size
+    """
+    engine = get_engine()
+
+    async def open_one():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(open_one() for _ in range(min(connections, settings.sql_pool_size))))
+
+async def dispose_engine():
+    """
+    Close every pooled connection
+    """
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+def get_pool_stats():
+    return pool_stats.snapshot(_engine.sync_engine if _engine is not None else None)
+
+async def get_mssql_connection():
+    """
+    Create SQL Server Database Session
+    """
+    get_engine()
+    async with _session_factory() as session:
+        try:
+            # Check the connection out now so the time spent waiting on the pool is measured
+            start = time.perf_counter()
+            await session.connection()
+            pool_stats.record_wait(time.perf_counter() - start)
+
+            yield session
+        except Exception: # Might be good to name all the sessions
+            await session.rollback()
+            raise
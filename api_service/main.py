@@ -1,29 +1,67 @@
 """
 Application server file (main.py)
 """
-from fastapi import FastAPI
+import time
+import asyncio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 
 from api_service.api import auth
+from api_service.core.config import settings
+from api_service.core.metrics import CONTENT_TYPE, REGISTRY, Gauge, Histogram
+from api_service.core.mssql_session import dispose_engine, get_pool_stats, warm_up
 from api_service.api import event
+from api_service.services.hashing import password_hasher
 from api_service.services.producer import ProducerService
 
+REQUEST_SECONDS = Histogram("api_http_request_duration_seconds",
+                            "HTTP request latency by method, route and status code",
+                            ("method", "route", "status"))
+STARTUP_SECONDS = Gauge("api_startup_seconds", "Time the lifespan startup took until the app was ready")
+
+async def _warm_up_database():
+    """
+    Open the first SQL Server connections. Not fatal: requests connect on demand if it fails
+    """
+    if settings.sql_warmup_connections <= 0:
+        return False
+    try:
+        await warm_up(settings.sql_warmup_connections)
+        return True
+    except Exception as err:
+        print('Issue warming up SQL Server connections: ', err)
+        return False
+
 # Define lifespan to start the service for Kafka Message Queue
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    On application startup/stop: open or close Kakfa connection
+    On application startup/stop: open or close Kakfa connection and the password hashing pool.
+    Kafka, the hashing pool and the SQL Server connections are started concurrently.
     """
+    start = time.perf_counter()
+    app.state.ready = False
     app.state.producer = ProducerService()
-    await app.state.producer.start()
+    _, _, app.state.database_warm = await asyncio.gather(
+        password_hasher.start(calibrate=settings.bcrypt_calibrate),
+        app.state.producer.start(),
+        _warm_up_database()
+    )
+    app.state.ready = True
+    STARTUP_SECONDS.set(time.perf_counter() - start)
+    print(f'Ready after {time.perf_counter() - start:.3f}s')
     try:
         yield
     except Exception as err:
         print('Issue with Kafka producer service: ', err)
     finally:
+        app.state.ready = False # stop receiving traffic before the connections close
         await app.state.producer.stop()
         del app.state.producer
+        await password_hasher.stop()
+        await dispose_engine()
 
 app = FastAPI(title="Sports Event Microservice",
               lifespan=lifespan)
@@ -37,6 +75,26 @@ app.add_middleware(
     allow_headers=["Authorization"]
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """
+    Observe the latency of every request under its route template, so path
+    parameters do not create a new series per value
+    """
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(
+            request.method,
+            route.path if route is not None else "unmatched",
+            str(status_code)
+        ).observe(time.perf_counter() - start)
+
 app.include_router(auth.router)
 app.include_router(event.router)
 
@@ -51,6 +109,38 @@ def root():
 @app.get("/health", include_in_schema=False)
 def health_check():
     """
-    Application health check route
+    Liveness: the process is up and serving. Does not check any dependency, so a
+    slow broker or database never gets the process restarted.
     """
     return {"status": "ok"}
+
+@app.get("/ready", include_in_schema=False)
+def readiness_check():
+    """
+    Readiness: startup finished and the Kafka producer is running. 503 otherwise,
+    including while shutting down, so no traffic is routed here.
+    """
+    producer = getattr(app.state, "producer", None)
+    ready = getattr(app.state, "ready", False) and producer is not None and producer.started
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not ready",
+            "producer_started": bool(producer and producer.started),
+            "database_warm": getattr(app.state, "database_warm", False)
+        }
+    )
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Metrics in the Prometheus text format
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/health/db", include_in_schema=False)
+def database_pool_stats():
+    """
+    SQL Server connection pool usage and checkout wait times
+    """
+    return get_pool_stats()
@@ -2,6 +2,7 @@
 Module for event schema.
 """
 from datetime import datetime
+from uuid import uuid4
 from pydantic import BaseModel, Field
 from typing import Optional, Annotated
 
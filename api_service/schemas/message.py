@@ -1,7 +1,19 @@
 """
 Module for API response schema.
 """
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
 
 class Message(BaseModel):
     message:str
+
+class EventResult(BaseModel):
+    index:int = Field(description="Position of the event in the submitted batch")
+    play_id:Optional[str] = Field(default=None, description="Play Id of the event")
+    status:str = Field(description="Delivery status (queued or failed)")
+    detail:Optional[str] = Field(default=None, description="Failure reason when the event was not queued")
+
+class BatchMessage(Message):
+    accepted:int
+    failed:int
+    results:list[EventResult]
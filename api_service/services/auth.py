@@ -1,20 +1,31 @@
+import time
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from pydantic import EmailStr
 from sqlmodel import select
 
+from api_service.core.cache import TTLCache
 from api_service.core.config import settings
+from api_service.core.metrics import Histogram
 from api_service.models.user import Users
 from api_service.schemas.auth import Token, TokenVal
 from api_service.schemas.user import User, UserSchema
 from api_service.services.base import SessionBase, DataManager
+from api_service.services.hashing import password_hasher
 
 # Set the auth barer
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified access tokens, so repeat requests with the same token skip jwt.decode
+token_cache = TTLCache(maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl_seconds)
+# Users looked up by email on login. Each worker process has its own cache, so the ttl
+# bounds how long a change made through another worker can go unseen
+user_cache = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl_seconds)
+_UNKNOWN_USER = object()
+JWT_VERIFY_SECONDS = Histogram("api_jwt_verify_seconds",
+                               "Time to verify an access token, by token cache result",
+                               ("cache",))
 
 def get_current_user(token_str: str = Depends(oauth_scheme)):
     """
@@ -32,17 +43,17 @@ def get_current_user(token_str: str = Depends(oauth_scheme)):
 # Create a class for the password
 class AuthUtils:
     @staticmethod
-    def get_password_hash(password:str):
+    async def get_password_hash(password:str):
         """
         Hash password provided in auth/token route
 
         params:
             - password (str): password provided in request body
         """
-        return pwd_context.hash(password)
+        return await password_hasher.hash(password)
     
     @staticmethod
-    def verify_password(plain_password:str, hashed_password:str):
+    async def verify_password(plain_password:str, hashed_password:str):
         """
         Verify password signature
 
@@ -50,7 +61,22 @@ class AuthUtils:
             - plain_password (str): password string - hashed in database
             - hashed_password (str): hashed password from database
         """
-        return pwd_context.verify(plain_password, hashed_password)
+        valid, _ = await password_hasher.verify_and_update(plain_password, hashed_password)
+        return valid
+
+    @staticmethod
+    async def verify_and_update_password(plain_password:str, hashed_password:str):
+        """
+        Verify password signature and return a new hash when the stored one
+        uses an outdated bcrypt cost factor
+
+        params:
+            - plain_password (str): password string - hashed in database
+            - hashed_password (str): hashed password from database
+
+        Returns (valid, new_hash), new_hash is None when no rehash is needed
+        """
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
     
     @staticmethod
     def verify_access_token(
@@ -59,19 +85,29 @@ class AuthUtils:
         ):
         """
         Verify authentication (JWT) token. Using this method to ensure the token has not expired.
+        Verified tokens are cached until the earlier of their exp claim and the cache ttl.
         """
-        credential_err = kwargs.get('expection')
+        credential_err = kwargs.get('exception')
+        start = time.perf_counter()
+
+        # A cache hit means the token was already verified and has not expired
+        token_data = token_cache.get(token)
+        if token_data is not None:
+            JWT_VERIFY_SECONDS.labels("hit").observe(time.perf_counter() - start)
+            return token_data
+
         try:
             # First decode the payload
             decoded = jwt.decode(token, settings.secret_key, algorithms=settings.algorithm)
 
             id: str = decoded.get("id") # get the id or username from jwt payload
-            exp: datetime = decoded.get("exp")
-            if not id:
+            exp: int = decoded.get("exp")
+            if not id or exp is None:
                 raise credential_err
             
             # check to ensure the expire time is still valid
-            if datetime.fromtimestamp(exp) < datetime.utcnow() is True:
+            expires_in = (datetime.fromtimestamp(exp, tz=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+            if expires_in <= 0:
                 raise credential_err
             
             # eventually add a pydantic model below
@@ -79,7 +115,11 @@ class AuthUtils:
 
         except JWTError:
             raise credential_err
+        finally:
+            JWT_VERIFY_SECONDS.labels("miss").observe(time.perf_counter() - start)
         
+        # Never keep a token in the cache past its own expiry
+        token_cache.set(token, token_data, ttl=expires_in)
         return token_data
     
 class Authentication(AuthUtils, SessionBase):
@@ -88,7 +128,7 @@ class Authentication(AuthUtils, SessionBase):
     a users token for API access
     """
     # authenticate and create jwt token
-    def authenticate(
+    async def authenticate(
             self,
             login: OAuth2PasswordRequestForm = Depends()
     ):
@@ -97,21 +137,27 @@ class Authentication(AuthUtils, SessionBase):
         the application database (company internal records)
         """
         # Return user information bassed on the email
-        user_info = AuthDataService(self.session).get_user(login.username)
+        data_service = AuthDataService(self.session)
+        user_info = await data_service.get_user(login.username)
 
         if not login.password:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Invalid credentials")
         
-        if self.verify_password(login.password, user_info.password):
+        valid, new_hash = await self.verify_and_update_password(login.password, user_info.password)
+        if not valid:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Invalid credentials")
 
+        # Stored hash used an older cost factor - replace it while we have the plain password
+        if new_hash:
+            await data_service.update_password(user_info.id, new_hash)
+
         access_token = self._create_access_token(user_info.id, user_info.email)
         return Token(access_token=access_token, token_type=settings.token_type)
         
     # Create new user method
-    def create_new_user(
+    async def create_new_user(
             self, 
             user: User,
             response:bool = False
@@ -129,10 +175,10 @@ class Authentication(AuthUtils, SessionBase):
         
         user_res = Users(
             email=user.email,
-            password=self.get_password_hash(user.password)
+            password=await self.get_password_hash(user.password)
         )
 
-        res_return = AuthDataService(self.session).add_user(user_res, response=response)
+        res_return = await AuthDataService(self.session).add_user(user_res, response=response)
         return res_return
 
     def _create_access_token(
@@ -167,31 +213,61 @@ class Authentication(AuthUtils, SessionBase):
 class AuthDataService(DataManager):
     """
     Class to handle database operations related to
-    the user
+    the user. User lookups are read through user_cache, so the cache entry
+    must be invalidated whenever a user row is written.
     """
-    def add_user(self, user: User, response:bool = True):
-        res_dict = self.add_one(user, response=response)
+    @staticmethod
+    def _cache_key(email: str):
+        return email.lower()
+
+    async def add_user(self, user: User, response:bool = True):
+        res_dict = await self.add_one(user, response=response)
+        # Drop a cached "unknown email" entry once the account is committed. Dropped
+        # any earlier, a concurrent lookup could cache the miss again before the commit
+        user_cache.pop(self._cache_key(user.email))
 
         if res_dict is True:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                                 detail="User account already exists. Please use different email or login")
         
         return res_dict
+
+    async def update_password(self, user_id: int, hashed_password: str):
+        """
+        Replace the stored password hash for a user
+        """
+        sql_model = await self.session.get(Users, user_id)
+        if sql_model:
+            sql_model.password = hashed_password
+            await self.add_one(sql_model)
+            user_cache.pop(self._cache_key(sql_model.email))
     
-    def get_user(self, username: EmailStr) -> UserSchema:
-        sql_model = self.get_one(
-            select(Users).where(Users.email == username)
-        )
+    async def get_user(self, username: EmailStr) -> UserSchema:
+        cache_key = self._cache_key(username)
+        user_info = user_cache.get(cache_key)
+
+        if user_info is None:
+            sql_model = await self.get_one(
+                select(Users).where(Users.email == username)
+            )
+
+            if sql_model:
+                user_info = UserSchema(
+                    id=sql_model.id,
+                    email=sql_model.email,
+                    password = sql_model.password,
+                    last_updated=sql_model.last_updated
+                )
+                user_cache.set(cache_key, user_info)
+            else:
+                # Negative entry so repeated attempts for unknown emails skip the database
+                user_info = _UNKNOWN_USER
+                user_cache.set(cache_key, user_info, ttl=settings.user_cache_negative_ttl_seconds)
         
-        if not sql_model:
+        if user_info is _UNKNOWN_USER:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Invalid credentials"
             )
         
-        return UserSchema(
-            id=sql_model.id,
-            email=sql_model.email,
-            password = sql_model.password,
-            last_updated=sql_model.last_updated
-        )
+        return user_info
@@ -1,14 +1,14 @@
 """
 Module for base instances of util classes
 """
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 class SessionBase:
     """
     Initializing database session
     """
-    def __init__(self, session: Session):
+    def __init__(self, session: AsyncSession):
         self.session = session
 
 # A class that does select one, add a row, etc
@@ -16,17 +16,18 @@ class DataManager(SessionBase):
     """
     Class responsible for database operations
     """
-    def add_one(self, model, response:bool = False):
+    async def add_one(self, model, response:bool = False):
         try:
             self.session.add(model)
-            self.session.commit()
+            await self.session.commit()
         except IntegrityError:
-            self.session.rollback()
+            await self.session.rollback()
             return True
         
         if response is True:
-            self.session.refresh(model)
+            await self.session.refresh(model)
             return model
 
-    def get_one(self, sql_stmt):
-        return self.session.exec(sql_stmt).first()
+    async def get_one(self, sql_stmt):
+        result = await self.session.exec(sql_stmt)
+        return result.first()
@@ -0,0 +1,119 @@
+"""
+Module for password hashing service
+"""
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+
+from api_service.core.config import settings
+from api_service.core.metrics import Histogram
+
+BCRYPT_SECONDS = Histogram("api_bcrypt_seconds",
+                           "Time to hash or verify a password, including the wait for a hashing thread",
+                           ("operation",))
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, size-limited thread pool so hashing never runs on the
+    event loop or the shared request threadpool. bcrypt releases the GIL, so
+    throughput scales with the number of workers up to the number of cores.
+    """
+    def __init__(
+            self,
+            max_workers:int,
+            target_ms:float,
+            min_rounds:int,
+            max_rounds:int
+            ):
+        """
+        Initialize password hasher
+
+        params:
+            - max_workers (int): number of hashing threads
+            - target_ms (float): target time per hash used by calibrate
+            - min_rounds (int): lowest bcrypt cost factor allowed
+            - max_rounds (int): highest bcrypt cost factor allowed
+        """
+        self.max_workers = max_workers
+        self.target_ms = target_ms
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+
+        self.rounds = min_rounds
+        self._context = self._create_context(self.rounds)
+        self._executor = None
+
+    @staticmethod
+    def _create_context(rounds:int):
+        """
+        Hashes with a lower cost than rounds are reported as needing an update,
+        which is what triggers the transparent rehash on login.
+        """
+        return CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds
+        )
+
+    def calibrate(self):
+        """
+        Pick the bcrypt cost factor whose hash time is closest to (but not above)
+        target_ms on this machine. Each extra round doubles the cost, so a single
+        measurement at min_rounds is enough to extrapolate.
+        """
+        probe = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=self.min_rounds)
+
+        elapsed_ms = math.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            probe.hash("calibration-password")
+            elapsed_ms = min(elapsed_ms, (time.perf_counter() - start) * 1000)
+
+        extra_rounds = int(math.log2(self.target_ms / elapsed_ms)) if elapsed_ms < self.target_ms else 0
+        return max(self.min_rounds, min(self.max_rounds, self.min_rounds + extra_rounds))
+
+    async def start(self, calibrate:bool = True):
+        """
+        Create the hashing thread pool and calibrate the cost factor
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="bcrypt")
+        if calibrate:
+            self.rounds = await self._run(self.calibrate)
+            self._context = self._create_context(self.rounds)
+            print(f'Using bcrypt cost factor {self.rounds} (target {self.target_ms}ms per hash)')
+
+    async def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def hash(self, password:str):
+        """
+        Hash password with the calibrated cost factor
+        """
+        with BCRYPT_SECONDS.labels("hash").time():
+            return await self._run(self._context.hash, password)
+
+    async def verify_and_update(self, plain_password:str, hashed_password:str):
+        """
+        Verify password against hash.
+
+        Returns (valid, new_hash). new_hash is set when the stored hash uses an older
+        cost factor and should be replaced.
+        """
+        with BCRYPT_SECONDS.labels("verify").time():
+            return await self._run(self._context.verify_and_update, plain_password, hashed_password)
+
+password_hasher = PasswordHasher(
+    max_workers=settings.bcrypt_workers,
+    target_ms=settings.bcrypt_target_ms,
+    min_rounds=settings.bcrypt_min_rounds,
+    max_rounds=settings.bcrypt_max_rounds
+)
@@ -0,0 +1,36 @@
+"""
+Module for choosing the Kafka message key of an event
+"""
+STRATEGIES = ("game", "play")
+
+class EventPartitioner:
+    """
+    Picks the Kafka key, and therefore the partition, of every event.
+
+    With the "game" strategy (default) the key is the game_id: all events of a game
+    land on one partition, in the order they were produced, so a single consumer
+    sees the whole game and can keep per-game state (lanes, game state, dedup)
+    locally without coordinating with other consumers. "play" keys by play_id and
+    spreads a game over every partition.
+    """
+    def __init__(self, strategy:str = "game"):
+        """
+        Initialize partitioner
+
+        params:
+            - strategy (str): "game" or "play"
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown partition strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+        self.strategy = strategy
+
+    def assign(self, event) -> str:
+        """
+        Key for one event
+
+        params:
+            - event (GameEvent): event to be produced
+        """
+        if self.strategy == "play":
+            return f'event-key-{event.play_id}'
+        return f'game-key-{event.game_id}'
@@ -1,34 +1,107 @@
 """
 Module for Apache Kafka Producer Service
 """
-import json
-import logging
+import time
 import asyncio
+from uuid import uuid4
 from aiokafka import AIOKafkaProducer
+from aiokafka.errors import KafkaError
 
+from api_service.core.broker import create_producer, is_embedded
+from api_service.core.codec import CODEC_HEADER, INGEST_TS_HEADER, TRACE_ID_HEADER, get_codec
 from api_service.core.config import settings
+from api_service.core.metrics import Counter, Gauge, Histogram
+from api_service.schemas.event import GameEvent
+from api_service.services.partitioner import EventPartitioner
+from api_service.services.tuning import BatchController, choose_compression, sample_batch
+
+PRODUCE_SECONDS = Histogram("api_kafka_produce_seconds",
+                            "Time until the broker acknowledged a message (single) or a whole batch (batch)",
+                            ("mode",))
+KAFKA_MESSAGES = Counter("api_kafka_messages", "Messages handed to the producer by outcome", ("outcome",))
+SEND_QUEUE_DEPTH = Gauge("api_send_queue_depth", "Messages waiting on the in-process send queue")
+
+class SendQueueFull(Exception):
+    """
+    Raised when the in-process send queue cannot take more messages
+    """
 
 class ProducerService:
     def __init__(self):
         self.topic = settings.topic
-        # Set the producer a async start and stop heres
-        self._producer = self._create_producer()
+        # The embedded broker hands the event dict itself to the consumer
+        self.codec = get_codec("object" if is_embedded(settings) else settings.event_codec)
+        self._headers = [(CODEC_HEADER, self.codec.name.encode('utf-8'))]
+        # The client is created by start(), so building the service opens nothing
+        self._producer = None
         self.started = False
+        self.partitioner = EventPartitioner(strategy=settings.partition_strategy)
+
+        # "sync" waits for the broker ack per request, "queue" enqueues and returns
+        self.mode = settings.producer_mode
+        self._queue = None
+        self._workers = []
+        self._delivery_callbacks = []
+        self.batching = BatchController(
+            target_p99=settings.producer_target_p99_ms / 1000,
+            min_batch_size=settings.producer_min_queue_batch_size,
+            max_batch_size=settings.send_queue_batch_size,
+            max_linger=settings.producer_max_queue_linger_ms / 1000,
+            interval=settings.producer_adapt_interval,
+            adaptive=settings.producer_adaptive
+        )
+        self.counters = {"enqueued": 0, "delivered": 0, "failed": 0, "rejected": 0}
 
     def _create_producer(self):
+        return create_producer(settings, kafka=self._create_kafka_producer)
+
+    def _create_kafka_producer(self):
+        example = GameEvent.model_config["json_schema_extra"]["examples"][0]
+        compression = choose_compression(
+            settings.producer_compression,
+            sample_batch(self.codec, example, settings.send_queue_batch_size),
+            settings.producer_target_p99_ms / 1000
+        )
         return AIOKafkaProducer(
-            bootstrap_servers=settings.bootstrap_server
+            bootstrap_servers=settings.bootstrap_server,
+            acks="all" if settings.producer_acks == "all" else int(settings.producer_acks),
+            linger_ms=settings.producer_linger_ms,
+            max_batch_size=settings.producer_max_batch_bytes,
+            compression_type=compression
         )
 
     async def start(self):
-        if self.started:
+        if not self.started:
+            if self._producer is None:
+                self._producer = self._create_producer()
             await self._producer.start()
             self.started = True
             print('Starting Kafka Producer Service...')
+            SEND_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+            if self.mode == "queue":
+                self._queue = asyncio.Queue(maxsize=settings.send_queue_size)
+                self._workers = [
+                    asyncio.create_task(self._drain_queue())
+                    for _ in range(settings.send_queue_workers)
+                ]
 
     async def stop(self):
         if self.started:
+            if self._queue is not None:
+                # Give the workers a chance to deliver what has already been accepted
+                try:
+                    await asyncio.wait_for(self._queue.join(), timeout=settings.send_queue_drain_timeout)
+                except asyncio.TimeoutError:
+                    print(f'Dropping {self._queue.qsize()} undelivered messages on shutdown')
+
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
             await self._producer.stop()
+            self._producer = None # a stopped aiokafka client cannot be started again
             self.started = False
             print('Shutting down Kafka connection...')
 
@@ -50,27 +123,210 @@ class ProducerService:
             return None
         
         return x if isinstance(x, bytes) else str(x).encode('utf-8')
+
+    def _serialize(self, value):
+        """
+        Encode a message value with the configured wire codec
+        """
+        if value is None or isinstance(value, bytes):
+            return value
+
+        if hasattr(value, "model_dump"): # pydantic models (GameEvent)
+            value = value.model_dump()
+
+        return self.codec.encode(value)
+
+    def _trace_headers(self, ingested_at:float = None, extra:list = None):
+        """
+        Codec header plus a new trace id and the ingest timestamp, which the
+        consumer uses to measure each event's end-to-end latency
+
+        params:
+            - ingested_at (float): time.time() when the API received the event, defaults to now
+            - extra (list): (name, bytes) headers appended after the trace headers
+        """
+        ingested_at = time.time() if ingested_at is None else ingested_at
+        return self._headers + [
+            (TRACE_ID_HEADER, uuid4().hex.encode('utf-8')),
+            (INGEST_TS_HEADER, str(int(ingested_at * 1_000_000)).encode('utf-8'))
+        ] + (extra or [])
+
+    def key_event(self, event):
+        """
+        Kafka key for an event, see EventPartitioner
+        """
+        return self.partitioner.assign(event)
     
-    async def produce_message(self, key:str, value:dict):
+    async def produce_message(self, key:str, value:dict, retry:bool = True, ingested_at:float = None,
+                              headers:list = None):
         """
         Send messge to Kafka topic.
+
+        params:
+            - headers (list): extra (name, bytes) headers
         """
         try:
-            payload = await self._producer.send_and_wait(
-                topic=self.topic,
-                key=self._to_bytes(key),
-                value=self._to_bytes(value)
-            )
+            with PRODUCE_SECONDS.labels("single").time():
+                payload = await self._producer.send_and_wait(
+                    topic=self.topic,
+                    key=self._to_bytes(key),
+                    value=self._serialize(value),
+                    headers=self._trace_headers(ingested_at, headers)
+                )
 
-            print(f'Delivered message to topic {self.topic}. Payload: {key}:{value}')
+            KAFKA_MESSAGES.labels("delivered").inc()
             return payload
+        except KafkaError:
+            KAFKA_MESSAGES.labels("failed").inc()
+            raise
         except BufferError:
+            if not retry:
+                raise
             print('Queue is full, flushing....')
-            self.flush()
+            await self.flush()
             # This will run once the messages have finished processing
-            self.produce_message(self.topic, key, value)
+            return await self.produce_message(key, value, retry=False, ingested_at=ingested_at, headers=headers)
+
+    async def produce_batch(self, messages:list, ingested_at:float = None):
+        """
+        Send a batch of messages to Kafka topic. Every message is handed to the
+        producer before any acknowledgement is awaited, so the whole batch is
+        pipelined into as few broker requests as the producer can build.
+
+        params:
+            - messages (list): (key, value) pairs to send, or (key, value, headers) with
+              extra headers per message
+            - ingested_at (float): time.time() when the API received the batch
+
+        Returns one RecordMetadata or exception per message, in the same order.
+        """
+        return await self._send_batch([
+            (key, value, self._trace_headers(ingested_at, *headers))
+            for key, value, *headers in messages
+        ])
+
+    async def _send_batch(self, messages:list):
+        """
+        Pipeline (key, value, headers) messages whose headers are complete
+        """
+        start = time.perf_counter()
+        results = [None] * len(messages)
+        pending = {}
+        for idx, (key, value, headers) in enumerate(messages):
+            try:
+                # send() only waits when the producer buffer is full and returns a delivery future
+                pending[idx] = await self._producer.send(
+                    topic=self.topic,
+                    key=self._to_bytes(key),
+                    value=self._serialize(value),
+                    headers=headers
+                )
+            except KafkaError as err:
+                results[idx] = err
+
+        if pending:
+            acks = await asyncio.gather(*pending.values(), return_exceptions=True)
+            for idx, ack in zip(pending, acks):
+                results[idx] = ack
+
+        PRODUCE_SECONDS.labels("batch").observe(time.perf_counter() - start)
+        failed = sum(isinstance(result, Exception) for result in results)
+        KAFKA_MESSAGES.labels("delivered").inc(len(messages) - failed)
+        if failed:
+            KAFKA_MESSAGES.labels("failed").inc(failed)
+        return results
+
+    def enqueue_message(self, key:str, value:dict, ingested_at:float = None, headers:list = None):
+        """
+        Put a message on the in-process send queue and return immediately.
+        The message is delivered by the background queue workers.
+
+        params:
+            - key (str): message key
+            - value (dict): message value
+            - ingested_at (float): time.time() when the API received the event
+            - headers (list): extra (name, bytes) headers
+
+        raises SendQueueFull when the queue is at capacity
+        """
+        self.enqueue_batch([(key, value, headers)], ingested_at=ingested_at)
+
+    def enqueue_batch(self, messages:list, ingested_at:float = None):
+        """
+        Put a batch of (key, value) pairs, or (key, value, headers) with extra
+        headers, on the send queue. The batch is accepted as a whole or rejected as
+        a whole. Trace headers are added here, so the time spent on the queue counts
+        towards the event's latency.
+
+        raises SendQueueFull when the queue cannot take every message
+        """
+        if self._queue is None:
+            raise RuntimeError("Send queue is only available when the producer runs in queue mode")
+
+        if self._queue.maxsize - self._queue.qsize() < len(messages):
+            self.counters["rejected"] += len(messages)
+            KAFKA_MESSAGES.labels("rejected").inc(len(messages))
+            raise SendQueueFull(f"Send queue is full ({self._queue.qsize()}/{self._queue.maxsize})")
+
+        enqueued = time.perf_counter()
+        for key, value, *headers in messages:
+            self._queue.put_nowait((key, value, self._trace_headers(ingested_at, *headers), enqueued))
+        self.counters["enqueued"] += len(messages)
+
+    @property
+    def queue_depth(self):
+        """
+        Number of messages waiting on the send queue
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def add_delivery_callback(self, callback):
+        """
+        Register a callback for queued deliveries. It is called as
+        callback(key, value, outcome) where outcome is the RecordMetadata
+        or the exception raised for the message.
+        """
+        self._delivery_callbacks.append(callback)
+
+    async def _drain_queue(self):
+        """
+        Queue worker: take whatever is waiting, waiting up to the controller's linger
+        for more (up to its batch size), and send it as one pipelined batch.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batching.linger
+            while len(batch) < self.batching.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+            try:
+                outcomes = await self._send_batch([(key, value, headers) for key, value, headers, _ in batch])
+            except Exception as err:
+                outcomes = [err] * len(batch)
+
+            acked = time.perf_counter()
+            self.batching.observe([acked - enqueued for *_, enqueued in batch])
+
+            for (key, value, _, _), outcome in zip(batch, outcomes):
+                self.counters["failed" if isinstance(outcome, Exception) else "delivered"] += 1
+                for callback in self._delivery_callbacks:
+                    try:
+                        callback(key, value, outcome)
+                    except Exception as err:
+                        print('Delivery callback failed: ', err)
 
-    # May need a method for multiple documents being passed in
+            for _ in batch:
+                self._queue.task_done()
 
     async def flush(self):
-        self._producer.flush()
+        await self._producer.flush()
@@ -0,0 +1,139 @@
+"""
+Module for Kafka producer tuning: compression choice and adaptive batching
+"""
+import time
+from uuid import uuid4
+from collections import deque
+
+from api_service.core.metrics import Gauge
+
+try:
+    from aiokafka.codec import has_lz4, has_zstd, lz4_encode, zstd_encode
+except ImportError: # older aiokafka without the codec helpers
+    has_lz4 = has_zstd = lambda: False
+
+BATCH_LINGER = Gauge("api_send_batch_linger_seconds", "Time a send queue worker waits to fill a batch")
+BATCH_SIZE = Gauge("api_send_batch_size", "Messages a send queue worker sends at most per batch")
+WINDOW_P99 = Gauge("api_send_latency_p99_seconds", "p99 enqueue-to-ack latency of the last controller window")
+
+def choose_compression(setting:str, sample:list, target_p99:float):
+    """
+    Compression type for AIOKafkaProducer
+
+    "auto" compresses a sample batch with lz4 and zstd and picks zstd when it is
+    noticeably smaller and fast enough for the latency target, otherwise lz4 (the
+    cheaper of the two). Falls back to no compression when neither library is installed.
+
+    params:
+        - setting (str): none, gzip, snappy, lz4, zstd or auto
+        - sample (list): encoded message values representative of a batch
+        - target_p99 (float): target p99 send latency in seconds
+    """
+    if setting != "auto":
+        return None if setting == "none" else setting
+
+    lz4_ok, zstd_ok = has_lz4(), has_zstd()
+    if not (lz4_ok and zstd_ok):
+        choice = "lz4" if lz4_ok else "zstd" if zstd_ok else None
+        print(f'WARNING: KAFKA_PRODUCER_COMPRESSION=auto but the lz4 or zstd codec is not installed '
+              f'(install aiokafka[lz4,zstd]), using {choice or "no compression"}')
+        return choice
+
+    payload = b"".join(sample)
+    results = {}
+    for name, encode in (("lz4", lz4_encode), ("zstd", zstd_encode)):
+        start = time.perf_counter()
+        size = len(encode(payload))
+        results[name] = (size, time.perf_counter() - start)
+
+    (lz4_size, _), (zstd_size, zstd_seconds) = results["lz4"], results["zstd"]
+    choice = "zstd" if zstd_size <= lz4_size * 0.9 and zstd_seconds <= target_p99 * 0.05 else "lz4"
+    print(f'Using {choice} compression (sample batch of {len(payload)} bytes: '
+          f'lz4 {lz4_size} bytes, zstd {zstd_size} bytes in {zstd_seconds * 1000:.2f}ms)')
+    return choice
+
+def sample_batch(codec, example:dict, size:int) -> list:
+    """
+    size encoded copies of example, each with a new play_id
+    """
+    return [codec.encode(dict(example, play_id=str(uuid4()))) for _ in range(size)]
+
+class BatchController:
+    """
+    Adjusts how long the send queue workers wait to fill a batch (linger) and how
+    many messages they send at once against a target p99 enqueue-to-ack latency.
+
+    Every interval the p99 of the window is compared with the target: above it,
+    linger is halved and the batch size reduced; well below it, while messages
+    arrive fast enough to fill a longer linger, linger and batch size grow. When
+    traffic is too slow for lingering to collect anything, linger drops to zero,
+    so quiet periods keep the lowest latency and busy periods get bigger batches.
+    """
+    def __init__(
+            self,
+            target_p99:float,
+            min_batch_size:int,
+            max_batch_size:int,
+            max_linger:float,
+            interval:float = 5.0,
+            adaptive:bool = True
+            ):
+        """
+        Initialize controller
+
+        params:
+            - target_p99 (float): target p99 enqueue-to-ack latency in seconds
+            - min_batch_size (int): fewest messages per batch the controller goes down to
+            - max_batch_size (int): most messages per batch
+            - max_linger (float): longest linger in seconds
+            - interval (float): seconds between adjustments
+            - adaptive (bool): False keeps linger at 0 and the batch size at max_batch_size
+        """
+        self.target_p99 = target_p99
+        self.min_batch_size = max(1, min(min_batch_size, max_batch_size))
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self.interval = interval
+        self.adaptive = adaptive
+
+        self.linger = 0.0
+        self.batch_size = max_batch_size
+        self._latencies = deque()
+        self._messages = 0
+        self._window_start = time.monotonic()
+        BATCH_LINGER.set_function(lambda: self.linger)
+        BATCH_SIZE.set_function(lambda: self.batch_size)
+
+    def observe(self, latencies:list):
+        """
+        Record the enqueue-to-ack latencies of one sent batch
+        """
+        if not self.adaptive:
+            return
+        self._latencies.extend(latencies)
+        self._messages += len(latencies)
+
+        now = time.monotonic()
+        if now - self._window_start >= self.interval:
+            self._adjust(now - self._window_start)
+            self._latencies.clear()
+            self._messages = 0
+            self._window_start = now
+
+    def _adjust(self, elapsed:float):
+        ordered = sorted(self._latencies)
+        p99 = ordered[max(0, -(-len(ordered) * 99 // 100) - 1)]
+        rate = self._messages / elapsed
+        WINDOW_P99.set(p99)
+        step = self.max_linger / 10
+
+        if p99 > self.target_p99:
+            self.linger = self.linger / 2 if self.linger > step else 0.0
+            self.batch_size = max(self.min_batch_size, int(self.batch_size * 0.75))
+        elif p99 < self.target_p99 * 0.7 and rate * (self.linger + step) >= 2:
+            # Enough traffic for a longer linger to collect more than one message
+            self.linger = min(self.max_linger, self.linger + step)
+            self.batch_size = min(self.max_batch_size, max(self.batch_size + 1, int(self.batch_size * 1.25)))
+
+        if rate * self.linger < 1:
+            self.linger = 0.0
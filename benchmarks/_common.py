@@ -0,0 +1,48 @@
+"""
+Helpers shared by the benchmark scripts: argument parsing and the JSON report
+"""
+import os
+import json
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def benchmark_parser(description:str) -> argparse.ArgumentParser:
+    """
+    Argument parser with the script's docstring as help and the --output option
+    """
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def new_report(benchmark:str, args, exclude:tuple = ()) -> dict:
+    """
+    Report header: benchmark name, git revision, Python version and the arguments
+    (without --output and the names in exclude)
+    """
+    return {
+        "benchmark": benchmark,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output",) + exclude}
+    }
+
+def write_report(report:dict, output:str = None):
+    """
+    Print the report as JSON, or write it to output
+    """
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,288 @@
+"""
+Ingestion benchmark for the API service.
+
+Drives concurrent load against POST /event and POST /auth/token in process, through
+httpx's ASGI transport, so no Kafka broker, SQL Server or network is involved:
+
+    - Kafka: the real ProducerService runs on an in-memory client that acknowledges
+      every send after --ack-latency-ms
+    - SQL Server: the user lookup runs on an in-memory session that answers after
+      --db-latency-ms
+    - JWT: POST /event skips token verification unless --verify-tokens is given
+
+Everything else (routing, validation, serialization, caching, bcrypt) is the
+application code, so the numbers move with changes to post_event, ProducerService
+and AuthUtils. Results are printed as JSON (or written to --output) to compare
+between commits:
+
+    python benchmarks/api_ingest.py --requests 5000 --concurrency 64
+    python benchmarks/api_ingest.py --scenarios token --bcrypt-rounds 4 --output before.json
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import contextlib
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from _common import ROOT, benchmark_parser, new_report, write_report
+
+sys.path.insert(0, ROOT)
+
+BENCH_EMAIL = "benchmark@example.com"
+BENCH_PASSWORD = "benchmark-password"
+
+RecordMetadata = namedtuple("RecordMetadata", ["topic", "partition", "offset"])
+
+def parse_args(argv=None):
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--scenarios", default="event,token", help="comma separated: event, token")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests before each scenario")
+    parser.add_argument("--games", type=int, default=20, help="distinct game ids in the event payloads")
+    parser.add_argument("--producer-mode", choices=("sync", "queue"), default="sync")
+    parser.add_argument("--codec", default="json", help="event codec: json, msgpack or binary")
+    parser.add_argument("--ack-latency-ms", type=float, default=2.0, help="simulated broker acknowledgement time")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="simulated user lookup time")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="bcrypt cost factor of the seeded user")
+    parser.add_argument("--verify-tokens", action="store_true", help="verify a real JWT on POST /event")
+    parser.add_argument("--no-token-cache", action="store_true", help="disable the verified-token cache")
+    parser.add_argument("--no-user-cache", action="store_true", help="disable the user lookup cache")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+def configure_environment(args):
+    """
+    Settings are read from the environment when api_service is imported, so the
+    benchmark configuration has to be in place first
+    """
+    defaults = {
+        "JWT_SECRET_KEY": "benchmark-secret-key",
+        "JWT_ALGORITHM": "HS256",
+        "JWT_EXPIRE_MINUTES": "30",
+        "JWT_TOKEN_TYPE": "bearer",
+        "KAFKA_TOPIC": "benchmark-events"
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+    os.environ["KAFKA_PRODUCER_MODE"] = args.producer_mode
+    os.environ["EVENT_CODEC"] = args.codec
+    os.environ["BCRYPT_MIN_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ["BCRYPT_MAX_ROUNDS"] = str(args.bcrypt_rounds)
+    if args.no_token_cache:
+        os.environ["JWT_CACHE_SIZE"] = "0"
+    if args.no_user_cache:
+        os.environ["USER_CACHE_SIZE"] = "0"
+
+class FakeKafkaClient:
+    """
+    Stands in for AIOKafkaProducer: every send is acknowledged after ack_latency seconds
+    """
+    def __init__(self, ack_latency:float):
+        self.ack_latency = ack_latency
+        self.messages = 0
+        self.bytes = 0
+        self._offset = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def send(self, topic, key=None, value=None, headers=None):
+        self.messages += 1
+        self.bytes += len(value or b"")
+        self._offset += 1
+
+        future = asyncio.get_running_loop().create_future()
+        metadata = RecordMetadata(topic, 0, self._offset)
+        asyncio.get_running_loop().call_later(self.ack_latency, future.set_result, metadata)
+        return future
+
+    async def send_and_wait(self, topic, key=None, value=None, headers=None):
+        return await (await self.send(topic, key=key, value=value, headers=headers))
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+class FakeSession:
+    """
+    Stands in for the SQL Server AsyncSession with a single seeded user
+    """
+    def __init__(self, user, latency:float):
+        self.user = user
+        self.latency = latency
+
+    async def exec(self, statement):
+        await asyncio.sleep(self.latency)
+        return FakeResult(self.user)
+
+    async def get(self, model, ident):
+        await asyncio.sleep(self.latency)
+        return self.user
+
+    def add(self, model):
+        pass
+
+    async def commit(self):
+        await asyncio.sleep(self.latency)
+
+    async def rollback(self):
+        pass
+
+    async def refresh(self, model):
+        pass
+
+def percentile(ordered:list, pct:float) -> float:
+    """
+    Nearest-rank percentile of an ascending list
+    """
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(latencies:list, statuses:Counter, elapsed:float) -> dict:
+    ordered = sorted(latencies)
+    errors = sum(count for code, count in statuses.items() if not 200 <= code < 300)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+            "p50": round(percentile(ordered, 50) * 1000, 3) if ordered else None,
+            "p95": round(percentile(ordered, 95) * 1000, 3) if ordered else None,
+            "p99": round(percentile(ordered, 99) * 1000, 3) if ordered else None,
+            "max": round(ordered[-1] * 1000, 3) if ordered else None
+        }
+    }
+
+async def drive(send, total:int, concurrency:int):
+    """
+    Run send() total times with at most concurrency calls in flight.
+    Returns latencies in seconds, status code counts and the wall time.
+    """
+    latencies = []
+    statuses = Counter()
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await send()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    return latencies, statuses, time.perf_counter() - start
+
+async def run(args):
+    import httpx
+
+    from api_service.main import app
+    from api_service.core.mssql_session import get_mssql_connection
+    from api_service.models.user import Users
+    from api_service.schemas.auth import TokenVal
+    from api_service.services.auth import Authentication, get_current_user, token_cache, user_cache
+    from api_service.services.hashing import password_hasher
+    from api_service.services.producer import ProducerService
+
+    kafka = FakeKafkaClient(args.ack_latency_ms / 1000)
+
+    class BenchmarkProducerService(ProducerService):
+        def _create_producer(self):
+            return kafka
+
+    rng = random.Random(args.seed)
+
+    # What the lifespan would do, without the external connections
+    await password_hasher.start(calibrate=False)
+    app.state.producer = BenchmarkProducerService()
+    await app.state.producer.start()
+
+    user = Users(id=1, email=BENCH_EMAIL, password=await password_hasher.hash(BENCH_PASSWORD),
+                 last_updated=datetime.now())
+
+    async def fake_connection():
+        return FakeSession(user, args.db_latency_ms / 1000)
+
+    app.dependency_overrides[get_mssql_connection] = fake_connection
+    if not args.verify_tokens:
+        app.dependency_overrides[get_current_user] = lambda: TokenVal(id=str(user.id))
+    access_token = Authentication(None)._create_access_token(user.id, user.email)
+
+    def event_payload():
+        return {
+            "game_id": rng.randrange(args.games),
+            "play_id": str(uuid.uuid4()),
+            "event_type": "scoring",
+            "event": "Touchdown!",
+            "timestamp": datetime.now().isoformat(),
+            "player_id": rng.randrange(1000000, 9999999)
+        }
+
+    report = new_report("api_ingest", args)
+    report["scenarios"] = {}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        scenarios = {
+            "event": lambda: client.post("/event", json=event_payload(),
+                                         headers={"Authorization": f"Bearer {access_token}"}),
+            "token": lambda: client.post("/auth/token",
+                                         data={"username": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        }
+
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in scenarios:
+                raise SystemExit(f"Unknown scenario {name}, expected one of {', '.join(scenarios)}")
+
+            token_cache.clear()
+            user_cache.clear()
+            # The application prints per message, keep that off the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                if args.warmup:
+                    await drive(scenarios[name], args.warmup, args.concurrency)
+                latencies, statuses, elapsed = await drive(scenarios[name], args.requests, args.concurrency)
+
+            result = summarize(latencies, statuses, elapsed)
+            result["token_cache"] = token_cache.stats()
+            result["user_cache"] = user_cache.stats()
+            report["scenarios"][name] = result
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await app.state.producer.stop()
+        await password_hasher.stop()
+    report["producer"] = dict(app.state.producer.counters, messages_sent=kafka.messages, bytes_sent=kafka.bytes)
+    app.dependency_overrides.clear()
+    return report
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    report = asyncio.run(run(args))
+
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Throughput benchmark for the event consumer pipeline.
+
+Feeds synthetic GameEvent messages through the same path ConsumeMessage uses for
+polled batches (EventPipeline -> worker lanes -> MongoBatchSink -> OffsetTracker)
+and into an in-memory MongoDB stand-in, so no Kafka broker or cluster is needed.
+Message size, game key skew and the share of undecodable messages are configurable,
+as are the simulated write and commit latencies.
+
+Reports msgs/sec from the first submitted batch until every offset is committed,
+the time spent in each stage (decode, write, commit) and the peak traced memory of
+the run. Decoding includes validation against the GameEvent schema unless
+--no-validate is given: JSON is parsed and validated in one pass, so after the run
+the messages are decoded again without validation ("decode_only") and the
+difference is reported as "validate". Stage times are summed over concurrent lanes,
+so they can add up to more than the wall time.
+
+    python benchmarks/consumer_pipeline.py --messages 200000 --workers 4
+    python benchmarks/consumer_pipeline.py --skew 1.2 --error-rate 0.01 --write-latency-ms 15 --max-inflight 4
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import itertools
+import contextlib
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from _common import ROOT, benchmark_parser, new_report, write_report
+
+sys.path.insert(0, os.path.join(ROOT, "event_consumer"))
+
+UNDECODABLE = b"\xc1\xff" # not valid JSON, MessagePack or binary event
+
+def parse_args(argv=None):
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--message-size", type=int, default=256, help="approximate encoded event size in bytes")
+    parser.add_argument("--codec", default="json", help="event codec: json, msgpack or binary")
+    parser.add_argument("--games", type=int, default=100, help="distinct game ids")
+    parser.add_argument("--skew", type=float, default=0.0, help="zipf exponent of the game distribution, 0 is uniform")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of undecodable messages")
+    parser.add_argument("--partitions", type=int, default=6)
+    parser.add_argument("--poll-batch", type=int, default=500, help="messages per polled batch")
+    parser.add_argument("--workers", type=int, default=4, help="worker lanes")
+    parser.add_argument("--lane-queue", type=int, default=100, help="batches a lane can hold")
+    parser.add_argument("--sink-batch", type=int, default=500, help="documents per MongoDB write")
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--max-inflight", type=int, default=1, help="concurrent writes per lane")
+    parser.add_argument("--max-pending", type=int, default=20, help="unfinished batches per lane before it stops taking events, 0 is unbounded")
+    parser.add_argument("--write-mode", choices=("insert", "upsert"), default="insert")
+    parser.add_argument("--write-latency-ms", type=float, default=5.0, help="simulated bulk write time")
+    parser.add_argument("--commit-latency-ms", type=float, default=1.0, help="simulated offset commit time")
+    parser.add_argument("--no-validate", action="store_true", help="decode without validating against the GameEvent schema")
+    parser.add_argument("--game-state", action="store_true", help="run the live game state stage")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip memory tracing, it slows the run down")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+class StageTimer:
+    """
+    Accumulated time and call count of one pipeline stage
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.items = 0
+
+    def add(self, seconds:float, items:int = 1):
+        self.seconds += seconds
+        self.calls += 1
+        self.items += items
+
+    def report(self, messages:int) -> dict:
+        return {
+            "total_s": round(self.seconds, 4),
+            "calls": self.calls,
+            "items": self.items,
+            "per_message_us": round(self.seconds / messages * 1e6, 3) if messages else None
+        }
+
+class SyntheticMessage:
+    """
+    Quacks like a confluent_kafka Message
+    """
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers")
+
+    def __init__(self, topic, partition, offset, key, value, headers):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+def synthesize(args, codec, header_name:str):
+    """
+    Build the message backlog. Game ids follow a zipf distribution, the event text
+    is padded so the encoded event is about message_size bytes.
+    """
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) ** args.skew for rank in range(args.games)]
+    cum_weights = list(itertools.accumulate(weights))
+    games = rng.choices(range(args.games), cum_weights=cum_weights, k=args.messages)
+
+    headers = [(header_name, codec.name.encode("utf-8"))]
+    template = {
+        "game_id": 0,
+        "play_id": str(uuid.uuid4()),
+        "event_type": "scoring",
+        "event": "",
+        "timestamp": datetime.now().isoformat(),
+        "player_id": 1234567
+    }
+    padding = "x" * max(0, args.message_size - len(codec.encode(template)))
+
+    offsets = Counter()
+    messages = []
+    for game_id in games:
+        partition = game_id % args.partitions
+        offset = offsets[partition]
+        offsets[partition] += 1
+
+        if rng.random() < args.error_rate:
+            value = UNDECODABLE
+        else:
+            value = codec.encode({
+                "game_id": game_id,
+                "play_id": str(uuid.uuid4()),
+                "event_type": "scoring",
+                "event": "Touchdown!" + padding,
+                "timestamp": datetime.now().isoformat(),
+                "player_id": rng.randrange(1000000, 9999999)
+            })
+        messages.append(SyntheticMessage("benchmark-events", partition, offset,
+                                         f"game-key-{game_id}".encode("utf-8"), value, headers))
+    return messages, Counter(games)
+
+class MemoryStore:
+    """
+    In-memory stand-in for AsyncMongoDataManager. Writes take write_latency seconds
+    and can overlap, like bulk writes on a connection pool.
+    """
+    def __init__(self, write_latency:float, timer:StageTimer):
+        self.write_latency = write_latency
+        self.timer = timer
+        self.stored = 0
+        self.states = {}
+        self._keys = set()
+
+    async def _write(self, documents:list):
+        start = time.perf_counter()
+        await asyncio.sleep(self.write_latency)
+        self.stored += len(documents)
+        self.timer.add(time.perf_counter() - start, len(documents))
+
+    async def insert_many_records(self, documents:list, ordered:bool = True):
+        await self._write(documents)
+
+    async def upsert_many_records(self, documents:list, ordered:bool = False):
+        new = []
+        for document in documents:
+            key = (document["game_id"], document["play_id"])
+            if key not in self._keys:
+                self._keys.add(key)
+                new.append(document)
+        await self._write(new)
+
+    async def read_state(self, game_id:str):
+        return self.states.get(game_id)
+
+    async def save_states(self, documents:list):
+        await asyncio.sleep(self.write_latency)
+        for document in documents:
+            self.states[document["_id"]] = document
+
+class MemoryConsumer:
+    """
+    Stands in for ConsumerService.commit_offsets, which runs on a worker thread
+    """
+    def __init__(self, commit_latency:float, timer:StageTimer):
+        self.commit_latency = commit_latency
+        self.timer = timer
+        self.committed = {}
+
+    def commit_offsets(self, offsets:dict):
+        start = time.perf_counter()
+        time.sleep(self.commit_latency)
+        self.committed.update(offsets)
+        self.timer.add(time.perf_counter() - start, len(offsets))
+
+class MemoryDeadLetter:
+    def __init__(self):
+        self.published = 0
+
+    async def publish_message(self, message, err, stage="decode", attempts=1, on_delivered=None):
+        self.published += 1
+        if on_delivered is not None:
+            on_delivered()
+
+    async def publish_document(self, document, err, stage="write", attempts=1, on_delivered=None):
+        self.published += 1
+        if on_delivered is not None:
+            on_delivered()
+
+    async def close(self, timeout:float = 10.0):
+        pass
+
+async def run(args, messages:list):
+    from services.decoder import EventDecoder
+    from services.offsets import OffsetTracker
+    from services.pipeline import EventPipeline, RecentKeyFilter
+    from services.sink import MongoBatchSink
+    from services.game_state import GameStateStore
+
+    timers = {stage: StageTimer() for stage in ("decode", "write", "commit")}
+    store = MemoryStore(args.write_latency_ms / 1000, timers["write"])
+    consumer = MemoryConsumer(args.commit_latency_ms / 1000, timers["commit"])
+    dead_letter = MemoryDeadLetter()
+    offsets = OffsetTracker(consumer)
+
+    decoder = EventDecoder(validate=not args.no_validate)
+
+    def decode(messages):
+        start = time.perf_counter()
+        try:
+            return decoder.decode_batch(messages)
+        finally:
+            timers["decode"].add(time.perf_counter() - start, len(messages))
+
+    sinks = [
+        MongoBatchSink(
+            store=store,
+            offsets=offsets,
+            batch_size=args.sink_batch,
+            flush_interval=args.flush_interval,
+            max_inflight=args.max_inflight,
+            max_pending=args.max_pending,
+            write_mode=args.write_mode,
+            dead_letter=dead_letter
+        )
+        for _ in range(args.workers)
+    ]
+    pipeline = EventPipeline(
+        decode=decode,
+        offsets=offsets,
+        sinks=sinks,
+        queue_size=args.lane_queue,
+        dead_letter=dead_letter,
+        key_filter=RecentKeyFilter(100000)
+    )
+    game_states = None
+    if args.game_state:
+        game_states = GameStateStore(store=store, flush_interval=args.flush_interval)
+        pipeline.add_stage(game_states.apply_events)
+        await game_states.start()
+    await pipeline.start()
+
+    start = time.perf_counter()
+    for idx in range(0, len(messages), args.poll_batch):
+        await pipeline.submit(messages[idx:idx + args.poll_batch])
+    await pipeline.stop(timeout=600)
+    if game_states is not None:
+        await game_states.stop()
+    elapsed = time.perf_counter() - start
+
+    committed = sum(offset + 1 for offset in consumer.committed.values())
+    return {
+        "messages": len(messages),
+        "stored": store.stored,
+        "dead_lettered": dead_letter.published,
+        "committed": committed,
+        "uncommitted": offsets.pending(),
+        "duration_s": round(elapsed, 4),
+        "throughput_msgs_per_s": round(len(messages) / elapsed, 2) if elapsed else None,
+        "stages": {stage: timer.report(len(messages)) for stage, timer in timers.items()}
+    }
+
+def split_validation(args, messages:list, stages:dict):
+    """
+    Add the decode-only time of the messages and the validation time derived from it
+    """
+    from services.decoder import EventDecoder
+
+    decoder = EventDecoder(validate=False)
+    timer = StageTimer()
+    for idx in range(0, len(messages), args.poll_batch):
+        batch = messages[idx:idx + args.poll_batch]
+        start = time.perf_counter()
+        decoder.decode_batch(batch)
+        timer.add(time.perf_counter() - start, len(batch))
+
+    stages["decode_only"] = timer.report(len(messages))
+    validate_s = max(0.0, stages["decode"]["total_s"] - timer.seconds)
+    stages["validate"] = {
+        "total_s": round(validate_s, 4),
+        "per_message_us": round(validate_s / len(messages) * 1e6, 3) if messages else None
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from core.codec import CODEC_HEADER, get_codec
+    messages, games = synthesize(args, get_codec(args.codec), CODEC_HEADER)
+    sizes = [len(message.value()) for message in messages]
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = asyncio.run(run(args, messages))
+    if not args.no_tracemalloc:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_mb"] = round(peak / 2 ** 20, 3)
+
+    if not args.no_validate:
+        split_validation(args, messages, result["stages"])
+
+    result["mean_message_bytes"] = round(sum(sizes) / len(sizes), 1) if sizes else None
+    result["hottest_game_share"] = round(games.most_common(1)[0][1] / len(messages), 4) if messages else None
+
+    report = new_report("consumer_pipeline", args)
+    report["result"] = result
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Startup benchmark for both services.
+
+Every run starts a fresh interpreter per app and measures:
+
+    - import_s: importing the app module (api_service.main or the consumer's main),
+      with no credentials in the environment
+    - ready_s: running the app's lifespan startup until GET /ready answers 200
+    - shutdown_s: running the lifespan shutdown
+
+The apps run on the embedded broker, so no Kafka broker is needed. The external
+connections are simulated: the Kafka producer start, the SQL Server warm-up and the
+MongoDB client creation, ping and index creation each take --connect-latency-ms.
+Connections opened concurrently make ready_s close to one latency rather than
+their sum. Results are printed as JSON (or written to --output) to compare between
+commits:
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --apps api --connect-latency-ms 200 --no-bcrypt-calibrate
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+from _common import ROOT, benchmark_parser, new_report, write_report
+
+APPS = ("api", "consumer")
+
+def parse_args(argv=None):
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--apps", default="api,consumer", help="comma separated: api, consumer")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per app")
+    parser.add_argument("--connect-latency-ms", type=float, default=100.0,
+                        help="simulated time of each external connection step")
+    parser.add_argument("--no-bcrypt-calibrate", action="store_true", help="skip the bcrypt cost calibration on startup")
+    parser.add_argument("--child", choices=APPS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def child_environment(args):
+    """
+    Environment of a measured interpreter: the embedded broker and none of the
+    credentials, which the apps must not need to be imported
+    """
+    env = {name: value for name, value in os.environ.items()
+           if not name.startswith(("SQL_", "JWT_", "MONGODB_", "KAFKA_", "EMBEDDED_"))}
+    env.update({
+        "EVENT_TRANSPORT": "embedded",
+        "KAFKA_TOPIC": "startup-events",
+        "BCRYPT_CALIBRATE": "false" if args.no_bcrypt_calibrate else "true"
+    })
+    return env
+
+class FakeKafkaClient:
+    """
+    Stands in for AIOKafkaProducer: start() takes latency seconds
+    """
+    def __init__(self, latency:float):
+        self.latency = latency
+
+    async def start(self):
+        await asyncio.sleep(self.latency)
+
+    async def stop(self):
+        pass
+
+    async def flush(self):
+        pass
+
+class FakeMongo:
+    """
+    Stands in for MongoDataManager (sync driver): creating the client, the ping
+    and the index creation each take latency seconds
+    """
+    def __init__(self, latency:float):
+        self.latency = latency
+        time.sleep(latency) # mongodb+srv DNS lookup
+
+    def ping(self, timeout:float = None, verbose:bool = True):
+        time.sleep(self.latency)
+        return True
+
+    def create_query_indexes(self):
+        time.sleep(self.latency)
+
+    def create_unique_index(self):
+        time.sleep(self.latency)
+
+    def insert_many_records(self, documents:list, ordered:bool = True):
+        pass
+
+    def upsert_many_records(self, documents:list, ordered:bool = False):
+        pass
+
+    def read_state(self, game_id:str):
+        return None
+
+    def save_states(self, documents:list):
+        pass
+
+    def shutdown(self):
+        pass
+
+def load_api(latency:float):
+    start = time.perf_counter()
+    import api_service.main as api_main
+    import_s = time.perf_counter() - start
+
+    class BenchmarkProducerService(api_main.ProducerService):
+        def _create_producer(self):
+            return FakeKafkaClient(latency)
+
+    async def warm_up(connections:int):
+        await asyncio.sleep(latency)
+
+    api_main.ProducerService = BenchmarkProducerService
+    api_main.warm_up = warm_up
+    return api_main.app, import_s
+
+def load_consumer(latency:float):
+    sys.path.insert(0, os.path.join(ROOT, "event_consumer"))
+    start = time.perf_counter()
+    import main as consumer_main
+    import_s = time.perf_counter() - start
+
+    from services import consume_messages
+    from services.consumer import EmbeddedConsumerService
+
+    class BenchmarkConsumerService(EmbeddedConsumerService):
+        def connect(self, timeout:float = 10.0):
+            time.sleep(latency)
+
+    consume_messages.create_data_manager = lambda: FakeMongo(latency)
+    consume_messages.EmbeddedConsumerService = BenchmarkConsumerService
+    return consumer_main.app, import_s
+
+async def time_to_ready(app) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        while (await client.get("/ready")).status_code != 200:
+            await asyncio.sleep(0.001)
+        ready_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await lifespan.__aexit__(None, None, None)
+        shutdown_s = time.perf_counter() - start
+    return {"ready_s": ready_s, "shutdown_s": shutdown_s}
+
+def run_child(args):
+    """
+    One measurement in this (fresh) interpreter, printed as JSON on the last line
+    """
+    sys.path.insert(0, ROOT)
+    latency = args.connect_latency_ms / 1000
+    loader = load_api if args.child == "api" else load_consumer
+
+    # The apps print while starting, keep that off the result line
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        app, import_s = loader(latency)
+        result = asyncio.run(time_to_ready(app))
+    finally:
+        sys.stdout = stdout
+    result["import_s"] = import_s
+    print(json.dumps(result))
+
+def summarize(samples:list) -> dict:
+    return {
+        metric: {
+            "min": round(min(sample[metric] for sample in samples), 4),
+            "median": round(statistics.median(sample[metric] for sample in samples), 4),
+            "max": round(max(sample[metric] for sample in samples), 4)
+        }
+        for metric in ("import_s", "ready_s", "shutdown_s")
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        run_child(args)
+        return
+
+    report = new_report("startup", args, exclude=("child",))
+    report["apps"] = {}
+    env = child_environment(args)
+    for name in args.apps.split(","):
+        name = name.strip()
+        if name not in APPS:
+            raise SystemExit(f"Unknown app {name}, expected one of {', '.join(APPS)}")
+
+        command = [sys.executable, os.path.abspath(__file__), "--child", name,
+                   "--connect-latency-ms", str(args.connect_latency_ms)]
+        samples = []
+        for _ in range(args.runs):
+            completed = subprocess.run(command, env=env, cwd=ROOT, capture_output=True, text=True)
+            if completed.returncode != 0:
+                raise SystemExit(f"{name} run failed:\n{completed.stderr}")
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        report["apps"][name] = summarize(samples)
+
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Module for stored event query routes
+"""
+import asyncio
+import inspect
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+
+from core.codec import get_codec
+from core.config import settings
+from services.mongodb import EVENT_FIELDS, event_filter, page_cursor, valid_cursor
+
+router = APIRouter(
+    prefix="/events",
+    tags=["Events"]
+)
+
+_codec = get_codec("json")
+
+def _fields(fields:Optional[str]) -> tuple:
+    """
+    Parse the comma separated fields parameter into a projection
+    """
+    if not fields:
+        return EVENT_FIELDS
+
+    requested = tuple(field.strip() for field in fields.split(",") if field.strip())
+    unknown = [field for field in requested if field not in EVENT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def _out(document:dict) -> dict:
+    document["_id"] = str(document["_id"])
+    return document
+
+@router.get("")
+async def query_events(
+    request: Request,
+    game_id: Optional[int] = None,
+    player_id: Optional[int] = None,
+    event_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(default=settings.query_page_size, ge=1, le=settings.query_max_page_size),
+    fields: Optional[str] = Query(default=None, description="Comma separated fields to return")
+    ):
+    """
+    One page of stored events in storage order, or in time order when start or end
+    is given. Pass next_cursor back as cursor (with the same filters) to read the
+    next page, it is null on the last page.
+    """
+    store = request.app.state.consume_message.mongodb
+    query = event_filter(game_id, player_id, event_type, start, end)
+    projection = _fields(fields)
+    if cursor is not None and not valid_cursor(query, cursor):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor")
+
+    # One extra event tells whether another page follows
+    if asyncio.iscoroutinefunction(store.find_page):
+        documents = await store.find_page(query, after=cursor, limit=limit + 1, fields=projection)
+    else:
+        documents = await asyncio.to_thread(store.find_page, query, cursor, limit + 1, projection)
+
+    page = documents[:limit]
+    next_cursor = page_cursor(query, page[-1]) if len(documents) > limit else None
+    if "timestamp" not in projection:
+        for document in page:
+            document.pop("timestamp", None) # only fetched for the cursor
+    return {
+        "items": [_out(document) for document in page],
+        "next_cursor": next_cursor
+    }
+
+@router.get("/export")
+async def export_events(
+    request: Request,
+    game_id: Optional[int] = None,
+    player_id: Optional[int] = None,
+    event_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fields: Optional[str] = Query(default=None, description="Comma separated fields to return")
+    ):
+    """
+    Every matching event as newline delimited JSON (in time order when start or end
+    is given), streamed from the database cursor without loading the result into memory
+    """
+    store = request.app.state.consume_message.mongodb
+    records = store.iter_records(event_filter(game_id, player_id, event_type, start, end),
+                                 fields=_fields(fields),
+                                 batch_size=settings.query_batch_size)
+
+    if inspect.isasyncgen(records):
+        async def lines():
+            async for document in records:
+                yield _codec.encode(_out(document)) + b"\n"
+    else:
+        # StreamingResponse iterates sync generators in the threadpool
+        def lines():
+            for document in records:
+                yield _codec.encode(_out(document)) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,39 @@
+"""
+Module for live game state routes
+"""
+import asyncio
+from fastapi import APIRouter, HTTPException, Request, status
+
+router = APIRouter(
+    prefix="/games",
+    tags=["Game State"]
+)
+
+@router.get("/{game_id}/state")
+async def get_game_state(game_id: int, request: Request):
+    """
+    Combined points of both teams (events carry no team, so there is no per-team
+    score), last play and per-player event counts and points of a game. Served from
+    memory when this process handles the game, otherwise read by id from the
+    game_state collection. "stale" is true when some of the game's events could not
+    be applied, so the counts are incomplete.
+    """
+    consume_message = request.app.state.consume_message
+    game_state = consume_message.game_states.get(game_id)
+
+    if game_state is None:
+        store = consume_message.mongodb
+        if asyncio.iscoroutinefunction(store.read_state):
+            game_state = await store.read_state(str(game_id))
+        else:
+            game_state = await asyncio.to_thread(store.read_state, str(game_id))
+
+    if game_state is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="No events received for this game")
+
+    response = {field: value for field, value in game_state.items() if field not in ("_id", "offsets")}
+    if "total_points" in response: # stored before the field was renamed
+        response["combined_points"] = response.pop("total_points")
+    response["stale"] = bool(response.get("stale")) or consume_message.game_states.is_stale(game_id)
+    return response
@@ -0,0 +1,73 @@
+"""
+Module for live game event streaming routes
+"""
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, Header, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from core.config import settings
+
+router = APIRouter(
+    prefix="/games",
+    tags=["Live Stream"]
+)
+
+@router.get("/{game_id}/stream")
+async def stream_game(
+    game_id: int,
+    request: Request,
+    last_event_id: Optional[str] = Header(default=None)
+    ):
+    """
+    Server-sent events stream of a game's events. Reconnecting clients send
+    Last-Event-ID to catch up on the events they missed.
+    """
+    hub = request.app.state.hub
+    subscriber = hub.subscribe(game_id, last_event_id=last_event_id)
+
+    async def frames():
+        try:
+            while True:
+                try:
+                    frame = await subscriber.next(timeout=settings.stream_keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+
+                if frame is None: # dropped for falling behind, the client reconnects with Last-Event-ID
+                    return
+                yield frame.sse
+        finally:
+            hub.unsubscribe(game_id, subscriber)
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/{game_id}/ws")
+async def websocket_game(
+    websocket: WebSocket,
+    game_id: int,
+    last_event_id: Optional[str] = None
+    ):
+    """
+    WebSocket stream of a game's events, one JSON text message per event
+    """
+    hub = websocket.app.state.hub
+    await websocket.accept()
+    subscriber = hub.subscribe(game_id, last_event_id=last_event_id)
+
+    try:
+        while True:
+            frame = await subscriber.next()
+            if frame is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(frame.text)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(game_id, subscriber)
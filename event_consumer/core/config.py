@@ -1,20 +1,66 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # mongodb env variables
-    mongodb_username:str = os.getenv("MONGODB_USERNAME")
-    mongodb_password:str = os.getenv("MONGODB_PASSWORD")
-    mongodb_cluster:str = os.getenv("MONGODB_CLUSTER")
-    mongodb_database:str = os.getenv("MONGODB_DATABASE")
-    mongodb_collection:str = os.getenv("MONGODB_COLLECTION")
+    mongodb_username:Optional[str] = os.getenv("MONGODB_USERNAME")
+    mongodb_password:Optional[str] = os.getenv("MONGODB_PASSWORD")
+    mongodb_cluster:Optional[str] = os.getenv("MONGODB_CLUSTER")
+    mongodb_database:Optional[str] = os.getenv("MONGODB_DATABASE")
+    mongodb_collection:Optional[str] = os.getenv("MONGODB_COLLECTION")
+    mongodb_state_collection:str = os.getenv("MONGODB_STATE_COLLECTION", "game_state")
+    state_flush_interval:float = os.getenv("GAME_STATE_FLUSH_INTERVAL", 1.0) # seconds between game state write-backs
+    state_idle_seconds:float = os.getenv("GAME_STATE_IDLE_SECONDS", 600) # seconds without events before a game state leaves memory
+    state_max_games:int = os.getenv("GAME_STATE_MAX_GAMES", 10000) # game states kept in memory
+    state_read_attempts:int = os.getenv("GAME_STATE_READ_ATTEMPTS", 3) # tries to read a stored state before its events skip the live view
+    query_page_size:int = os.getenv("EVENT_QUERY_PAGE_SIZE", 100) # default events per page
+    query_max_page_size:int = os.getenv("EVENT_QUERY_MAX_PAGE_SIZE", 1000)
+    query_batch_size:int = os.getenv("EVENT_QUERY_BATCH_SIZE", 500) # events per cursor round trip when exporting
+    mongodb_driver:str = os.getenv("MONGODB_DRIVER", "sync") # sync (pymongo) or async (motor)
+    mongodb_max_pool_size:int = os.getenv("MONGODB_MAX_POOL_SIZE", 100)
+    mongodb_min_pool_size:int = os.getenv("MONGODB_MIN_POOL_SIZE", 0)
+    mongodb_write_concern:str = os.getenv("MONGODB_WRITE_CONCERN", "majority")
+    mongodb_journal:bool = os.getenv("MONGODB_JOURNAL", True)
+    sink_batch_size:int = os.getenv("MONGODB_SINK_BATCH_SIZE", 1000) # documents per insert_many
+    sink_flush_interval:float = os.getenv("MONGODB_SINK_FLUSH_INTERVAL", 0.5) # seconds
+    mongodb_write_mode:str = os.getenv("MONGODB_WRITE_MODE", "insert") # insert or upsert (idempotent on game_id, play_id)
+    dedup_cache_size:int = os.getenv("MONGODB_DEDUP_CACHE_SIZE", 100000) # recent event keys remembered, 0 disables
+    mongodb_ping_timeout:float = os.getenv("MONGODB_PING_TIMEOUT", 5.0) # seconds, startup and readiness pings
+    mongodb_ping_cache_seconds:float = os.getenv("MONGODB_PING_CACHE_SECONDS", 5.0) # /ready reuses a ping result this long
+    sink_max_inflight:int = os.getenv("MONGODB_SINK_MAX_INFLIGHT", 1) # concurrent writes per worker lane, 1 keeps each game's writes in order
+    sink_max_pending:int = os.getenv("MONGODB_SINK_MAX_PENDING", 20) # unfinished batches per worker lane (writing, retrying or held) before its lane stops taking events, 0 is unbounded
 
     # kafka env variables
-    boostrap_server:str = os.getenv("KAFKA_SERVERS")
-    topic:str = os.getenv("KAFKA_TOPIC")
-    group_id:str = os.getenv("KAFKA_GROUP_ID")
-    offset:str = os.getenv("KAFKA_OFFSET")
-
+    boostrap_server:Optional[str] = os.getenv("KAFKA_SERVERS")
+    topic:Optional[str] = os.getenv("KAFKA_TOPIC")
+    transport:str = os.getenv("EVENT_TRANSPORT", "kafka") # kafka or embedded (in-process broker, single process only)
+    embedded_partitions:int = os.getenv("EMBEDDED_PARTITIONS", 4)
+    embedded_log_dir:Optional[str] = os.getenv("EMBEDDED_LOG_DIR") # append-only log directory, unset keeps records in memory
+    embedded_queue_size:int = os.getenv("EMBEDDED_QUEUE_SIZE", 10000) # records the consumer can fall behind
+    embedded_segment_records:int = os.getenv("EMBEDDED_SEGMENT_RECORDS", 100000) # records per log segment, segments every group committed past are deleted
+    group_id:Optional[str] = os.getenv("KAFKA_GROUP_ID")
+    offset:Optional[str] = os.getenv("KAFKA_OFFSET")
+    dead_letter_topic:Optional[str] = os.getenv("KAFKA_DEAD_LETTER_TOPIC") # defaults to <topic>-dlq
+    retry_base_delay:float = os.getenv("RETRY_BASE_DELAY", 0.5) # seconds before the first retry
+    retry_max_delay:float = os.getenv("RETRY_MAX_DELAY", 30) # longest backoff in seconds
+    retry_max_attempts:int = os.getenv("RETRY_MAX_ATTEMPTS", 8) # attempts before an event is dead-lettered
+    consume_batch_size:int = os.getenv("KAFKA_CONSUME_BATCH_SIZE", 500) # max messages per poll
+    validate_events:bool = os.getenv("CONSUMER_VALIDATE_EVENTS", True) # dead-letter events that are not a valid GameEvent
+    consume_timeout:float = os.getenv("KAFKA_CONSUME_TIMEOUT", 1.0) # seconds
+    kafka_connect_timeout:float = os.getenv("KAFKA_CONNECT_TIMEOUT", 10.0) # seconds to fetch topic metadata on startup
+    consumer_stats_interval_ms:int = os.getenv("KAFKA_STATS_INTERVAL_MS", 5000) # partition lag refresh, 0 disables
+    consume_queue_size:int = os.getenv("KAFKA_CONSUME_QUEUE_SIZE", 8) # batches waiting for the handler
+    consumer_workers:int = os.getenv("CONSUMER_WORKERS", 4) # asyncio worker lanes, events of one game share a lane
+    consumer_processes:int = os.getenv("CONSUMER_PROCESSES", 1) # consumer processes in the group, including the app
 
+    # live stream env variables
+    trace_sample_rate:float = os.getenv("TRACE_SAMPLE_RATE", 0.001) # share of event traces logged
+    trace_log_size:int = os.getenv("TRACE_LOG_SIZE", 500) # sampled traces kept for /traces
+    stream_history_size:int = os.getenv("STREAM_HISTORY_SIZE", 256) # events kept per game for reconnects
+    stream_queue_size:int = os.getenv("STREAM_QUEUE_SIZE", 64) # events a viewer can fall behind
+    stream_slow_policy:str = os.getenv("STREAM_SLOW_POLICY", "drop") # drop or sample slow viewers
+    stream_idle_seconds:float = os.getenv("STREAM_IDLE_SECONDS", 300) # seconds an unwatched game keeps its event history
+    stream_keepalive:float = os.getenv("STREAM_KEEPALIVE", 15) # seconds between SSE keepalives
 
 settings = Settings()
@@ -1,25 +1,90 @@
 """
 FastAPI App to consume Kafka messages to load to MongDB
 """
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 
-from services.consume_message import ConsumeMessage
+from api import events, state, stream
+from core.broker import is_embedded
+from core.config import settings
+from core.metrics import CONTENT_TYPE, REGISTRY
+from services.consume_messages import ConsumeMessage
+from services.hub import GameHub
+from services.workers import WorkerProcesses
 
 # Define a lifespan to start and stop a service on app startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await ConsumeMessage().start_service()
+    app.state.hub = GameHub(
+        history_size=settings.stream_history_size,
+        subscriber_queue_size=settings.stream_queue_size,
+        slow_policy=settings.stream_slow_policy,
+        idle_seconds=settings.stream_idle_seconds
+    )
+    app.state.consume_message = ConsumeMessage(hub=app.state.hub)
+    await app.state.consume_message.start_service()
+
+    # Extra processes cannot share the embedded broker
+    extra_processes = 0 if is_embedded(settings) else settings.consumer_processes - 1
+    app.state.workers = WorkerProcesses(max(0, extra_processes))
+    if app.state.workers.count:
+        app.state.workers.start()
     try:
         yield
     except KeyboardInterrupt:
         print('Shutting down service...')
     finally:
-        await ConsumeMessage().stop_service()
+        await asyncio.to_thread(app.state.workers.stop)
+        await app.state.consume_message.stop_service()
 
 app = FastAPI(lifespan=lifespan)
 
+app.include_router(stream.router)
+app.include_router(state.router)
+app.include_router(events.router)
+
 # Define root path - 200 health checks
 @app.get("/")
 def root():
     return {"message": "Event consumer is running..."}
+
+@app.get("/health")
+def health_check():
+    """
+    Consumer health check route (liveness): always 200 while the process serves,
+    the status tells whether the consumer is running
+    """
+    health = app.state.consume_message.health()
+    health["worker_processes_alive"] = app.state.workers.alive()
+    health["stream"] = app.state.hub.stats()
+    return {"status": "ok" if health["consumer_running"] else "degraded", **health}
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness: 200 once startup finished, the consumer is polling and MongoDB is
+    reachable, 503 otherwise (including while shutting down)
+    """
+    consume_message = getattr(app.state, "consume_message", None)
+    if consume_message is None:
+        return JSONResponse(status_code=503, content={"ready": False})
+    readiness = await consume_message.readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@app.get("/traces")
+def recent_traces():
+    """
+    Most recent sampled end-to-end event traces, newest last
+    """
+    tracer = app.state.consume_message.tracer
+    return {"traces": list(tracer.recent) if tracer else []}
+
+@app.get("/metrics")
+def metrics():
+    """
+    Metrics in the Prometheus text format. Only covers this process, worker
+    processes started with CONSUMER_PROCESSES keep their own metrics.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
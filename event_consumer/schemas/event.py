@@ -1,16 +1,52 @@
 """
 Schema validation for Event data doc
 """
-from datetime import datetime
-from pydantic import BaseModel, Field
+from datetime import datetime, timezone
+from pydantic import AfterValidator, BaseModel, Field, StringConstraints, TypeAdapter
 from typing import Optional, Annotated
+from typing_extensions import NotRequired, TypedDict
 
 class GameEvent(BaseModel):
-    game_id:str = Field(title="Game Identifier", description="Game Id for current game")
+    game_id:int = Field(title="Game Identifier", description="Game Id for current game")
     play_id:Optional[str] = Field(description="Play Id of current game event")
-    event_type: str = Field(description="Game event type (e.g. touchdown, field goal, tackle, etc.)")
+    event_type: str = Field(description="Game event type (e.g. scoring, game started, pause in action, etc.)")
+    event: str = Field(description="Game event (e.g. touchdown, field goal, tackle, etc.)")
     timestamp: Optional[datetime] = Field(default=None, description="Timestamp of current game event")
     player_id: int = Field(description="Player Id of player involved in current game event")
 
     class Config:
         from_attributes = True
+
+def utc_timestamp(value) -> str:
+    """
+    ISO 8601 timestamp (string or datetime) as a fixed-width UTC string, e.g.
+    2024-09-08T17:00:00.000000+00:00. Naive timestamps are taken as UTC. Stored
+    timestamps and query bounds share this form, so comparing them as strings
+    compares them in time.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+# ISO 8601 date and time as the codecs write it (datetime.isoformat), stored in UTC
+IsoTimestamp = Annotated[str, StringConstraints(
+    pattern=r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}:?\d{2})?$'
+), AfterValidator(utc_timestamp)]
+
+class GameEventRecord(TypedDict):
+    """
+    GameEvent as it is stored: validated into a plain dict, ready for MongoDB, with
+    the timestamp kept as the UTC ISO string the event queries compare against
+    """
+    game_id: int
+    play_id: Optional[str]
+    event_type: str
+    event: str
+    timestamp: NotRequired[Optional[IsoTimestamp]]
+    player_id: int
+
+# Compiled once, building a validator is far more expensive than running it
+EVENT_RECORD = TypeAdapter(GameEventRecord)
+EVENT_RECORDS = TypeAdapter(list[GameEventRecord])
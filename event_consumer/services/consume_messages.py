@@ -1,56 +1,319 @@
 """
 Module for consume message functions
 """
+import time
 import asyncio
+import functools
 import contextlib
 
+from core.broker import create_consumer, create_sync_producer
 from core.config import settings
-from services.mongodb import MongoDataManager
-from services.consumer import ConsumerService
+from services.mongodb import create_data_manager
+from services.consumer import ConsumerService, EmbeddedConsumerService
+from services.dead_letter import DeadLetterPublisher, RetryPolicy
+from services.decoder import EventDecoder
+from services.game_state import GameStateStore
+from services.offsets import OffsetTracker
+from services.pipeline import EventPipeline, RecentKeyFilter
+from services.sink import MongoBatchSink
+from services.tracing import Tracer
 
 class ConsumeMessage:
-    def __init__(self):
+    def __init__(self, hub = None):
+        """
+        params:
+            - hub (GameHub): live stream hub that receives every decoded event, optional
+        """
+        self.hub = hub
         self.consumer = None
         self.mongodb = None
         self.consumer_task = None
-        self.shutdown_event = asyncio.Event()
+        self.queue = None
+        self.pipeline = None
+        self.offsets = None
+        self.dead_letter = None
+        self.game_states = None
+        self.tracer = None
+        self.ready = False
+        self.mongodb_reachable = False
+        self.mongodb_checked = None # monotonic time of the last ping
+        self.indexes_created = False
+        self.index_task = None
+        self.kafka_connected = False
+        self.startup_seconds = None
+
+    async def _mongodb_call(self, method, *args, **kwargs):
+        """
+        Run a data manager method on either driver
+        """
+        if asyncio.iscoroutinefunction(method):
+            return await method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def _ping_mongodb(self, verbose:bool = True) -> bool:
+        self.mongodb_checked = time.monotonic()
+        self.mongodb_reachable = await self._mongodb_call(
+            self.mongodb.ping, timeout=settings.mongodb_ping_timeout, verbose=verbose
+        )
+        return self.mongodb_reachable
+
+    async def _create_indexes(self):
+        await self._mongodb_call(self.mongodb.create_query_indexes)
+        if settings.mongodb_write_mode == "upsert":
+            await self._mongodb_call(self.mongodb.create_unique_index)
+        self.indexes_created = True
+
+    async def _start_mongodb(self):
+        """
+        Connect to MongoDB, ping it and create the indexes. When the ping fails the
+        indexes are created in the background once MongoDB answers, so an unreachable
+        cluster does not fail the startup. Returns whether the ping succeeded.
+        """
+        if settings.mongodb_driver == "async":
+            self.mongodb = create_data_manager()
+        else:
+            # The sync client resolves the mongodb+srv DNS records when it is created
+            self.mongodb = await asyncio.to_thread(create_data_manager)
+
+        if await self._ping_mongodb():
+            try:
+                await self._create_indexes()
+            except Exception as err:
+                print('Issue creating MongoDB indexes, retrying in the background: ', err)
+
+        if not self.indexes_created:
+            self.index_task = asyncio.create_task(self._create_indexes_in_background())
+        return self.mongodb_reachable
+
+    async def _create_indexes_in_background(self):
+        """
+        Ping with backoff until MongoDB answers, then create the indexes
+        """
+        retry_policy = RetryPolicy(
+            base_delay=settings.retry_base_delay,
+            max_delay=settings.retry_max_delay,
+            max_attempts=settings.retry_max_attempts
+        )
+        attempt = 0
+        while not self.indexes_created:
+            attempt += 1
+            await asyncio.sleep(retry_policy.delay(attempt))
+            if not await self._ping_mongodb(verbose=False):
+                continue
+            try:
+                await self._create_indexes()
+                print('MongoDB reachable, indexes created')
+            except Exception as err:
+                print(f'Issue creating MongoDB indexes (attempt {attempt}): ', err)
+
+    async def _connect_kafka(self):
+        """
+        Open the consumer's broker connections ahead of the first poll. Not fatal:
+        the client keeps reconnecting once polling starts.
+        """
+        try:
+            await asyncio.to_thread(self.consumer.connect, settings.kafka_connect_timeout)
+            return True
+        except Exception as err:
+            print('Issue connecting to Kafka: ', err)
+            return False
 
     async def start_service(self):
         """
-        Start MongoDB and Kafka Connections
+        Start MongoDB and Kafka Connections. MongoDB, the Kafka consumer and the
+        dead-letter producer are connected concurrently.
         """
         print(f'Connecting to MongoDB....Subscribing to Kafka topic {settings.topic}....')
-        self.mongodb = MongoDataManager()
-        self.consumer = ConsumerService(
+        start = time.perf_counter()
+        self.consumer = create_consumer(
+            settings,
+            kafka=lambda: ConsumerService(
+                bootstrap_server=settings.boostrap_server,
+                group_id=settings.group_id,
+                auto_offset=settings.offset,
+                topics=[settings.topic],
+                batch_size=settings.consume_batch_size,
+                poll_timeout=settings.consume_timeout,
+                stats_interval_ms=settings.consumer_stats_interval_ms
+            ),
+            embedded=lambda broker: EmbeddedConsumerService(
+                broker=broker,
+                group_id=settings.group_id or "event-consumer",
+                topics=[settings.topic],
+                batch_size=settings.consume_batch_size
+            )
+        )
+        self.dead_letter = DeadLetterPublisher(
             bootstrap_server=settings.boostrap_server,
-            group_id=settings.group_id,
-            auto_offset=settings.offset,
-            topics=[settings.topic]
+            topic=settings.dead_letter_topic or f'{settings.topic}-dlq',
+            create_producer=functools.partial(create_sync_producer, settings)
+        )
+        self.mongodb_reachable, self.kafka_connected, _ = await asyncio.gather(
+            self._start_mongodb(),
+            self._connect_kafka(),
+            asyncio.to_thread(self.dead_letter.start)
+        )
+
+        self.offsets = OffsetTracker(self.consumer)
+        self.tracer = Tracer(sample_rate=settings.trace_sample_rate, log_size=settings.trace_log_size)
+
+        # One sink per worker lane so every lane writes its games' events independently
+        retry_policy = RetryPolicy(
+            base_delay=settings.retry_base_delay,
+            max_delay=settings.retry_max_delay,
+            max_attempts=settings.retry_max_attempts
         )
+        sinks = [
+            MongoBatchSink(
+                store=self.mongodb,
+                offsets=self.offsets,
+                batch_size=settings.sink_batch_size,
+                flush_interval=settings.sink_flush_interval,
+                max_inflight=settings.sink_max_inflight,
+                max_pending=settings.sink_max_pending,
+                write_mode=settings.mongodb_write_mode,
+                retry_policy=retry_policy,
+                dead_letter=self.dead_letter,
+                tracer=self.tracer
+            )
+            for _ in range(settings.consumer_workers)
+        ]
+        self.pipeline = EventPipeline(
+            decode=EventDecoder(validate=settings.validate_events).decode_batch,
+            offsets=self.offsets,
+            sinks=sinks,
+            queue_size=settings.consume_queue_size,
+            dead_letter=self.dead_letter,
+            key_filter=RecentKeyFilter(settings.dedup_cache_size),
+            tracer=self.tracer
+        )
+        if self.hub is not None:
+            # Viewers get events as soon as they are decoded, before the MongoDB write
+            self.pipeline.add_stage(self.hub.publish_events)
+            self.pipeline.add_stage(self.tracer.published_events)
 
-        self.consumer_task = asyncio.create_task(
-            await self.consumer.consume_message(handler=self.mongodb.add_one_doc)
+        self.game_states = GameStateStore(
+            store=self.mongodb,
+            flush_interval=settings.state_flush_interval,
+            idle_seconds=settings.state_idle_seconds,
+            max_games=settings.state_max_games,
+            retry_policy=RetryPolicy(
+                base_delay=settings.retry_base_delay,
+                max_delay=settings.retry_max_delay,
+                max_attempts=settings.state_read_attempts
+            )
         )
+        self.pipeline.add_stage(self.game_states.apply_events)
+        await self.game_states.start()
+        await self.pipeline.start()
+
+        # Batches flow from the polling thread to the handler task through this queue
+        self.queue = asyncio.Queue(maxsize=settings.consume_queue_size)
+        self.consumer_task = asyncio.create_task(self._dispatch())
+        self.consumer.start(asyncio.get_running_loop(), self.queue)
+
+        self.ready = True
+        self.startup_seconds = time.perf_counter() - start
+        print(f'Ready after {self.startup_seconds:.3f}s')
+
+    async def _dispatch(self):
+        """
+        Hand each polled batch to the message handler
+        """
+        while True:
+            batch = await self.queue.get()
+            try:
+                await self.handle_batch(batch)
+            except Exception as err:
+                print('Issue handling message batch: ', err)
+            finally:
+                self.queue.task_done()
+
+    async def handle_batch(self, messages:list):
+        """
+        Hand a batch of Kafka messages to the processing pipeline
+        """
+        await self.pipeline.submit(messages)
+
+    def health(self):
+        """
+        Consumer thread state and number of batches waiting to be handled
+        """
+        return {
+            "consumer_running": bool(self.consumer and self.consumer.running),
+            "queued_batches": self.queue.qsize() if self.queue else 0,
+            "queued_per_worker": self.pipeline.queued() if self.pipeline else [],
+            "uncommitted_per_partition": self.offsets.pending() if self.offsets else {}
+        }
+
+    async def readiness(self):
+        """
+        Startup finished, the consumer is polling and MongoDB answered a ping. The
+        ping is repeated once the last result is older than MONGODB_PING_CACHE_SECONDS,
+        so a cluster that becomes unreachable turns the service unready again.
+        """
+        if (self.ready and self.mongodb is not None and self.mongodb_checked is not None
+                and time.monotonic() - self.mongodb_checked >= settings.mongodb_ping_cache_seconds):
+            await self._ping_mongodb(verbose=False)
+
+        consumer_running = bool(self.consumer and self.consumer.running)
+        return {
+            "ready": self.ready and consumer_running and self.mongodb_reachable,
+            "consumer_running": consumer_running,
+            "mongodb_reachable": self.mongodb_reachable,
+            "mongodb_indexes_created": self.indexes_created,
+            "kafka_connected": self.kafka_connected,
+            "startup_seconds": self.startup_seconds
+        }
 
     async def stop_service(self):
         """
         Stop MongoDB and Kafka Connections
         """
         print('Shutting down Kafka and MongoDB connections...')
-        self.shutdown_event.set()
+        self.ready = False
 
-        if hasattr(self.consumer, "stop"):
+        if self.index_task is not None:
+            self.index_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.index_task
+
+        # Stop fetching, let the handler finish what was polled, then write and commit it
+        if self.consumer is not None:
             with contextlib.suppress(Exception):
-                await self.consumer.shutdown()
+                await asyncio.to_thread(self.consumer.stop_polling)
+
+        if self.queue is not None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.queue.join(), timeout=settings.sink_flush_interval * 10)
 
         if self.consumer_task:
             self.consumer_task.cancel()
             with contextlib.suppress(asyncio.CancelledError):
                 await self.consumer_task
 
-        if hasattr(self.mongodb, "shutdown"):
+        if self.pipeline is not None:
+            await self.pipeline.stop(timeout=settings.sink_flush_interval * 10)
+
+        if self.game_states is not None:
+            try:
+                await self.game_states.stop()
+            except Exception as err:
+                print('Issue writing game states on shutdown: ', err)
+
+        if self.dead_letter is not None:
+            with contextlib.suppress(Exception):
+                await self.dead_letter.close()
+            if self.offsets is not None:
+                # Dead-lettered messages delivered while closing
+                await self.offsets.commit()
+
+        if self.consumer is not None:
+            with contextlib.suppress(Exception):
+                await asyncio.to_thread(self.consumer.shutdown)
+
+        if self.mongodb is not None:
             with contextlib.suppress(Exception):
-                await self.mongodb.shutdown()
+                self.mongodb.shutdown()
 
         print('Shutting down service completed....')
-        
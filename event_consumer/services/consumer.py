@@ -1,68 +1,278 @@
 """
 Module for Kafa Consumer Service
 """
-from confluent_kafka import Consumer
+import json
+import asyncio
+import threading
+import concurrent.futures
+from confluent_kafka import Consumer, KafkaError, TopicPartition
+
+from core.metrics import SIZE_BUCKETS, Gauge, Histogram
+
+POLL_BATCH_SIZE = Histogram("consumer_poll_batch_size", "Messages returned by one poll",
+                            buckets=SIZE_BUCKETS)
+CONSUMER_LAG = Gauge("consumer_lag", "Messages behind the end of each assigned partition",
+                     ("topic", "partition"))
 
 # Don't forget to type each parameter for documentation
 class ConsumerService:
-    def __init__(self, bootstrap_server, group_id, auto_offset, topics):
+    def __init__(
+            self,
+            bootstrap_server:str,
+            group_id:str,
+            auto_offset:str,
+            topics:list,
+            batch_size:int = 500,
+            poll_timeout:float = 1.0,
+            stats_interval_ms:int = 5000
+            ):
+        """
+        Initialize Kafka consumer
+
+        params:
+            - bootstrap_server (str): Kafka bootstrap servers
+            - group_id (str): consumer group id
+            - auto_offset (str): offset reset policy (earliest or latest)
+            - topics (list): topics to subscribe to
+            - batch_size (int): maximum number of messages returned by one poll
+            - poll_timeout (float): seconds to wait for a batch to fill
+            - stats_interval_ms (int): how often librdkafka reports partition lag, 0 disables it
+        """
         self.bootstrap_server = bootstrap_server
         self.group_id = group_id
         self.auto_offset = auto_offset
         self.topics = topics
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.stats_interval_ms = stats_interval_ms
 
-        # Create consumer method would be here
-        self.consumer = self._create_consumer()
+        # The client is created by connect() or start(), so building the service opens nothing
+        self.consumer = None
+        self._thread = None
+        self._stop = threading.Event()
 
     # internal method to create consumer - subscribe to topic
     def _create_consumer(self):
         config = {
             'bootstrap.servers': self.bootstrap_server,
             'group.id': self.group_id,
-            'auto.offset.reset': self.auto_offset
+            'auto.offset.reset': self.auto_offset,
+            # Offsets are committed by the sink once the batch is stored
+            'enable.auto.commit': False
         }
+        if self.stats_interval_ms:
+            config['statistics.interval.ms'] = self.stats_interval_ms
+            config['stats_cb'] = self._on_stats
 
         return Consumer(config)
 
+    @staticmethod
+    def _on_stats(stats_json:str):
+        """
+        librdkafka statistics callback (runs on the polling thread): publish the
+        consumer lag of every assigned partition
+        """
+        try:
+            stats = json.loads(stats_json)
+        except ValueError:
+            return
+
+        for topic, topic_stats in stats.get("topics", {}).items():
+            for partition, partition_stats in topic_stats.get("partitions", {}).items():
+                lag = partition_stats.get("consumer_lag", -1)
+                if partition != "-1" and lag >= 0: # -1 is the internal partition / unknown lag
+                    CONSUMER_LAG.labels(topic, partition).set(lag)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def connect(self, timeout:float = 10.0):
+        """
+        Create the client and fetch the topic metadata, which opens the broker
+        connections before the first poll. Blocking, run it on a thread.
+        """
+        if self.consumer is None:
+            self.consumer = self._create_consumer()
+        for topic in self.topics:
+            self.consumer.list_topics(topic, timeout=timeout)
+
+    def start(self, loop:asyncio.AbstractEventLoop, queue:asyncio.Queue):
+        """
+        Start polling on a dedicated thread. Each non-empty poll is put on queue
+        as one list of messages. When the queue is full the polling thread waits,
+        which stops fetching until the handlers catch up.
+
+        params:
+            - loop (AbstractEventLoop): event loop that owns queue
+            - queue (asyncio.Queue): bounded queue of message batches
+        """
+        if self.consumer is None:
+            self.consumer = self._create_consumer()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.consume_message,
+            args=(loop, queue),
+            name="kafka-consumer",
+            daemon=True
+        )
+        self._thread.start()
+
     # method to actually consume messages from the topic
-    def consume_message(self, handler, timeout=1.0):
+    def consume_message(self, loop:asyncio.AbstractEventLoop, queue:asyncio.Queue):
+        """
+        Polling loop run by the consumer thread
+        """
         # First you neeed to subscribe to a topic
         try:
             self.consumer.subscribe(self.topics)
             print(f'Subscribed to {self.topics}')
 
-            while True:
-                message = self.consumer.poll(timeout)
-                if message is None:
+            while not self._stop.is_set():
+                messages = self.consumer.consume(num_messages=self.batch_size, timeout=self.poll_timeout)
+                if not messages:
                     continue
+                POLL_BATCH_SIZE.observe(len(messages))
+
+                batch = []
+                for message in messages:
+                    error = message.error()
+                    if error is None:
+                        batch.append(message)
+                    elif error.code() != KafkaError._PARTITION_EOF:
+                        print(f'Issue with consumer service: {error}')
+
+                if batch:
+                    self._put(loop, queue, batch)
+
+        except Exception as err:
+            print('Consumer service stopped with an error: ', err)
+
+    def _put(self, loop, queue, batch):
+        """
+        Hand a batch to the event loop, waiting while the queue is full
+        """
+        future = asyncio.run_coroutine_threadsafe(queue.put(batch), loop)
+        while not self._stop.is_set():
+            try:
+                future.result(timeout=self.poll_timeout)
+                return
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+
+    def commit_offsets(self, offsets:dict):
+        """
+        Synchronously commit processed offsets
+
+        params:
+            - offsets (dict): (topic, partition) -> offset of the last processed message
+        """
+        if not offsets:
+            return
 
-                if message.error():
-                    print(f'Issue with consumer service: {message.error()}')
+        self.consumer.commit(
+            offsets=[TopicPartition(topic, partition, offset + 1) # commit the next offset to read
+                     for (topic, partition), offset in offsets.items()],
+            asynchronous=False
+        )
 
-                print(f'Recieved message: {message.key()}:{message.value()}')
-                handler(message)
+    def stop_polling(self, timeout:float = 10.0):
+        """
+        Stop the polling thread. The consumer stays open so offsets can still be committed.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
 
-        except KeyboardInterrupt:
-            print('Consumer service interuppted....')
-        finally:
+    def shutdown(self, timeout:float = 10.0):
+        """
+        shutdown Kafka connection. Blocks until the polling thread has stopped.
+        """
+        self.stop_polling(timeout)
+        if self.consumer is not None:
             self.consumer.close()
-            print('Consumer service is closed...')
+        print('Consumer service is closed...')
+
+class EmbeddedConsumerService:
+    """
+    Consumer on the embedded broker with the ConsumerService interface. Records
+    are moved from the broker to the handler queue by a task on the event loop, so
+    no polling thread is needed.
+    """
+    def __init__(
+            self,
+            broker,
+            group_id:str,
+            topics:list,
+            batch_size:int = 500
+            ):
+        """
+        Initialize embedded consumer
 
-    def shutdown(self):
+        params:
+            - broker (EmbeddedBroker): in-process broker
+            - group_id (str): consumer group id, committed offsets are kept per group
+            - topics (list): topics to subscribe to
+            - batch_size (int): maximum number of records handed over at once
         """
-        shutdown Kafka connection
+        self.broker = broker
+        self.group_id = group_id
+        self.topics = topics
+        self.batch_size = batch_size
+        self._loop = None
+        self._subscriptions = []
+        self._tasks = []
+
+    @property
+    def running(self):
+        return any(not task.done() for task in self._tasks)
+
+    def connect(self, timeout:float = 10.0):
+        pass
+
+    def start(self, loop:asyncio.AbstractEventLoop, queue:asyncio.Queue):
+        """
+        Subscribe and start forwarding records to queue in batches. Must be called on loop.
         """
-        self.consumer.close()
+        self._loop = loop
+        self._subscriptions = [self.broker.subscribe(topic, self.group_id) for topic in self.topics]
+        self._tasks = [loop.create_task(self._forward(subscription, queue))
+                       for subscription in self._subscriptions]
+        print(f'Subscribed to {self.topics} on the embedded broker')
 
-# def handle_message(msg):
-#     print(f"Processing message: {msg.value().decode('utf-8')}")
-#     # This will be the mongodb insert here
+    async def _forward(self, subscription, queue:asyncio.Queue):
+        while True:
+            batch = [await subscription.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(subscription.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            POLL_BATCH_SIZE.observe(len(batch))
+            await queue.put(batch)
 
-# consumer = ConsumerService(
-#     bootstrap_server='localhost:9092',
-#     group_id='my-event-group',
-#     auto_offset='earliest', # change to latest to only get the most recent message. Earliest will look for everything
-#     topics=['game-event']
-# )
+    def commit_offsets(self, offsets:dict):
+        """
+        Commit processed offsets
+
+        params:
+            - offsets (dict): (topic, partition) -> offset of the last processed message
+        """
+        if offsets:
+            self.broker.commit(self.group_id, {position: offset + 1 for position, offset in offsets.items()})
+
+    def stop_polling(self, timeout:float = 10.0):
+        """
+        Stop forwarding records. Safe to call from any thread.
+        """
+        for task in self._tasks:
+            self._loop.call_soon_threadsafe(task.cancel)
+        for subscription in self._subscriptions:
+            self._loop.call_soon_threadsafe(self.broker.unsubscribe, subscription)
+        self._tasks, self._subscriptions = [], []
 
-# consumer.consume_message(handler=handle_message)
+    def shutdown(self, timeout:float = 10.0):
+        self.stop_polling(timeout)
+        print('Consumer service is closed...')
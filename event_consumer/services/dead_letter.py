@@ -0,0 +1,239 @@
+"""
+Module for failed event handling: dead-letter topic and retry policy
+"""
+import time
+import random
+import asyncio
+import functools
+import contextlib
+from collections import deque
+from datetime import datetime, timezone
+from bson.errors import InvalidDocument
+from confluent_kafka import Producer
+
+from core.codec import CODEC_HEADER, get_codec
+
+class DocumentRejected(Exception):
+    """
+    MongoDB refused one document of a bulk write (a write error inside BulkWriteError)
+    """
+    def __init__(self, code:int, message:str):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+
+# Per-document rejections by the driver or the server - retrying cannot help. Anything
+# else (timeouts, lost connections, elections, bugs) goes through the retry policy.
+POISON_ERRORS = (InvalidDocument, DocumentRejected)
+
+def is_poison(err:Exception) -> bool:
+    """
+    Return True for failures that will fail again however often they are retried
+    """
+    return isinstance(err, POISON_ERRORS)
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter
+    """
+    def __init__(self, base_delay:float, max_delay:float, max_attempts:int):
+        """
+        params:
+            - base_delay (float): delay in seconds before the first retry
+            - max_delay (float): longest delay in seconds between retries
+            - max_attempts (int): attempts (including the first) before giving up
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def delay(self, attempt:int) -> float:
+        """
+        Seconds to wait after the given failed attempt (1 for the first failure)
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def exhausted(self, attempt:int) -> bool:
+        return attempt >= self.max_attempts
+
+class DeadLetterPublisher:
+    """
+    Publishes events that cannot be stored to a dead-letter topic. The original
+    payload is kept as the message value and the failure is described in headers.
+
+    Producing is asynchronous: messages the producer's full local queue refuses wait
+    in a backlog and are produced, in order, by a background task that also serves
+    the delivery reports. A message's on_delivered callback runs on the event loop
+    once the broker confirmed it, so the caller commits its offset only then. A
+    message that failed delivery goes back to the backlog. When backlog_size
+    messages are waiting, publishing waits for room instead of dropping any.
+    """
+    def __init__(
+            self,
+            bootstrap_server:str,
+            topic:str,
+            producer = None,
+            create_producer = None,
+            backlog_size:int = 10000
+            ):
+        """
+        params:
+            - bootstrap_server (str): Kafka bootstrap servers
+            - topic (str): dead-letter topic
+            - producer: client with the confluent_kafka Producer interface, defaults to one created by start()
+            - create_producer (callable): called by start() with the Kafka producer factory, returns the
+              client to use (e.g. core.broker.create_sync_producer bound to the settings), None uses Kafka
+            - backlog_size (int): messages kept while the producer's local queue is full
+        """
+        self.topic = topic
+        self.published = 0
+        self.failed = 0
+        self.bootstrap_server = bootstrap_server
+        self.backlog_size = backlog_size
+        self._backlog = deque() # (key, value, headers, on_delivered) not yet taken by the producer
+        self._codec = get_codec("json")
+        self._loop = None
+        self._poller = None
+        # Created by start() unless a client is given
+        self._producer = producer
+        self._create_producer = create_producer
+
+    def start(self):
+        """
+        Create the producer client
+        """
+        if self._producer is None:
+            if self._create_producer is not None:
+                self._producer = self._create_producer(self._create_kafka_producer)
+            else:
+                self._producer = self._create_kafka_producer()
+
+    def _create_kafka_producer(self):
+        return Producer({
+            'bootstrap.servers': self.bootstrap_server,
+            'enable.idempotence': True
+        })
+
+    def _on_delivery(self, entry:tuple, err, message):
+        """
+        Delivery report of one message. Runs on whichever thread polls the producer,
+        so the outcome is handed to the event loop.
+        """
+        if err is None:
+            if entry[3] is not None:
+                self._call_soon(entry[3])
+            return
+
+        self.failed += 1
+        print(f'Issue publishing to dead-letter topic {self.topic}, retrying: {err}')
+        self._call_soon(self._backlog.append, entry)
+
+    def _call_soon(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError: # loop closed, the message's offset stays uncommitted
+            pass
+
+    async def _produce(self, key, value, headers:list, on_delivered = None):
+        self._loop = asyncio.get_running_loop()
+        # Backpressure: wait for the producer to take part of the backlog
+        while len(self._backlog) >= self.backlog_size:
+            self._produce_backlog()
+            if len(self._backlog) >= self.backlog_size:
+                await asyncio.sleep(0.05)
+
+        self._backlog.append((key, value, headers, on_delivered))
+        self._produce_backlog()
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll_periodically())
+
+    async def _poll_periodically(self):
+        """
+        Serve delivery reports and produce the backlog until nothing is outstanding
+        """
+        try:
+            while True:
+                await asyncio.sleep(0.05)
+                self._produce_backlog()
+                if not self._backlog and not self._producer.flush(0):
+                    return
+        finally:
+            self._poller = None
+
+    def _produce_backlog(self):
+        """
+        Hand the backlog to the producer until its local queue is full. Never blocks,
+        publishing runs on the event loop thread.
+        """
+        # Serve delivery reports first, that frees room in the local queue
+        self._producer.poll(0)
+        while self._backlog:
+            entry = self._backlog[0]
+            key, value, headers, _ = entry
+            try:
+                self._producer.produce(self.topic, key=key, value=value, headers=headers,
+                                       on_delivery=functools.partial(self._on_delivery, entry))
+            except BufferError:
+                return
+            self._backlog.popleft()
+            self.published += 1
+
+    @staticmethod
+    def _error_headers(err:Exception, stage:str, attempts:int):
+        return [
+            ("dlq-stage", stage.encode("utf-8")),
+            ("dlq-error-type", type(err).__name__.encode("utf-8")),
+            ("dlq-error-message", str(err)[:1024].encode("utf-8")),
+            ("dlq-attempts", str(attempts).encode("utf-8")),
+            ("dlq-failed-at", datetime.now(timezone.utc).isoformat().encode("utf-8"))
+        ]
+
+    async def publish_message(self, message, err:Exception, stage:str = "decode", attempts:int = 1,
+                              on_delivered = None):
+        """
+        Dead-letter a Kafka message as it was received (e.g. it could not be decoded).
+        on_delivered is called on the event loop once the broker has the message.
+        """
+        headers = list(message.headers() or []) + self._error_headers(err, stage, attempts) + [
+            ("dlq-original-topic", str(message.topic()).encode("utf-8")),
+            ("dlq-original-partition", str(message.partition()).encode("utf-8")),
+            ("dlq-original-offset", str(message.offset()).encode("utf-8"))
+        ]
+        await self._produce(message.key(), message.value(), headers, on_delivered)
+
+    async def publish_document(self, document:dict, err:Exception, stage:str = "write", attempts:int = 1,
+                               on_delivered = None):
+        """
+        Dead-letter a decoded event (e.g. MongoDB rejected it), encoded as JSON.
+        on_delivered is called on the event loop once the broker has the message.
+        """
+        document = {field: value for field, value in document.items() if field != "_id"}
+        headers = [(CODEC_HEADER, self._codec.name.encode("utf-8"))] + self._error_headers(err, stage, attempts)
+        key = f'game-key-{document.get("game_id")}'.encode("utf-8") # keyed like the game's events
+        await self._produce(key, self._codec.encode(document), headers, on_delivered)
+
+    async def close(self, timeout:float = 10.0):
+        """
+        Wait for queued dead-letter messages to be delivered. Messages still undelivered
+        afterwards never call on_delivered, their offsets stay uncommitted.
+        """
+        if self._producer is None:
+            return
+
+        if self._poller is not None:
+            self._poller.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._poller
+        await asyncio.to_thread(self._drain, timeout)
+
+    def _drain(self, timeout:float):
+        deadline = time.monotonic() + timeout
+        while self._backlog and time.monotonic() < deadline:
+            self._produce_backlog()
+            if self._backlog:
+                self._producer.poll(0.1)
+        if self._backlog:
+            print(f'{len(self._backlog)} dead-letter messages were never handed to the producer')
+
+        remaining = self._producer.flush(max(0.0, deadline - time.monotonic()))
+        if remaining:
+            print(f'{remaining} dead-letter messages were not delivered')
@@ -0,0 +1,103 @@
+"""
+Module for decoding and validating polled messages
+"""
+from pydantic import ValidationError
+
+from core.codec import codec_from_headers
+from schemas.event import EVENT_RECORD, EVENT_RECORDS, utc_timestamp
+
+def _stage(err:ValidationError) -> str:
+    """
+    "decode" when the bytes are not JSON at all, "validate" when they are not a GameEvent
+    """
+    return "decode" if any(error["type"] == "json_invalid" for error in err.errors()) else "validate"
+
+def _normalized(document:dict) -> dict:
+    """
+    Unvalidated document with its timestamp in the stored UTC form, left as it is when it does not parse
+    """
+    timestamp = document.get("timestamp")
+    if timestamp:
+        try:
+            document["timestamp"] = utc_timestamp(timestamp)
+        except (TypeError, ValueError):
+            pass
+    return document
+
+class EventDecoder:
+    """
+    Turns polled messages into validated event documents (GameEventRecord).
+
+    JSON messages are parsed and validated in one pass, straight from the message
+    bytes, by the compiled validator, so no intermediate dict is built. Messages in
+    the other codecs are decoded first and the batch is validated in one call; only
+    when that call fails are its events validated one by one to split the invalid
+    ones off. A batch of valid events therefore raises no exception.
+    """
+    def __init__(self, validate:bool = True):
+        """
+        params:
+            - validate (bool): False only decodes, like before the schema was enforced
+        """
+        self.validate = validate
+
+    def decode(self, message) -> dict:
+        """
+        Decode and validate one message. raises ValidationError for an invalid event
+        """
+        codec = codec_from_headers(message.headers())
+        if not self.validate:
+            return _normalized(codec.decode(message.value()))
+        if codec.name == "json":
+            return EVENT_RECORD.validate_json(message.value())
+        return EVENT_RECORD.validate_python(codec.decode(message.value()))
+
+    def decode_batch(self, messages:list):
+        """
+        Decode and validate a polled batch
+
+        Returns (decoded, failed): decoded holds (message, document) pairs in message
+        order, failed holds (message, error, stage) for messages that could not be
+        decoded (stage "decode") or are not valid events (stage "validate").
+        """
+        documents = [None] * len(messages)
+        failed = {} # index -> (error, stage)
+        pending = [] # decoded, not yet validated: (index, dict)
+
+        for idx, message in enumerate(messages):
+            try:
+                codec = codec_from_headers(message.headers())
+                if self.validate and codec.name == "json":
+                    documents[idx] = EVENT_RECORD.validate_json(message.value())
+                    continue
+                document = codec.decode(message.value())
+            except ValidationError as err:
+                failed[idx] = (err, _stage(err))
+                continue
+            except Exception as err:
+                failed[idx] = (err, "decode")
+                continue
+
+            if self.validate:
+                pending.append((idx, document))
+            else:
+                documents[idx] = _normalized(document)
+
+        if pending:
+            try:
+                valid = EVENT_RECORDS.validate_python([document for _, document in pending])
+            except ValidationError:
+                valid = None
+
+            if valid is not None:
+                for (idx, _), document in zip(pending, valid):
+                    documents[idx] = document
+            else:
+                for idx, document in pending:
+                    try:
+                        documents[idx] = EVENT_RECORD.validate_python(document)
+                    except ValidationError as err:
+                        failed[idx] = (err, "validate")
+
+        decoded = [(message, documents[idx]) for idx, message in enumerate(messages) if idx not in failed]
+        return decoded, [(messages[idx], err, stage) for idx, (err, stage) in sorted(failed.items())]
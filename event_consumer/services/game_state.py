@@ -0,0 +1,284 @@
+"""
+Module for the live game state view
+"""
+import re
+import time
+import asyncio
+import contextlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from core.metrics import Counter
+
+STATE_READ_FAILURES = Counter("consumer_game_state_read_failures",
+                              "Games whose stored state could not be read, their events skipped the live view")
+
+# Points per scoring event, matched on the normalized event text
+POINTS = {
+    "touchdown": 6,
+    "field goal": 3,
+    "safety": 2,
+    "two point conversion": 2,
+    "extra point": 1
+}
+
+_NOT_WORD = re.compile(r"[^a-z0-9 ]+")
+
+def _points(event:str) -> int:
+    if not event:
+        return 0
+    return POINTS.get(_NOT_WORD.sub("", event.lower().replace("-", " ")).strip(), 0)
+
+class GameState:
+    """
+    Current state of one game, updated one event at a time.
+
+    Events do not say which team scored, so there is no per-team score: combined_points
+    is the points of both teams together, and player_points the points per player.
+
+    A state is stale when some of the game's events could not be applied (its stored
+    state could not be read when they arrived); its counts then miss those events.
+    """
+    __slots__ = ("game_id", "events", "scoring_plays", "combined_points", "last_play",
+                 "event_types", "player_events", "player_points", "offsets", "stale", "_snapshot")
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.events = 0
+        self.scoring_plays = 0
+        self.combined_points = 0
+        self.last_play = None
+        self.event_types = {}
+        self.player_events = {}
+        self.player_points = {}
+        self.offsets = {} # "topic:partition" -> offset of the last applied event
+        self.stale = False
+        self._snapshot = None
+
+    @classmethod
+    def from_document(cls, document:dict):
+        state = cls(document["game_id"])
+        for field in ("events", "scoring_plays", "combined_points", "last_play",
+                      "event_types", "player_events", "player_points", "offsets", "stale"):
+            if field in document:
+                setattr(state, field, document[field])
+        if "total_points" in document: # written before the field was renamed
+            state.combined_points = document["total_points"]
+        return state
+
+    def apply(self, position:tuple, document:dict) -> bool:
+        """
+        Apply one event. Returns False (and changes nothing) when the event's offset
+        was already applied, e.g. after a redelivery.
+        """
+        topic, partition, offset = position
+        partition_key = f'{topic}:{partition}'
+        if self.offsets.get(partition_key, -1) >= offset:
+            return False
+        self.offsets[partition_key] = offset
+
+        player = str(document.get("player_id"))
+        event_type = document.get("event_type")
+        points = _points(document.get("event"))
+
+        self.events += 1
+        self.event_types[event_type] = self.event_types.get(event_type, 0) + 1
+        self.player_events[player] = self.player_events.get(player, 0) + 1
+        if event_type == "scoring" or points:
+            self.scoring_plays += 1
+            self.combined_points += points
+            self.player_points[player] = self.player_points.get(player, 0) + points
+
+        self.last_play = {
+            "play_id": document.get("play_id"),
+            "event_type": event_type,
+            "event": document.get("event"),
+            "player_id": document.get("player_id"),
+            "timestamp": document.get("timestamp")
+        }
+        self._snapshot = None
+        return True
+
+    def to_document(self) -> dict:
+        """
+        State as a game_state document. The document is cached until the next event,
+        so repeated reads cost nothing.
+        """
+        if self._snapshot is None:
+            self._snapshot = {
+                "_id": str(self.game_id),
+                "game_id": self.game_id,
+                "events": self.events,
+                "scoring_plays": self.scoring_plays,
+                "combined_points": self.combined_points,
+                "last_play": self.last_play,
+                "event_types": dict(self.event_types),
+                "player_events": dict(self.player_events),
+                "player_points": dict(self.player_points),
+                "offsets": dict(self.offsets),
+                "stale": self.stale,
+                "updated_at": datetime.now(timezone.utc)
+            }
+        return self._snapshot
+
+class GameStateStore:
+    """
+    In-memory game states, updated incrementally by the event pipeline. Changed
+    states are written back to the game_state collection in one bulk write every
+    flush_interval seconds, however many events they received in between.
+
+    Once written back, states without events for idle_seconds, and the least
+    recently updated ones beyond max_games, are dropped from memory. A dropped
+    game is read back from the collection when its next event arrives.
+    """
+    def __init__(
+            self,
+            store,
+            flush_interval:float,
+            idle_seconds:float = 600.0,
+            max_games:int = 10000,
+            retry_policy = None
+            ):
+        """
+        params:
+            - store (MongoDataManager | AsyncMongoDataManager): data manager for the game_state collection
+            - flush_interval (float): seconds between write-backs
+            - idle_seconds (float): seconds without events before a written-back state is dropped
+            - max_games (int): states kept in memory, the least recently updated is dropped first
+            - retry_policy (RetryPolicy): backoff for reading a stored state, None tries once
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        self.max_games = max_games
+        self.retry_policy = retry_policy
+        self.evicted = 0
+        self._async_store = asyncio.iscoroutinefunction(store.save_states)
+        self._states = OrderedDict() # key -> GameState, least recently updated first
+        self._updated = {} # key -> monotonic time of the last event
+        self._stale = set() # keys of games that skipped events while their state was unreadable
+        self._dirty = set()
+        self._timer = None
+
+    async def _call(self, method, *args):
+        if self._async_store:
+            return await method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def start(self):
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._timer
+            self._timer = None
+        await self.flush()
+
+    async def _read_state(self, key:str):
+        """
+        Stored state document of a game, retried with the retry policy. Raises once it is exhausted
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._call(self.store.read_state, key)
+            except Exception:
+                if self.retry_policy is None or self.retry_policy.exhausted(attempt):
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+
+    async def apply_events(self, events:list):
+        """
+        Pipeline stage: apply (position, document) pairs in order. When a game's
+        stored state cannot be read, its events in this batch skip the live view
+        (starting from an empty state would overwrite the stored one) and the game's
+        state is marked stale; the events themselves are still stored.
+        """
+        unreadable = set()
+        now = time.monotonic()
+        for position, document in events:
+            game_id = document.get("game_id")
+            key = str(game_id)
+            if key in unreadable:
+                continue
+
+            state = self._states.get(key)
+            if state is None:
+                # Continue from the stored state when the game started before this process
+                try:
+                    stored = await self._read_state(key)
+                except Exception as err:
+                    print(f'Issue reading the state of game {key}, skipping it in the live view: ', err)
+                    STATE_READ_FAILURES.inc()
+                    unreadable.add(key)
+                    self._stale.add(key)
+                    continue
+                state = self._states[key] = (GameState.from_document(stored) if stored
+                                             else GameState(game_id))
+                if key in self._stale:
+                    # Persisted with the state, so it survives eviction and restarts
+                    state.stale = True
+                    self._stale.discard(key)
+                    self._dirty.add(key)
+            else:
+                self._states.move_to_end(key)
+
+            self._updated[key] = now
+            if state.apply(position, document):
+                self._dirty.add(key)
+
+    def get(self, game_id):
+        """
+        Current state document of a game, or None when this process has not seen it
+        """
+        state = self._states.get(str(game_id))
+        return state.to_document() if state is not None else None
+
+    def is_stale(self, game_id) -> bool:
+        """
+        True when events of the game skipped the live view and its state is not loaded
+        """
+        return str(game_id) in self._stale
+
+    async def flush(self):
+        """
+        Write every changed state with one bulk write
+        """
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        documents = [self._states[key].to_document() for key in dirty]
+        try:
+            await self._call(self.store.save_states, documents)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    def evict(self):
+        """
+        Drop written-back states that are idle or beyond max_games. Changed states
+        are the most recently updated, so the scan stops at the first one.
+        """
+        idle_before = time.monotonic() - self.idle_seconds
+        while self._states:
+            key = next(iter(self._states))
+            if key in self._dirty:
+                break
+            if len(self._states) <= self.max_games and self._updated.get(key, 0) > idle_before:
+                break
+            del self._states[key]
+            self._updated.pop(key, None)
+            self.evicted += 1
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as err:
+                print('Issue writing game states to MongoDB: ', err)
+            self.evict()
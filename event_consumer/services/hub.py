@@ -0,0 +1,184 @@
+"""
+Module for the live game event hub (in-process pub/sub)
+"""
+import time
+import asyncio
+from uuid import uuid4
+from collections import deque
+
+from core.codec import get_codec
+
+class Frame:
+    """
+    One event, serialized once and shared by every subscriber. Its event id is
+    "<channel epoch>-<seq>".
+    """
+    __slots__ = ("seq", "id", "data", "text", "sse")
+
+    def __init__(self, epoch:str, seq:int, data:bytes):
+        self.seq = seq
+        self.id = f'{epoch}-{seq}'
+        self.data = data # JSON bytes
+        self.text = data.decode("utf-8") # WebSocket text frames
+        self.sse = b"id: %s\nevent: game-event\ndata: %s\n\n" % (self.id.encode("ascii"), data)
+
+class Subscriber:
+    """
+    A viewer of one game. Frames wait in a bounded queue, a None frame means the
+    hub dropped the subscriber because it fell behind.
+    """
+    def __init__(self, maxsize:int):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.skipped = 0
+        self.closed = False
+
+    async def next(self, timeout:float = None):
+        """
+        Wait for the next frame. Returns None when the subscriber was dropped and
+        raises asyncio.TimeoutError when nothing arrived within timeout.
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def _close(self):
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class _Channel:
+    __slots__ = ("epoch", "seq", "history", "subscribers", "active")
+
+    def __init__(self, history_size:int):
+        # seq restarts with every channel (after a prune or a restart), the epoch tells them apart
+        self.epoch = uuid4().hex[:12]
+        self.seq = 0
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.active = time.monotonic() # last publish or unsubscribe
+
+class GameHub:
+    """
+    Fans out events to the viewers of each game. Every game keeps a ring buffer of
+    its latest frames so a reconnecting viewer can catch up from its last event id.
+
+    A subscriber whose queue is full is either dropped ("drop") or loses its oldest
+    queued frame ("sample"), so a slow viewer never makes the hub buffer without limit.
+
+    A game without subscribers and without events for idle_seconds is forgotten
+    together with its ring buffer, so finished games do not pile up in memory.
+    """
+    def __init__(
+            self,
+            history_size:int,
+            subscriber_queue_size:int,
+            slow_policy:str = "drop",
+            idle_seconds:float = 300.0
+            ):
+        """
+        Initialize hub
+
+        params:
+            - history_size (int): frames kept per game for catch-up
+            - subscriber_queue_size (int): frames a subscriber can fall behind
+            - slow_policy (str): "drop" or "sample" for subscribers that fall further behind
+            - idle_seconds (float): seconds a game without subscribers keeps its ring buffer after its last event
+        """
+        self.history_size = history_size
+        self.subscriber_queue_size = subscriber_queue_size
+        self.slow_policy = slow_policy
+        self.idle_seconds = idle_seconds
+        self.dropped = 0
+        self.pruned = 0
+        self._codec = get_codec("json")
+        self._channels = {}
+        self._last_prune = time.monotonic()
+
+    def _channel(self, game_id):
+        key = str(game_id)
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._channels[key] = _Channel(self.history_size)
+        return channel
+
+    def _prune(self, now:float):
+        """
+        Forget the games nobody watches that had no events for idle_seconds.
+        Runs at most once per idle_seconds.
+        """
+        if now - self._last_prune < self.idle_seconds:
+            return
+        self._last_prune = now
+        idle = [key for key, channel in self._channels.items()
+                if not channel.subscribers and now - channel.active >= self.idle_seconds]
+        for key in idle:
+            del self._channels[key]
+        self.pruned += len(idle)
+
+    def publish(self, game_id, document:dict):
+        """
+        Serialize an event once and queue it for every subscriber of its game
+        """
+        now = time.monotonic()
+        self._prune(now)
+        channel = self._channel(game_id)
+        channel.active = now
+        channel.seq += 1
+        frame = Frame(channel.epoch, channel.seq, self._codec.encode(
+            {field: value for field, value in document.items() if field != "_id"}
+        ))
+        channel.history.append(frame)
+
+        for subscriber in list(channel.subscribers):
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                if self.slow_policy == "sample":
+                    subscriber.queue.get_nowait()
+                    subscriber.queue.put_nowait(frame)
+                    subscriber.skipped += 1
+                else:
+                    channel.subscribers.discard(subscriber)
+                    subscriber._close()
+                    self.dropped += 1
+
+    async def publish_events(self, events:list):
+        """
+        Pipeline stage: publish (position, document) pairs in order
+        """
+        for _, document in events:
+            self.publish(document.get("game_id"), document)
+
+    def subscribe(self, game_id, last_event_id:str = None):
+        """
+        Subscribe to a game. With last_event_id, frames after it that are still in
+        the ring buffer are queued first. An id from another epoch was sent before
+        the game was forgotten (or the process restarted), then the whole ring
+        buffer is new to the viewer.
+        """
+        self._prune(time.monotonic())
+        channel = self._channel(game_id)
+        subscriber = Subscriber(self.subscriber_queue_size)
+
+        if last_event_id is not None:
+            epoch, _, seq = str(last_event_id).rpartition("-")
+            last_seq = int(seq) if epoch == channel.epoch and seq.isdigit() else 0
+            missed = [frame for frame in channel.history if frame.seq > last_seq]
+            for frame in missed[-self.subscriber_queue_size:]:
+                subscriber.queue.put_nowait(frame)
+
+        channel.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, game_id, subscriber:Subscriber):
+        channel = self._channels.get(str(game_id))
+        if channel is not None:
+            channel.subscribers.discard(subscriber)
+            channel.active = time.monotonic()
+
+    def stats(self):
+        return {
+            "games": len(self._channels),
+            "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+            "dropped_subscribers": self.dropped,
+            "pruned_games": self.pruned
+        }
@@ -1,18 +1,115 @@
 """
 Controller module for MongoDB
 """
-import json
+import asyncio
+import contextlib
+from datetime import datetime
 from urllib.parse import quote_plus
 from bson.objectid import ObjectId
+import pymongo
+from pymongo import ASCENDING, IndexModel, ReplaceOne, UpdateOne
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo.write_concern import WriteConcern
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError: # only needed when MONGODB_DRIVER=async
+    AsyncIOMotorClient = None
 
 from core.config import settings
+from schemas.event import utc_timestamp
+from services.decoder import EventDecoder
 
 # Mongodb connection string below
 # mongodb+srv://<username>:<db_password>@cluster0.rfvytng.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0
 # don't forget to set the mongodb env credentials!
 
+_decoder = EventDecoder(validate=settings.validate_events)
+
+# Events are unique per game and play. Events without a play_id are not covered by the index
+EVENT_KEY_FIELDS = ("game_id", "play_id")
+EVENT_KEY_INDEX = "game_id_play_id_unique"
+EVENT_KEY_FILTER = {"play_id": {"$type": "string"}}
+
+# Event queries page on _id, so every query index ends with _id: the filter and the
+# sort are both answered by the index and a page costs the same however deep it is.
+# Time range queries page on (timestamp, _id) instead, so the range and the sort come
+# from the same timestamp index and no page sorts the matching range in memory
+EVENT_QUERY_INDEXES = (
+    ("game_id_id", ("game_id", "_id")),
+    ("game_id_timestamp_id", ("game_id", "timestamp", "_id")),
+    ("timestamp_id", ("timestamp", "_id")),
+    ("game_id_event_type_id", ("game_id", "event_type", "_id")),
+    ("game_id_player_id_id", ("game_id", "player_id", "_id")),
+    ("player_id_id", ("player_id", "_id")),
+    ("event_type_id", ("event_type", "_id"))
+)
+EVENT_FIELDS = ("game_id", "play_id", "event_type", "event", "timestamp", "player_id")
+
+def event_filter(game_id:int = None, player_id:int = None, event_type:str = None,
+                 start:datetime = None, end:datetime = None) -> dict:
+    """
+    Build an event query filter. Timestamps are stored as fixed-width UTC ISO 8601
+    strings (see utc_timestamp), so the time range is converted to the same form;
+    naive bounds are taken as UTC. Events stored before timestamps were normalized
+    keep the string they arrived with and only compare correctly when it was already
+    in that form; rewrite them with utc_timestamp to include them reliably.
+    """
+    query = {}
+    if game_id is not None:
+        query["game_id"] = game_id
+    if player_id is not None:
+        query["player_id"] = player_id
+    if event_type is not None:
+        query["event_type"] = event_type
+    if start is not None or end is not None:
+        query["timestamp"] = {}
+        if start is not None:
+            query["timestamp"]["$gte"] = utc_timestamp(start)
+        if end is not None:
+            query["timestamp"]["$lt"] = utc_timestamp(end)
+    return query
+
+def event_sort(query:dict) -> list:
+    """
+    Page order of a query: time order for time ranges, storage (_id) order otherwise
+    """
+    if "timestamp" in query:
+        return [("timestamp", ASCENDING), ("_id", ASCENDING)]
+    return [("_id", ASCENDING)]
+
+def page_cursor(query:dict, document:dict) -> str:
+    """
+    Cursor of the page after document: its _id, prefixed with its timestamp for time ranges
+    """
+    if "timestamp" in query:
+        return f'{document.get("timestamp")}|{document["_id"]}'
+    return str(document["_id"])
+
+def valid_cursor(query:dict, cursor:str) -> bool:
+    timestamp, separator, object_id = cursor.rpartition("|")
+    return ObjectId.is_valid(object_id) and bool(separator) == ("timestamp" in query)
+
+def _after(query:dict, after:str = None) -> dict:
+    """
+    Add the keyset condition: only events after the previous page's last event
+    """
+    if after is None:
+        return query
+    if "timestamp" not in query:
+        return {**query, "_id": {"$gt": ObjectId(after)}}
+
+    timestamp, _, object_id = after.rpartition("|")
+    return {"$and": [query, {"$or": [
+        {"timestamp": {"$gt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$gt": ObjectId(object_id)}}
+    ]}]}
+
+def _projection(query:dict, fields:tuple) -> list:
+    # Time range pages need the timestamp for their cursor
+    return list(fields) + (["timestamp"] if "timestamp" in query and "timestamp" not in fields else [])
+
 # I may update the structure of this project to use service logic separte from the main logic
 # base file that has the session injection and basic database operations like read and write
 # You can use the TypeDict from the typing library to insert records using schema validation
@@ -22,15 +119,36 @@ class MongoDBConn:
         # Initialize the mongodb connection here
         self.client = self._connect_to_mongodb()
         self.database = self.client[settings.mongodb_database]
-        self.collection = self.database[settings.mongodb_collection]
+        self.collection = self.database.get_collection(settings.mongodb_collection,
+                                                       write_concern=self._write_concern())
+        self.state_collection = self.database.get_collection(settings.mongodb_state_collection,
+                                                             write_concern=self._write_concern())
 
+    @staticmethod
+    def _ping_timeout(timeout:float = None):
+        """
+        Bound a ping, server selection included, instead of the client's 30s default
+        """
+        return pymongo.timeout(timeout) if timeout else contextlib.nullcontext()
+
+    def ping(self, timeout:float = None, verbose:bool = True) -> bool:
+        """
+        Check the cluster is reachable. Blocking, the service runs it on a thread
 
-        # Try to ping the database to make sure the connection worked
+        params:
+            - timeout (float): seconds to wait for an answer, None uses the client's timeouts
+            - verbose (bool): log the outcome
+        """
         try:
-            self.client.admin.command('ping')
-            print('Client intialized. You successfully connected to MongoDB!')
+            with self._ping_timeout(timeout):
+                self.client.admin.command('ping')
+            if verbose:
+                print('Client intialized. You successfully connected to MongoDB!')
+            return True
         except Exception as err:
-            print('Issue connecting to cluster: ', err)
+            if verbose:
+                print('Issue connecting to cluster: ', err)
+            return False
 
     # internal method to create the connection string with env variables
     def _create_mongodb_uri(self):
@@ -45,6 +163,15 @@ class MongoDBConn:
             f"?retryWrites=true&w=majority&appName={settings.mongodb_cluster}"
         )
 
+    @staticmethod
+    def _write_concern():
+        """
+        Write concern for event writes (MONGODB_WRITE_CONCERN is a node count or "majority")
+        """
+        w = settings.mongodb_write_concern
+        return WriteConcern(w=int(w) if str(w).isdigit() else w,
+                            j=settings.mongodb_journal)
+
     # internal method to actually connect to mongodb that __init__ will call
     def _connect_to_mongodb(self):
         """
@@ -52,7 +179,9 @@ class MongoDBConn:
         """
         return MongoClient(
             self._create_mongodb_uri(),
-            server_api=ServerApi('1')
+            server_api=ServerApi('1'),
+            maxPoolSize=settings.mongodb_max_pool_size,
+            minPoolSize=settings.mongodb_min_pool_size
             )
 
     # methods to insert data and read data
@@ -65,17 +194,57 @@ class MongoDBConn:
                                    bypass_document_validation=False)
         return result.inserted_id
         
-    def insert_many_records(self, documents:list): # Only lists are allowed
+    def insert_many_records(self, documents:list, ordered:bool = True): # Only lists are allowed
         """
-        Insert a list of documents to collection.
+        Insert a list of documents to collection. With ordered=False the server
+        keeps inserting after a failed document and may apply the writes in parallel.
         """
         if not isinstance(documents, list):
             raise AttributeError(
                 "Documents must be inside a list."
             )
         
-        self.collection.insert_many(documents,
-                                    bypass_document_validation=False)
+        return self.collection.insert_many(documents,
+                                           ordered=ordered,
+                                           bypass_document_validation=False)
+
+    @staticmethod
+    def _upserts(documents:list, key_fields:tuple):
+        """
+        Build one insert-if-missing upsert per document, matched on key_fields
+        """
+        return [
+            UpdateOne({field: document[field] for field in key_fields},
+                      {"$setOnInsert": document},
+                      upsert=True)
+            for document in documents
+        ]
+
+    def upsert_many_records(self, documents:list, key_fields:tuple = EVENT_KEY_FIELDS, ordered:bool = False):
+        """
+        Insert documents that are not stored yet, matched on key_fields, with one bulk_write.
+        Writing the same documents again leaves the collection unchanged.
+        """
+        if not isinstance(documents, list):
+            raise AttributeError(
+                "Documents must be inside a list."
+            )
+
+        return self.collection.bulk_write(self._upserts(documents, key_fields),
+                                          ordered=ordered,
+                                          bypass_document_validation=False)
+
+    def create_unique_index(self, key_fields:tuple = EVENT_KEY_FIELDS, name:str = EVENT_KEY_INDEX):
+        """
+        Create the unique index used by upsert_many_records. Only documents with a
+        play_id are indexed.
+        """
+        return self.collection.create_index(
+            [(field, ASCENDING) for field in key_fields],
+            name=name,
+            unique=True,
+            partialFilterExpression=EVENT_KEY_FILTER
+        )
     
     def read_record(self, object_id:str):
         """
@@ -85,6 +254,48 @@ class MongoDBConn:
         return (
             self.collection.find_one({"_id": ObjectId(object_id)})
         )
+
+    def create_query_indexes(self):
+        """
+        Create the compound indexes used by find_page and iter_records
+        """
+        return self.collection.create_indexes([
+            IndexModel([(field, ASCENDING) for field in fields], name=name)
+            for name, fields in EVENT_QUERY_INDEXES
+        ])
+
+    def find_page(self, query:dict, after:str = None, limit:int = 100, fields:tuple = EVENT_FIELDS):
+        """
+        Read one page of events in event_sort order, starting after the previous page's last event
+        """
+        cursor = self.collection.find(_after(query, after), projection=_projection(query, fields))
+        return list(cursor.sort(event_sort(query)).limit(limit))
+
+    def iter_records(self, query:dict, fields:tuple = EVENT_FIELDS, batch_size:int = 500):
+        """
+        Iterate over every matching event in event_sort order, fetching batch_size events per round trip
+        """
+        cursor = self.collection.find(query, projection=list(fields), batch_size=batch_size)
+        try:
+            yield from cursor.sort(event_sort(query))
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _replacements(documents:list):
+        return [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents]
+
+    def save_states(self, documents:list):
+        """
+        Replace (or create) game state documents with one bulk_write
+        """
+        return self.state_collection.bulk_write(self._replacements(documents), ordered=False)
+
+    def read_state(self, game_id:str):
+        """
+        Read a game state document
+        """
+        return self.state_collection.find_one({"_id": game_id})
     
     def shutdown(self):
         """
@@ -96,12 +307,180 @@ class MongoDataManager(MongoDBConn):
     """
     MongoDB database/document operations
     """
+    @staticmethod
+    def decode_doc(payload):
+        """
+        Decode a Kafka message value into a validated document using the codec named
+        in its headers. raises ValidationError when it is not a valid GameEvent
+        """
+        return _decoder.decode(payload)
+
     def add_one_doc(self, payload:dict):
         """
         Add one document to MongDB collection
         """
-        record = payload.value()
-        return self.insert_record(json.loads(record.decode('utf-8'))) # Will need to update to be sent to a dead letter queue if something failed
+        return self.insert_record(self.decode_doc(payload)) # Will need to update to be sent to a dead letter queue if something failed
 
     def read_document_by_id(self, object_id:str):
         return self.read_record(object_id=object_id)
+
+class AsyncMongoDBConn(MongoDBConn):
+    """
+    MongoDB connection on the asyncio (Motor) driver. Same API as MongoDBConn,
+    but the database operations are coroutines, so several bulk writes can be in
+    flight on one connection pool without blocking the event loop.
+    """
+    def __init__(self):
+        if AsyncIOMotorClient is None:
+            raise RuntimeError("motor is not installed, it is required for MONGODB_DRIVER=async")
+
+        self.client = self._connect_to_mongodb()
+        self.database = self.client[settings.mongodb_database]
+        self.collection = self.database.get_collection(settings.mongodb_collection,
+                                                       write_concern=self._write_concern())
+        self.state_collection = self.database.get_collection(settings.mongodb_state_collection,
+                                                             write_concern=self._write_concern())
+
+    def _connect_to_mongodb(self):
+        """
+        Connect to MongoDB cluster using Motor.
+        """
+        return AsyncIOMotorClient(
+            self._create_mongodb_uri(),
+            server_api=ServerApi('1'),
+            maxPoolSize=settings.mongodb_max_pool_size,
+            minPoolSize=settings.mongodb_min_pool_size
+            )
+
+    async def ping(self, timeout:float = None, verbose:bool = True) -> bool:
+        """
+        Check the cluster is reachable
+
+        params:
+            - timeout (float): seconds to wait for an answer, None uses the client's timeouts
+            - verbose (bool): log the outcome
+        """
+        try:
+            with self._ping_timeout(timeout):
+                await asyncio.wait_for(self.client.admin.command('ping'), timeout)
+            if verbose:
+                print('Client intialized. You successfully connected to MongoDB!')
+            return True
+        except Exception as err:
+            if verbose:
+                print('Issue connecting to cluster: ', err)
+            return False
+
+    async def insert_record(self, document:dict):
+        """
+        Insert one record to collection. 
+        """
+        result = await self.collection.insert_one(document,
+                                                  bypass_document_validation=False)
+        return result.inserted_id
+
+    async def insert_many_records(self, documents:list, ordered:bool = True):
+        """
+        Insert a list of documents to collection.
+        """
+        if not isinstance(documents, list):
+            raise AttributeError(
+                "Documents must be inside a list."
+            )
+
+        return await self.collection.insert_many(documents,
+                                                 ordered=ordered,
+                                                 bypass_document_validation=False)
+
+    async def upsert_many_records(self, documents:list, key_fields:tuple = EVENT_KEY_FIELDS, ordered:bool = False):
+        """
+        Insert documents that are not stored yet, matched on key_fields, with one bulk_write.
+        """
+        if not isinstance(documents, list):
+            raise AttributeError(
+                "Documents must be inside a list."
+            )
+
+        return await self.collection.bulk_write(self._upserts(documents, key_fields),
+                                                ordered=ordered,
+                                                bypass_document_validation=False)
+
+    async def create_unique_index(self, key_fields:tuple = EVENT_KEY_FIELDS, name:str = EVENT_KEY_INDEX):
+        """
+        Create the unique index used by upsert_many_records.
+        """
+        return await self.collection.create_index(
+            [(field, ASCENDING) for field in key_fields],
+            name=name,
+            unique=True,
+            partialFilterExpression=EVENT_KEY_FILTER
+        )
+
+    async def read_record(self, object_id:str):
+        """
+        Read document from collection using document
+        object id.
+        """
+        return await self.collection.find_one({"_id": ObjectId(object_id)})
+
+    async def create_query_indexes(self):
+        """
+        Create the compound indexes used by find_page and iter_records
+        """
+        return await self.collection.create_indexes([
+            IndexModel([(field, ASCENDING) for field in fields], name=name)
+            for name, fields in EVENT_QUERY_INDEXES
+        ])
+
+    async def find_page(self, query:dict, after:str = None, limit:int = 100, fields:tuple = EVENT_FIELDS):
+        """
+        Read one page of events in event_sort order, starting after the previous page's last event
+        """
+        cursor = self.collection.find(_after(query, after), projection=_projection(query, fields))
+        return await cursor.sort(event_sort(query)).limit(limit).to_list(length=limit)
+
+    async def iter_records(self, query:dict, fields:tuple = EVENT_FIELDS, batch_size:int = 500):
+        """
+        Iterate over every matching event in event_sort order, fetching batch_size events per round trip
+        """
+        cursor = self.collection.find(query, projection=list(fields), batch_size=batch_size)
+        try:
+            async for document in cursor.sort(event_sort(query)):
+                yield document
+        finally:
+            await cursor.close()
+
+    async def save_states(self, documents:list):
+        """
+        Replace (or create) game state documents with one bulk_write
+        """
+        return await self.state_collection.bulk_write(self._replacements(documents), ordered=False)
+
+    async def read_state(self, game_id:str):
+        """
+        Read a game state document
+        """
+        return await self.state_collection.find_one({"_id": game_id})
+
+class AsyncMongoDataManager(AsyncMongoDBConn):
+    """
+    MongoDB database/document operations on the asyncio driver
+    """
+    decode_doc = staticmethod(MongoDataManager.decode_doc)
+
+    async def add_one_doc(self, payload:dict):
+        """
+        Add one document to MongDB collection
+        """
+        return await self.insert_record(self.decode_doc(payload))
+
+    async def read_document_by_id(self, object_id:str):
+        return await self.read_record(object_id=object_id)
+
+def create_data_manager():
+    """
+    Return the MongoDB data manager for the configured driver (MONGODB_DRIVER=sync or async)
+    """
+    if settings.mongodb_driver == "async":
+        return AsyncMongoDataManager()
+    return MongoDataManager()
@@ -0,0 +1,102 @@
+"""
+Module for per-partition Kafka offset tracking
+"""
+import asyncio
+from collections import deque
+
+from core.metrics import Histogram
+
+COMMIT_SECONDS = Histogram("consumer_commit_seconds", "Time of one synchronous offset commit")
+
+class OffsetTracker:
+    """
+    Tracks every polled message until it has been handled (stored, dead-lettered or
+    dropped as a duplicate). Messages of one partition can finish out of order when
+    they are processed by different workers, so only the highest offset below which
+    every message is finished is committed.
+    """
+    def __init__(self, consumer):
+        """
+        params:
+            - consumer (ConsumerService): consumer used to commit offsets
+        """
+        self.consumer = consumer
+        self._partitions = {} # (topic, partition) -> (offsets in poll order, finished offsets)
+        self._lock = asyncio.Lock()
+        self._commit_wanted = False
+        self._committer = None
+
+    def track(self, messages:list):
+        """
+        Register polled messages, in the order they were polled
+        """
+        for message in messages:
+            position = (message.topic(), message.partition())
+            pending = self._partitions.get(position)
+            if pending is None:
+                pending = self._partitions[position] = (deque(), set())
+            pending[0].append(message.offset())
+
+    def mark_done(self, positions:list):
+        """
+        Mark messages as handled
+
+        params:
+            - positions (list): (topic, partition, offset) of each handled message
+        """
+        for topic, partition, offset in positions:
+            pending = self._partitions.get((topic, partition))
+            if pending is not None:
+                pending[1].add(offset)
+
+    def finish(self, positions:list):
+        """
+        Mark messages as handled from a callback (e.g. a dead-letter delivery report)
+        and commit them in the background. Must be called on the event loop thread.
+        """
+        self.mark_done(positions)
+        self._commit_wanted = True
+        if self._committer is None:
+            self._committer = asyncio.create_task(self._commit_wanted_offsets())
+
+    async def _commit_wanted_offsets(self):
+        try:
+            while self._commit_wanted:
+                self._commit_wanted = False
+                await self.commit()
+        finally:
+            self._committer = None
+
+    def _take_committable(self):
+        offsets = {}
+        for position, (polled, finished) in self._partitions.items():
+            last = None
+            while polled and polled[0] in finished:
+                last = polled.popleft()
+                finished.discard(last)
+            if last is not None:
+                offsets[position] = last
+        return offsets
+
+    def pending(self):
+        """
+        Number of polled but unfinished messages per partition
+        """
+        return {f'{topic}[{partition}]': len(polled)
+                for (topic, partition), (polled, _) in self._partitions.items()}
+
+    async def commit(self):
+        """
+        Commit the offsets every partition has finished up to
+        """
+        async with self._lock:
+            offsets = self._take_committable()
+            if not offsets:
+                return
+
+            try:
+                with COMMIT_SECONDS.time():
+                    await asyncio.to_thread(self.consumer.commit_offsets, offsets)
+            except Exception as err:
+                # A later commit covers these partitions again
+                print('Issue committing offsets: ', err)
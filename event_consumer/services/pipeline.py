@@ -0,0 +1,258 @@
+"""
+Module for the parallel event processing pipeline
+"""
+import time
+import asyncio
+import functools
+import contextlib
+from collections import OrderedDict
+
+from core.metrics import Counter, Histogram
+
+DECODE_SECONDS = Histogram("consumer_decode_seconds", "Time to decode one polled batch")
+EVENTS = Counter("consumer_events", "Polled messages by outcome", ("outcome",))
+STAGE_ERRORS = Counter("consumer_stage_errors", "Event batches a pipeline stage failed on", ("stage",))
+
+class RecentKeyFilter:
+    """
+    Remembers the most recently seen event keys so redelivered events are dropped
+    before they are processed. Bounded to maxsize keys, the oldest is forgotten first.
+    """
+    def __init__(self, maxsize:int):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._keys = OrderedDict()
+
+    def seen(self, key) -> bool:
+        """
+        Return True when key was already seen, otherwise remember it
+        """
+        if self.maxsize <= 0:
+            return False
+
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.dropped += 1
+            return True
+
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return False
+
+class _Lane:
+    """
+    One worker: a queue of event batches processed strictly in arrival order
+    """
+    def __init__(self, sink, queue_size:int):
+        self.sink = sink
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+
+class EventPipeline:
+    """
+    Decodes polled messages, drops recent duplicates and spreads the events over
+    worker lanes by game_id. Every
+    event of a game goes to the same lane, and a lane handles its events one batch
+    at a time, so events of one game are processed in order while different games
+    are processed concurrently. Each lane writes through its own sink.
+
+    A failing stage is logged and skipped for that batch, the events still reach
+    the sink. Events the sink cannot take are dead-lettered, so every event is
+    eventually reported to the offset tracker and no partition stops committing.
+    Dead-lettered messages are reported once the dead-letter topic confirmed them.
+    """
+    def __init__(
+            self,
+            decode,
+            offsets,
+            sinks:list,
+            queue_size:int,
+            dead_letter = None,
+            key_filter:RecentKeyFilter = None,
+            tracer = None
+            ):
+        """
+        Initialize pipeline
+
+        params:
+            - decode (callable): turns a polled batch into (decoded, failed), see EventDecoder.decode_batch
+            - offsets (OffsetTracker): tracker for every polled message
+            - sinks (list): one MongoBatchSink per worker lane
+            - queue_size (int): event batches a lane can hold before submit waits
+            - dead_letter (DeadLetterPublisher): destination for undecodable and invalid messages
+            - key_filter (RecentKeyFilter): drops events whose (game_id, play_id) was seen recently
+            - tracer (Tracer): starts the latency trace of every traced message
+        """
+        self.decode = decode
+        self.offsets = offsets
+        self.dead_letter = dead_letter
+        self.key_filter = key_filter
+        self.tracer = tracer
+        self.lanes = [_Lane(sink, queue_size) for sink in sinks]
+        self.stages = []
+        self.dead_lettered = 0
+
+    def add_stage(self, stage):
+        """
+        Register an async stage run by the lanes before events reach the sink.
+        It is called with the lane's (position, document) pairs, in order.
+        """
+        self.stages.append(stage)
+
+    async def start(self):
+        for lane in self.lanes:
+            await lane.sink.start()
+            lane.task = asyncio.create_task(self._work(lane))
+
+    async def stop(self, timeout:float = 10.0):
+        """
+        Finish the queued batches, then stop the lanes and flush their sinks
+        """
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.queue.join() for lane in self.lanes)), timeout=timeout
+            )
+
+        for lane in self.lanes:
+            if lane.task is not None:
+                lane.task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await lane.task
+
+        for lane in self.lanes:
+            try:
+                await lane.sink.stop()
+            except Exception as err:
+                print('Issue flushing events on shutdown: ', err)
+
+    def _lane_for(self, game_id):
+        return self.lanes[hash(game_id) % len(self.lanes)]
+
+    async def submit(self, messages:list):
+        """
+        Decode a polled batch and queue its events on their game's lane
+        """
+        self.offsets.track(messages)
+        if self.tracer is not None:
+            self.tracer.receive(messages)
+
+        start = time.perf_counter()
+        routed = {}
+        finished = [] # duplicate (or dropped) messages, nothing more to do for them
+        dead_lettered = [] # undecodable or invalid messages, finished by their delivery report
+        decoded, failed = self.decode(messages)
+        invalid = 0
+        for message, err, stage in failed:
+            position = (message.topic(), message.partition(), message.offset())
+            dead_lettered.append(position)
+            if not await self._dead_letter_message(message, position, err, stage):
+                finished.append(position)
+            invalid += stage == "validate"
+
+        duplicates = 0
+        for message, document in decoded:
+            position = (message.topic(), message.partition(), message.offset())
+            play_id = document.get("play_id")
+            if (self.key_filter is not None and play_id is not None
+                    and self.key_filter.seen((document.get("game_id"), play_id))):
+                finished.append(position)
+                duplicates += 1
+                continue
+
+            routed.setdefault(self._lane_for(document.get("game_id")), []).append((position, document))
+
+        DECODE_SECONDS.observe(time.perf_counter() - start)
+        EVENTS.labels("decoded").inc(len(messages) - len(failed) - duplicates)
+        if duplicates:
+            EVENTS.labels("duplicate").inc(duplicates)
+        if invalid:
+            EVENTS.labels("invalid").inc(invalid)
+        if len(failed) > invalid:
+            EVENTS.labels("undecodable").inc(len(failed) - invalid)
+
+        if self.tracer is not None:
+            self.tracer.discard(finished + dead_lettered)
+        if finished:
+            self.offsets.mark_done(finished)
+            await self.offsets.commit()
+
+        for lane, events in routed.items():
+            await lane.queue.put(events)
+
+    async def _work(self, lane:_Lane):
+        while True:
+            events = await lane.queue.get()
+            try:
+                await self._process(lane, events)
+            finally:
+                lane.queue.task_done()
+
+    async def _process(self, lane:_Lane, events:list):
+        for stage in self.stages:
+            try:
+                await stage(events)
+            except Exception as err:
+                name = getattr(stage, "__qualname__", repr(stage))
+                STAGE_ERRORS.labels(name).inc()
+                print(f'Issue in pipeline stage {name}, continuing without it for {len(events)} events: ', err)
+
+        try:
+            await lane.sink.add(events)
+        except Exception as err:
+            print(f'Issue handing {len(events)} events to the sink, dead-lettering them: ', err)
+            await self._abandon(events, err)
+
+    async def _abandon(self, events:list, err:Exception):
+        """
+        Dead-letter events that cannot be stored, they are marked handled once delivered
+        """
+        dropped = []
+        for position, document in events:
+            if not await self._dead_letter_document(document, position, err):
+                dropped.append(position)
+        EVENTS.labels("abandoned").inc(len(events))
+        if self.tracer is not None:
+            self.tracer.discard([position for position, _ in events])
+        if dropped:
+            self.offsets.mark_done(dropped)
+            await self.offsets.commit()
+
+    async def _dead_letter_document(self, document:dict, position:tuple, err:Exception, stage:str = "write") -> bool:
+        """
+        Dead-letter an event, its offset is finished once the broker confirmed it.
+        Returns False when the event was dropped instead and the caller finishes it.
+        """
+        self.dead_lettered += 1
+        if self.dead_letter is None:
+            print(f'Dropping event {document.get("play_id")} ({stage} failed): {err}')
+            return False
+        try:
+            await self.dead_letter.publish_document(document, err, stage=stage,
+                                                    on_delivered=functools.partial(self.offsets.finish, [position]))
+            return True
+        except Exception as publish_err:
+            print(f'Issue dead-lettering event {document.get("play_id")}: {publish_err}')
+            return False
+
+    async def _dead_letter_message(self, message, position:tuple, err:Exception, stage:str = "decode") -> bool:
+        """
+        Dead-letter a polled message, see _dead_letter_document
+        """
+        self.dead_lettered += 1
+        if self.dead_letter is None:
+            print(f'Dropping message at offset {message.offset()} ({stage} failed): {err}')
+            return False
+        try:
+            await self.dead_letter.publish_message(message, err, stage=stage,
+                                                   on_delivered=functools.partial(self.offsets.finish, [position]))
+            return True
+        except Exception as publish_err:
+            print(f'Issue dead-lettering message at offset {message.offset()}: {publish_err}')
+            return False
+
+    def queued(self):
+        """
+        Event batches waiting in each lane
+        """
+        return [lane.queue.qsize() for lane in self.lanes]
@@ -0,0 +1,335 @@
+"""
+Module for the buffered MongoDB sink
+"""
+import time
+import asyncio
+import functools
+import contextlib
+from collections import deque
+from pymongo.errors import BulkWriteError
+
+from core.metrics import Counter, Histogram
+from services.dead_letter import DocumentRejected, is_poison
+
+MONGO_WRITE_SECONDS = Histogram("consumer_mongo_write_seconds", "Time of one MongoDB bulk write",
+                                ("operation",))
+DOCUMENTS = Counter("consumer_documents", "Events by write outcome", ("outcome",))
+
+DUPLICATE_KEY = 11000
+
+class _Batch:
+    """
+    Documents written together and the Kafka messages they came from
+    """
+    __slots__ = ("documents", "positions", "attempts", "retry_handle")
+
+    def __init__(self, documents:list, positions:list):
+        self.documents = documents
+        self.positions = positions
+        self.attempts = 0
+        self.retry_handle = None
+
+class MongoBatchSink:
+    """
+    Buffers decoded events and writes them to MongoDB with one unordered insert_many
+    once batch_size documents are waiting or flush_interval seconds have passed.
+
+    Up to max_inflight batches are written concurrently. Once max_pending batches
+    are unfinished (e.g. retrying while MongoDB is down) flushing waits for one of
+    them, so the lane stops taking events and its queue pushes back on polling.
+    A message is reported to the
+    offset tracker only once its event is stored or the dead-letter topic confirmed
+    it, and the tracker never commits past an unfinished message, so delivery is
+    at-least-once.
+
+    Failures are handled so the lane's events are still written in order:
+        - documents MongoDB rejects go to the dead-letter topic
+        - a batch that fails as a whole (timeout, lost connection) is retried in the
+          background with exponential backoff, and dead-lettered once the retry policy is exhausted.
+          Batches flushed meanwhile are held behind it and written once it is done.
+
+    In "upsert" write mode events with a play_id are written as bulk upserts keyed on
+    (game_id, play_id), so redelivered or resubmitted events never create duplicates.
+    """
+    def __init__(
+            self,
+            store,
+            offsets,
+            batch_size:int,
+            flush_interval:float,
+            max_inflight:int = 1,
+            max_pending:int = 0,
+            write_mode:str = "insert",
+            retry_policy = None,
+            dead_letter = None,
+            tracer = None
+            ):
+        """
+        Initialize sink
+
+        params:
+            - store (MongoDataManager | AsyncMongoDataManager): data manager used to write documents
+            - offsets (OffsetTracker): tracker told about every handled message
+            - batch_size (int): number of buffered documents that triggers a flush
+            - flush_interval (float): longest time in seconds a document waits in the buffer
+            - max_inflight (int): number of batches that can be written at the same time
+            - max_pending (int): unfinished batches before flushing waits, 0 is unbounded
+            - write_mode (str): "insert" (insert_many) or "upsert" (idempotent bulk upserts)
+            - retry_policy (RetryPolicy): backoff for batches that failed as a whole, None retries on the next flush
+            - dead_letter (DeadLetterPublisher): destination for events that cannot be stored, None only logs them
+            - tracer (Tracer): finishes the latency trace of every stored event
+        """
+        self.store = store
+        self.offsets = offsets
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.write_mode = write_mode
+        self.retry_policy = retry_policy
+        self.dead_letter = dead_letter
+        self.tracer = tracer
+        self.retried = 0
+        self.dead_lettered = 0
+        self._async_store = asyncio.iscoroutinefunction(store.insert_many_records)
+
+        self._documents = []
+        self._positions = [] # (topic, partition, offset) of every buffered message
+        self._oldest = None # monotonic time the oldest buffered document was added
+        self._pending = set() # batches not yet stored or dead-lettered
+        self._failed = set() # batches waiting for a retry
+        self._held = deque() # batches flushed while a batch waits for a retry, in flush order
+        self._room = asyncio.Condition() # notified whenever a pending batch finishes
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._tasks = set()
+        self._timer = None
+
+    async def start(self):
+        self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stop the flush timer, write whatever is still buffered and wait for every write
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._timer
+            self._timer = None
+
+        await self.flush(wait=False)
+        await self.drain()
+
+        # Give batches waiting on a backoff timer one last attempt
+        for batch in list(self._pending):
+            if batch.retry_handle is not None:
+                batch.retry_handle.cancel()
+                batch.retry_handle = None
+                await self._submit(batch)
+        await self.drain()
+
+        if self._pending:
+            print(f'{len(self._pending)} batches were not stored, their offsets are left uncommitted')
+
+    async def add(self, events:list):
+        """
+        Buffer decoded events and flush when the buffer is full
+
+        params:
+            - events (list): (position, document) pairs, position is (topic, partition, offset)
+        """
+        for position, document in events:
+            self._documents.append(document)
+            self._positions.append(position)
+
+        if self._oldest is None and self._positions:
+            self._oldest = time.monotonic()
+
+        if len(self._documents) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self, wait:bool = True):
+        """
+        Hand the buffer to a background write. Only waits when max_inflight
+        writes are already running, or (with wait) max_pending batches are unfinished.
+        """
+        if wait and self.max_pending > 0 and len(self._pending) >= self.max_pending:
+            async with self._room:
+                await self._room.wait_for(lambda: len(self._pending) < self.max_pending)
+        if not self._positions:
+            return
+
+        batch = _Batch(self._documents, self._positions)
+        self._documents, self._positions, self._oldest = [], [], None
+        self._pending.add(batch)
+        if self._failed or self._held:
+            self._held.append(batch)
+            return
+        await self._submit(batch)
+
+    async def drain(self):
+        """
+        Wait for every running write to finish, including the held batches they release
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _release_held(self):
+        """
+        Write the held batches once no batch waits for a retry
+        """
+        while self._held and not self._failed:
+            await self._submit(self._held.popleft())
+
+    async def _submit(self, batch:_Batch):
+        await self._inflight.acquire()
+        task = asyncio.create_task(self._write_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write_batch(self, batch:_Batch):
+        batch.retry_handle = None
+        batch.attempts += 1
+        failure = None
+        try:
+            rejected = await self._write(batch.documents) if batch.documents else []
+        except Exception as err:
+            failure = err
+        finally:
+            self._inflight.release()
+
+        if failure is not None:
+            await self._batch_failed(batch, failure)
+            return
+
+        DOCUMENTS.labels("stored").inc(len(batch.documents) - len(rejected))
+        errors = {id(document): err for document, err in rejected}
+        stored, dropped, done = [], [], []
+        for document, position in zip(batch.documents, batch.positions):
+            if id(document) not in errors:
+                stored.append(position)
+                continue
+            dropped.append(position)
+            if not await self._dead_letter_document(document, position, errors[id(document)], batch.attempts):
+                done.append(position)
+
+        if self.tracer is not None:
+            self.tracer.discard(dropped)
+            self.tracer.stored(stored)
+
+        await self._finish(batch, stored + done)
+
+    async def _finish(self, batch:_Batch, positions:list):
+        """
+        Forget a written or dead-lettered batch, commit the given positions and write
+        the batches held behind it. Dead-lettered events are finished by their delivery
+        report instead.
+        """
+        self._pending.discard(batch)
+        self._failed.discard(batch)
+        async with self._room:
+            self._room.notify_all()
+        self.offsets.mark_done(positions)
+        await self.offsets.commit()
+        await self._release_held()
+
+    async def _batch_failed(self, batch:_Batch, err:Exception):
+        """
+        Schedule a retry for a batch that failed as a whole, or dead-letter it
+        when the failure is permanent or the retry policy is exhausted
+        """
+        if not is_poison(err) and (self.retry_policy is None or not self.retry_policy.exhausted(batch.attempts)):
+            delay = self.retry_policy.delay(batch.attempts) if self.retry_policy else self.flush_interval
+            print(f'Issue writing {len(batch.documents)} events to MongoDB (attempt {batch.attempts}), '
+                  f'retrying in {delay:.2f}s: {err}')
+            self.retried += 1
+            DOCUMENTS.labels("retried").inc(len(batch.documents))
+            self._failed.add(batch)
+            batch.retry_handle = asyncio.get_running_loop().call_later(delay, self._retry, batch)
+            return
+
+        done = []
+        for document, position in zip(batch.documents, batch.positions):
+            if not await self._dead_letter_document(document, position, err, batch.attempts):
+                done.append(position)
+        if self.tracer is not None:
+            self.tracer.discard(batch.positions)
+        await self._finish(batch, done)
+
+    def _retry(self, batch:_Batch):
+        task = asyncio.create_task(self._submit(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dead_letter_document(self, document:dict, position:tuple, err:Exception, attempts:int) -> bool:
+        """
+        Dead-letter an event, its offset is finished once the broker confirmed it.
+        Returns False when the event was dropped instead and the caller finishes it.
+        """
+        self.dead_lettered += 1
+        DOCUMENTS.labels("dead_lettered").inc()
+        if self.dead_letter is None:
+            print(f'Dropping event {document.get("play_id")} that could not be stored: {err}')
+            return False
+        try:
+            await self.dead_letter.publish_document(document, err, stage="write", attempts=attempts,
+                                                    on_delivered=functools.partial(self.offsets.finish, [position]))
+            return True
+        except Exception as publish_err:
+            print(f'Issue dead-lettering event {document.get("play_id")}: {publish_err}')
+            return False
+
+    async def _call(self, method, *args, **kwargs):
+        """
+        Run a data manager method on either driver
+        """
+        if self._async_store:
+            return await method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def _write(self, documents:list):
+        """
+        Write documents and return the (document, error) pairs MongoDB rejected.
+        Raises when the write failed as a whole.
+
+        In upsert mode the keyed upserts and the unkeyed inserts are separate bulk
+        writes with their own error handling: duplicate-key errors of one part never
+        keep the other part from being written.
+        """
+        if self.write_mode == "upsert":
+            keyed, unkeyed = [], []
+            for document in documents:
+                has_key = "game_id" in document and document.get("play_id") is not None
+                (keyed if has_key else unkeyed).append(document)
+            rejected = []
+            if keyed:
+                rejected += await self._write_part(self.store.upsert_many_records, keyed)
+            if unkeyed:
+                rejected += await self._write_part(self.store.insert_many_records, unkeyed)
+            return rejected
+
+        return await self._write_part(self.store.insert_many_records, documents)
+
+    async def _write_part(self, method, documents:list):
+        try:
+            with MONGO_WRITE_SECONDS.labels(method.__name__).time():
+                await self._call(method, documents, ordered=False)
+        except BulkWriteError as err:
+            if err.details.get("writeConcernErrors"):
+                raise
+
+            # Documents that already exist were stored by an earlier attempt or a concurrent upsert
+            return [
+                (documents[error["index"]], DocumentRejected(error.get("code"), error.get("errmsg", "")))
+                for error in err.details.get("writeErrors", [])
+                if error.get("code") != DUPLICATE_KEY
+            ]
+        return []
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval / 2)
+            try:
+                if self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval:
+                    await self.flush()
+            except Exception as err:
+                print('Issue flushing events to MongoDB: ', err)
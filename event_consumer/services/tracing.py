@@ -0,0 +1,161 @@
+"""
+Module for end-to-end event latency tracing
+"""
+import json
+import time
+import random
+from collections import deque
+
+from core.codec import INGEST_TS_HEADER, TRACE_ID_HEADER
+from core.metrics import Histogram
+
+# End-to-end latencies range from milliseconds to (under load) minutes
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                 10.0, 30.0, 60.0, 120.0, 300.0)
+STAGE_SECONDS = Histogram(
+    "consumer_event_latency_seconds",
+    "Event latency per stage: broker (API receive to broker append, LogAppendTime topics), "
+    "send (API receive to producer send, CreateTime topics), consume (Kafka timestamp to "
+    "handler), publish (API receive to live viewers), write (handler to stored) and total "
+    "(API receive to stored)",
+    ("stage",),
+    buckets=STAGE_BUCKETS
+)
+
+_TIMESTAMP_NOT_AVAILABLE = 0 # confluent_kafka.TIMESTAMP_NOT_AVAILABLE
+_TIMESTAMP_LOG_APPEND_TIME = 2 # confluent_kafka.TIMESTAMP_LOG_APPEND_TIME
+
+class _Trace:
+    __slots__ = ("trace_id", "position", "ingested", "brokered", "stage", "received", "published", "sampled")
+
+    def __init__(self, trace_id, position, ingested, brokered, stage, received, sampled):
+        self.trace_id = trace_id
+        self.position = position
+        self.ingested = ingested
+        self.brokered = brokered
+        self.stage = stage # "broker" or "send", what the Kafka timestamp marks
+        self.received = received
+        self.published = None
+        self.sampled = sampled
+
+class Tracer:
+    """
+    Follows every event that carries the API's trace headers from the moment its
+    batch reaches the handler until it is stored, and records each stage in the
+    STAGE_SECONDS histogram. A sample of the finished traces is logged and kept in
+    a ring buffer for the /traces route.
+
+    Stages compare wall clocks of different hosts (API, broker, consumer), so they
+    are only as accurate as the hosts' clock sync.
+
+    What the Kafka timestamp marks depends on the topic's message.timestamp.type:
+    with LogAppendTime it is the broker append, recorded as the "broker" stage; with
+    the default CreateTime it is the producer's send, recorded as "send", and the
+    time to the broker ack is then part of "consume". Set LogAppendTime on the
+    topic to see the broker stage.
+    """
+    def __init__(self, sample_rate:float, log_size:int):
+        """
+        params:
+            - sample_rate (float): share of events whose full trace is logged, 0 logs none
+            - log_size (int): sampled traces kept for the /traces route
+        """
+        self.sample_rate = sample_rate
+        self.recent = deque(maxlen=log_size)
+        self._open = {} # (topic, partition, offset) -> _Trace
+
+    @staticmethod
+    def _header(headers, name:str):
+        for key, value in headers:
+            if key == name:
+                return value
+        return None
+
+    def receive(self, messages:list):
+        """
+        Start a trace for every traced message of a polled batch
+        """
+        received = time.time()
+        for message in messages:
+            headers = message.headers()
+            if not headers:
+                continue
+            ingest_ts = self._header(headers, INGEST_TS_HEADER)
+            if ingest_ts is None:
+                continue
+
+            try:
+                ingested = int(ingest_ts) / 1_000_000
+            except ValueError:
+                continue
+
+            brokered = stage = None
+            timestamp_type, timestamp = message.timestamp()
+            if timestamp_type != _TIMESTAMP_NOT_AVAILABLE:
+                brokered = timestamp / 1000
+                stage = "broker" if timestamp_type == _TIMESTAMP_LOG_APPEND_TIME else "send"
+                STAGE_SECONDS.labels(stage).observe(max(0.0, brokered - ingested))
+                STAGE_SECONDS.labels("consume").observe(max(0.0, received - brokered))
+
+            trace_id = self._header(headers, TRACE_ID_HEADER)
+            position = (message.topic(), message.partition(), message.offset())
+            self._open[position] = _Trace(
+                trace_id.decode("utf-8", "replace") if trace_id else None,
+                position, ingested, brokered, stage, received,
+                self.sample_rate > 0 and random.random() < self.sample_rate
+            )
+
+    async def published_events(self, events:list):
+        """
+        Pipeline stage, registered after the live stream hub: the events are now
+        visible to viewers
+        """
+        published = time.time()
+        for position, _ in events:
+            trace = self._open.get(position)
+            if trace is not None:
+                trace.published = published
+                STAGE_SECONDS.labels("publish").observe(max(0.0, published - trace.ingested))
+
+    def stored(self, positions:list):
+        """
+        Finish the traces of events written to MongoDB
+        """
+        stored = time.time()
+        for position in positions:
+            trace = self._open.pop(position, None)
+            if trace is None:
+                continue
+
+            STAGE_SECONDS.labels("write").observe(max(0.0, stored - trace.received))
+            STAGE_SECONDS.labels("total").observe(max(0.0, stored - trace.ingested))
+            if trace.sampled:
+                self._log(trace, stored)
+
+    def discard(self, positions:list):
+        """
+        Drop the traces of events that will not be stored (duplicates, dead-lettered)
+        """
+        for position in positions:
+            self._open.pop(position, None)
+
+    def _log(self, trace:_Trace, stored:float):
+        def ms(start, end):
+            return round((end - start) * 1000, 3) if start is not None and end is not None else None
+
+        entry = {
+            "trace_id": trace.trace_id,
+            "topic": trace.position[0],
+            "partition": trace.position[1],
+            "offset": trace.position[2],
+            f'{trace.stage or "broker"}_ms': ms(trace.ingested, trace.brokered),
+            "consume_ms": ms(trace.brokered, trace.received),
+            "publish_ms": ms(trace.ingested, trace.published),
+            "write_ms": ms(trace.received, stored),
+            "total_ms": ms(trace.ingested, stored)
+        }
+        self.recent.append(entry)
+        print('Event trace: ', json.dumps(entry))
+
+    def open_traces(self):
+        return len(self._open)
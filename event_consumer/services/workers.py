@@ -0,0 +1,70 @@
+"""
+Module for extra consumer worker processes
+"""
+import signal
+import asyncio
+import multiprocessing
+
+async def _run_worker():
+    """
+    Run the consume pipeline without the web app until SIGTERM/SIGINT
+    """
+    from services.consume_messages import ConsumeMessage
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    service = ConsumeMessage()
+    await service.start_service()
+    try:
+        await stop.wait()
+    finally:
+        await service.stop_service()
+
+def run_worker():
+    asyncio.run(_run_worker())
+
+class WorkerProcesses:
+    """
+    Extra consumer processes in the same consumer group. Kafka spreads the topic's
+    partitions over every member. A game is handled by one process, in order, only
+    while its events share a partition, i.e. when the API keys them by game_id
+    (KAFKA_PARTITION_STRATEGY=game, the default). Keyed by play_id, a game's events
+    are spread over every process and only each play is handled in order.
+    """
+    def __init__(self, count:int):
+        """
+        params:
+            - count (int): number of processes to run next to the app's own consumer
+        """
+        self.count = count
+        self.processes = []
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.processes = [
+            context.Process(target=run_worker, name=f'event-consumer-{idx}')
+            for idx in range(self.count)
+        ]
+        for process in self.processes:
+            process.start()
+        print(f'Started {self.count} extra consumer processes')
+
+    def stop(self, timeout:float = 30.0):
+        """
+        Ask every worker to finish its batches and commit, then wait for it to exit
+        """
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate() # SIGTERM - workers shut down gracefully
+
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+        self.processes = []
+
+    def alive(self):
+        return sum(process.is_alive() for process in self.processes)
@@ -0,0 +1,55 @@
+"""
+Runs the API service and the event consumer in one process on the embedded broker
+(core/broker.py) instead of Kafka, for local development and small deployments.
+
+The API is served at / and the consumer routes (health, live streams, queries) under
+/consumer. Events go from POST /event to the consumer through in-process queues
+without being serialized. Set EMBEDDED_LOG_DIR to keep the events on disk, so a
+restart picks up where the consumer left off:
+
+    EMBEDDED_LOG_DIR=./data/broker python single_node.py
+"""
+import os
+import sys
+from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+os.environ["EVENT_TRANSPORT"] = "embedded"
+# The consumer imports its modules from the top level (core, services, api, schemas)
+sys.path.insert(0, os.path.join(ROOT, "event_consumer"))
+
+import core.broker as consumer_broker
+from main import app as consumer_app
+from core.config import settings
+from api_service.core import broker as api_broker
+from api_service.main import app as api_app
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Share one broker between both services, then start the consumer before the API
+    so it is subscribed before the first event arrives
+    """
+    broker = consumer_broker.EmbeddedBroker(
+        partitions=settings.embedded_partitions,
+        log_dir=settings.embedded_log_dir,
+        queue_size=settings.embedded_queue_size,
+        segment_size=settings.embedded_segment_records
+    )
+    consumer_broker.set_broker(broker)
+    api_broker.set_broker(broker)
+    try:
+        async with consumer_app.router.lifespan_context(consumer_app):
+            async with api_app.router.lifespan_context(api_app):
+                yield
+    finally:
+        broker.close()
+
+app = FastAPI(title="Sports Event Microservice (single node)", lifespan=lifespan)
+app.mount("/consumer", consumer_app)
+app.mount("/", api_app)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))